@@ -0,0 +1,47 @@
+""" Apply story update activities with the stream handler at WARNING, the
+    way main sets up logging, and report activities/s.
+
+    python benchmarks/activity_logging.py [activities] [stories] [logger level]
+
+    main used to set the sleuth logger to DEBUG whatever the handler levels,
+    pass DEBUG as the logger level to see what that cost.
+"""
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sleuth import Sleuth, Story, logger  # noqa
+from sleuth import pt_api  # noqa
+from journal_replay import ACTIVITY, STATES  # noqa
+
+
+def main(activity_count=20000, story_count=2000, logger_level='WARNING'):
+    handler = logging.StreamHandler(open(os.devnull, 'w'))
+    handler.setLevel(logging.WARNING)
+    logger.addHandler(handler)
+    logger.setLevel(getattr(logging, logger_level.upper()))
+    activities = [pt_api.objectify(ACTIVITY % {
+        'id': activity_id, 'story_id': activity_id % story_count,
+        'state': STATES[activity_id % len(STATES)],
+        'estimate': activity_id % 8}) for activity_id in range(activity_count)]
+    sleuth = Sleuth([], ['current'], None, 10)
+    sleuth.stories = dict(
+        (story_id, Story(story_id, 1, u'feature', None, 1, u'unstarted',
+                         None, u'The Save Dialog', None, None, None, None,
+                         None, None, None))
+        for story_id in range(story_count))
+    start = time.time()
+    for activity in activities:
+        sleuth.process_activity(activity)
+    seconds = time.time() - start
+    sleuth.close()
+    print('applied %d activities in %.2fs with the logger at %s: '
+          '%.0f activities/s' % (activity_count, seconds, logger_level,
+                                 activity_count / seconds))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]] + sys.argv[3:4])
@@ -0,0 +1,62 @@
+""" Drain a backlog of story update activities, the way a poll after some
+    downtime returns them, one at a time and as a batch, and report
+    activities/s.
+
+    python benchmarks/batch_apply.py [activities] [stories] [logger level]
+"""
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sleuth import Sleuth, Story, logger  # noqa
+from sleuth import pt_api  # noqa
+from journal_replay import ACTIVITY, STATES  # noqa
+
+
+def make_sleuth(story_count):
+    sleuth = Sleuth([], ['current'], None, 10)
+    sleuth.stories = dict(
+        (story_id, Story(story_id, 1, u'feature', None, 1, u'unstarted',
+                         None, u'The Save Dialog', None, None, None, None,
+                         None, None, None))
+        for story_id in range(story_count))
+    return sleuth
+
+
+def main(activity_count=20000, story_count=2000, logger_level='INFO'):
+    handler = logging.StreamHandler(open(os.devnull, 'w'))
+    logger.addHandler(handler)
+    logger.setLevel(getattr(logging, logger_level.upper()))
+    activities = [pt_api.objectify(ACTIVITY % {
+        'id': activity_id, 'story_id': activity_id % story_count,
+        'state': STATES[activity_id % len(STATES)],
+        'estimate': activity_id % 8}) for activity_id in range(activity_count)]
+
+    sleuth = make_sleuth(story_count)
+    start = time.time()
+    for activity in activities:
+        sleuth.process_activity(activity)
+    one_at_a_time = time.time() - start
+    states = dict((story.id, story.current_state)
+                  for story in sleuth.stories.values())
+    sleuth.close()
+
+    sleuth = make_sleuth(story_count)
+    start = time.time()
+    stats = sleuth.process_activities(activities)
+    batch = time.time() - start
+    assert states == dict((story.id, story.current_state)
+                          for story in sleuth.stories.values())
+    sleuth.close()
+
+    print('one at a time: %d activities in %.2fs, %.0f activities/s' %
+          (activity_count, one_at_a_time, activity_count / one_at_a_time))
+    print('batch: %d activities in %.2fs, %.0f activities/s, %d applied' %
+          (activity_count, batch, activity_count / batch, stats.applied))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]] + sys.argv[3:4])
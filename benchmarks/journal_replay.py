@@ -0,0 +1,68 @@
+""" Replay a synthetic activity journal offline, and report activities/s.
+
+    python benchmarks/journal_replay.py [activities] [stories]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sleuth import Sleuth, Story  # noqa
+from sleuth.journal import ActivityJournal  # noqa
+
+ACTIVITY = '''<activity>
+  <id type="integer">%(id)s</id>
+  <event_type>story_update</event_type>
+  <occurred_at type="datetime">2013/08/07 20:33:30 UTC</occurred_at>
+  <author>Dana Deer</author>
+  <project_id type="integer">1</project_id>
+  <description>Dana Deer edited "The Save Dialog %(story_id)s"</description>
+  <stories type="array">
+    <story>
+      <id type="integer">%(story_id)s</id>
+      <current_state>%(state)s</current_state>
+      <estimate type="integer">%(estimate)s</estimate>
+    </story>
+  </stories>
+</activity>'''
+STATES = ['unstarted', 'started', 'finished', 'delivered', 'accepted']
+
+
+def write_journal(directory, activity_count, story_count):
+    activity_journal = ActivityJournal(directory, fsync_every=10000)
+    for activity_id in range(activity_count):
+        activity_journal.append(ACTIVITY % {
+            'id': activity_id, 'story_id': activity_id % story_count,
+            'state': STATES[activity_id % len(STATES)],
+            'estimate': activity_id % 8})
+    activity_journal.close()
+    return activity_journal
+
+
+def main(activity_count=50000, story_count=5000):
+    directory = tempfile.mkdtemp()
+    try:
+        activity_journal = write_journal(directory, activity_count,
+                                         story_count)
+        sleuth = Sleuth([], ['current'], None, 10,
+                        journal=activity_journal)
+        sleuth.stories = dict(
+            (story_id, Story(story_id, 1, u'feature', None, 1, u'unstarted',
+                             None, u'The Save Dialog', None, None, None, None,
+                             None, None, None))
+            for story_id in range(story_count))
+        start = time.time()
+        replayed = sleuth.replay_journal()
+        seconds = time.time() - start
+        sleuth.close()
+        print('replayed %d activities in %.2fs: %.0f activities/s' %
+              (replayed, seconds, replayed / seconds))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,79 @@
+""" Report the peak RSS of loading a large synthetic iterations response,
+    the way sleuth used to (the body decoded to unicode, copied without its
+    encoding declaration and objectified) and with Sleuth.load_stories.
+
+    Each way is run in a process of its own, since the peak RSS of a process
+    never goes down.
+
+    python benchmarks/load_memory.py [stories]
+"""
+import os
+import resource
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sleuth import Sleuth, Story  # noqa
+from sleuth import pt_api  # noqa
+from story_parsing import iterations  # noqa
+
+
+class Response(object):
+
+    status_code = 200
+    headers = {}
+
+    def __init__(self, content):
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+
+class Client(object):
+
+    def __init__(self, content):
+        self.content = content
+
+    def get(self, url, token, headers=None):
+        return Response(self.content)
+
+
+def decoded(client):
+    data = client.get(None, None).text
+    iterationsxml = pt_api.objectify(data.replace(' encoding="UTF-8"', ''))
+    return [Story.create(1, storyxml)
+            for iteration in iterationsxml.iterchildren()
+            for storyxml in iteration.stories.iterchildren()]
+
+
+def load_stories(client):
+    pt_api.set_client(client)
+    sleuth = Sleuth([1], ['current'], None, 10)
+    sleuth.wait_until_ready()
+    sleuth.close()
+    return sleuth.stories
+
+
+def peak_rss(mode, story_count):
+    client = Client(iterations(story_count))
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    stories = globals()[mode](client)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print('%s loaded %d stories, peak RSS grew by %d KB' %
+          (mode, len(stories), after - before))
+
+
+def main(story_count=20000):
+    for mode in ['decoded', 'load_stories']:
+        subprocess.check_call([sys.executable, __file__, mode,
+                               str(story_count)])
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] in [['decoded'], ['load_stories']]:
+        peak_rss(sys.argv[1], int(sys.argv[2]))
+    else:
+        main(*[int(arg) for arg in sys.argv[1:]])
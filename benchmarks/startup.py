@@ -0,0 +1,50 @@
+""" Start sleuth against a tracker that takes a while to return the stories,
+    and report how long until the constructor returns, until an activity is
+    taken in, and until the stories are loaded.
+
+    python benchmarks/startup.py [projects] [seconds per request]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sleuth import Sleuth  # noqa
+from sleuth import pt_api  # noqa
+from journal_replay import ACTIVITY  # noqa
+from load_memory import Response  # noqa
+from story_parsing import iterations  # noqa
+
+
+class SlowClient(object):
+
+    def __init__(self, content, seconds):
+        self.content = content
+        self.seconds = seconds
+
+    def get(self, url, token, headers=None, stream=False):
+        time.sleep(self.seconds)
+        return Response(self.content)
+
+
+def main(project_count=10, seconds=0.5):
+    pt_api.set_client(SlowClient(iterations(200), seconds))
+    start = time.time()
+    sleuth = Sleuth(range(1, project_count + 1), ['current', 'backlog'],
+                    None, 10, poll_workers=4)
+    constructed = time.time() - start
+    sleuth.process_activity(pt_api.objectify(ACTIVITY % {
+        'id': 1, 'story_id': 1, 'state': 'started', 'estimate': 1}))
+    activity = time.time() - start
+    sleuth.wait_until_ready()
+    ready = time.time() - start
+    sleuth.close()
+    print('constructed in %.3fs, first activity taken in %.3fs, '
+          'ready in %.2fs with %d stories' %
+          (constructed, activity, ready, len(sleuth.stories)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]] +
+         [float(arg) for arg in sys.argv[2:3]])
@@ -0,0 +1,69 @@
+""" Build a lot of stories, the way iterparse_stories does, and report the
+    memory they take per story.
+
+    python benchmarks/story_memory.py [stories]
+"""
+import gc
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sleuth import STORY_BUILDER  # noqa
+
+STORY_TYPES = ['feature', 'bug', 'chore', 'release']
+STATES = ['unscheduled', 'unstarted', 'started', 'finished', 'delivered',
+          'accepted']
+LABELS = ['', 'ui', 'ui,dialogs', 'backend', 'backend,api,urgent']
+PEOPLE = ['Dana Deer', 'Rob', 'Alex Fox', 'Sam Hare']
+
+
+def text(value):
+    """ A fresh unicode copy of value, like every parsed field is
+    """
+    return unicode(''.join(list(value)))
+
+
+def build_story(story_id):
+    fields = {'story_type': text(STORY_TYPES[story_id % 4]),
+              'url': text('http://www.pivotaltracker.com/story/show/%s' %
+                          story_id),
+              'estimate': story_id % 8,
+              'current_state': text(STATES[story_id % 6]),
+              'description': text('The Save Dialog %s' % story_id),
+              'name': text('The Save Dialog %s' % story_id),
+              'requested_by': text(PEOPLE[story_id % 4]),
+              'owned_by': text(PEOPLE[(story_id + 1) % 4]),
+              'created_at': text('2009/03/16 16:55:04 UTC'),
+              'labels': text(LABELS[story_id % 5])}
+    notes = tasks = None
+    if story_id % 3 == 0:
+        note = STORY_BUILDER.note(story_id, text('a note'),
+                                  text(PEOPLE[story_id % 4]),
+                                  text('2009/03/16 16:55:04 UTC'))
+        notes = {note.id: note}
+    if story_id % 4 == 0:
+        task = STORY_BUILDER.task(story_id, text('a task'),
+                                  text('2009/03/16 16:55:04 UTC'), 1, False)
+        tasks = {task.id: task}
+    return STORY_BUILDER.story(1, story_id, fields, notes, tasks)
+
+
+def rss_bytes():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def main(story_count=200000):
+    gc.collect()
+    before = rss_bytes()
+    stories = dict((story_id, build_story(story_id))
+                   for story_id in range(story_count))
+    gc.collect()
+    used = rss_bytes() - before
+    print('%d stories take %.1f MB: %d bytes per story' %
+          (len(stories), used / 1024.0 / 1024, used / len(stories)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,68 @@
+""" Parse a synthetic iterations document both ways, objectify and
+    Story.create or the streaming iterparse_stories, and report stories/s.
+
+    python benchmarks/story_parsing.py [stories]
+"""
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sleuth import Story, STORY_BUILDER  # noqa
+from sleuth import pt_api  # noqa
+
+STORY = '''<story>
+  <id type="integer">%(id)s</id>
+  <story_type>feature</story_type>
+  <url>http://www.pivotaltracker.com/story/show/%(id)s</url>
+  <estimate type="integer">%(estimate)s</estimate>
+  <current_state>started</current_state>
+  <description>The Save Dialog %(id)s</description>
+  <name>The Save Dialog %(id)s</name>
+  <requested_by>Dana Deer</requested_by>
+  <owned_by>Rob</owned_by>
+  <created_at type="datetime">2009/03/16 16:55:04 UTC</created_at>
+  <labels>ui,dialogs</labels>
+  <notes type="array">
+    <note><id type="integer">%(id)s</id><text>a note</text><author>Rob</author>
+          <noted_at type="datetime">2009/03/16 16:55:04 UTC</noted_at></note>
+  </notes>
+  <tasks type="array">
+    <task><id type="integer">%(id)s</id><description>a task</description>
+          <position type="integer">1</position><complete type="boolean">false</complete>
+          <created_at type="datetime">2009/03/16 16:55:04 UTC</created_at></task>
+  </tasks>
+</story>'''
+
+
+def iterations(story_count):
+    stories = ''.join(STORY % {'id': story_id, 'estimate': story_id % 8}
+                      for story_id in range(story_count))
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<iterations type="array"><iteration><stories type="array">%s'
+            '</stories></iteration></iterations>' % stories)
+
+
+def objectify(data):
+    return [Story.create(1, story) for iteration in pt_api.objectify(data).iterchildren()
+            for story in iteration.stories.iterchildren()]
+
+
+def iterparse(data):
+    return list(pt_api.iterparse_stories(io.BytesIO(data), 1, STORY_BUILDER))
+
+
+def main(story_count=20000):
+    data = iterations(story_count)
+    for parse in [objectify, iterparse]:
+        start = time.time()
+        stories = parse(data)
+        seconds = time.time() - start
+        print('%s parsed %d stories in %.2fs: %.0f stories/s' %
+              (parse.__name__, len(stories), seconds, len(stories) / seconds))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
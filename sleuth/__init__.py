@@ -1,5 +1,9 @@
-from threading import Lock
+from threading import Lock, RLock
+import collections
+import copy
 import datetime
+import heapq
+import itertools
 import logging
 import operator
 import sys
@@ -9,26 +13,88 @@ import time
 import argparse
 from futures import ThreadPoolExecutor
 
+from aggregates import PointAggregates
+from audit import AuditLog
+from changes import ChangeFeed
+from dedup import RecentActivities
+from indexes import StoryIndexes, TimeIndex
+from interning import intern_text
+from journal import ActivityJournal
+from locking import StripedLock
+from observers import TouchedStories
+from polling import AdaptivePoller
+from scheduler import Scheduler
+from webhook import ActivityListener
+import interning
+import journal
 import pt_api
+import snapshot
 
 
 logger = logging.getLogger(__name__)
 
+# The activities come from the v4 api only, which has the task events the
+# v3 one lacks. The watermarks are kept per project and api version.
+ACTIVITIES_VERSION = 'v4'
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError('%s is shared between stories, and read only' %
+                    type(self).__name__)
+
+
+class _EmptyDict(dict):
+    """ The notes or tasks of every story that has none
+    """
+
+    __setitem__ = __delitem__ = setdefault = update = popitem = _read_only
+
+    def __reduce__(self):
+        return 'EMPTY_DICT'
+
+
+class _EmptyList(list):
+    """ The labels of every story that has none
+    """
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = remove = pop = sort = reverse = _read_only
+
+    def __reduce__(self):
+        return 'EMPTY_LIST'
+
+
+EMPTY_DICT = _EmptyDict()
+EMPTY_LIST = _EmptyList()
+
+
+def _split_labels(labels):
+    if not labels:
+        return EMPTY_LIST
+    return [intern_text(label) for label in unicode(labels).split(',')]
+
 
 class Note(object):
     """Represent a note for a story"""
 
+    __slots__ = ('id', 'text', 'author', 'noted_at')
+
     def __init__(self, note_id, text, author, noted_at):
         self.id = int(note_id)
         self.text = unicode(text)
-        self.author = unicode(author)
+        self.author = intern_text(unicode(author))
         self.noted_at = unicode(noted_at)
 
+    def content(self):
+        return tuple(getattr(self, attribute) for attribute in self.__slots__)
+
 
 class Task(object):
     """ Represent a task for a story
     """
 
+    __slots__ = ('id', 'description', 'position', 'complete', 'created_at')
+
     def __init__(self, task_id, description, created_at,
                  position=-1, complete=False):
         self.id = int(task_id)
@@ -38,69 +104,124 @@ class Task(object):
         self.created_at = unicode(created_at)
 
     def update(self, taskxml):
+        """ Update the task from the task xml, return the list of
+            (attribute, old value, new value) changes
+        """
+        changes = []
         if hasattr(taskxml, 'description'):
-            logger.info("Changed task description from %s to %s" %
-                        (self.description, taskxml.description))
-            self.description = unicode(taskxml.description)
+            logger.info("Changed task description from %s to %s",
+                        self.description, taskxml.description)
+            changes.append(('description', self.description,
+                            unicode(taskxml.description)))
         if hasattr(taskxml, 'complete'):
-            logger.info("Changed task completion from %s to %s"
-                        % (self.complete, taskxml.complete))
-            self.complete = taskxml.complete
+            logger.info("Changed task completion from %s to %s",
+                        self.complete, taskxml.complete)
+            changes.append(('complete', self.complete, taskxml.complete))
         if hasattr(taskxml, 'position'):
-            logger.info("Changed task position from %s to %s"
-                        % (self.position, taskxml.position))
-            self.position = int(taskxml.position)
+            logger.info("Changed task position from %s to %s",
+                        self.position, taskxml.position)
+            changes.append(('position', self.position,
+                            int(taskxml.position)))
+        changes = [(attribute, old_value, new_value)
+                   for attribute, old_value, new_value in changes
+                   if new_value != old_value]
+        for attribute, _, new_value in changes:
+            setattr(self, attribute, new_value)
+        return changes
+
+    def content(self):
+        return tuple(getattr(self, attribute) for attribute in self.__slots__)
+
+    def reconcile_from(self, task):
+        """ Make the task the same as task, a fresh copy of it from the
+            tracker, return the list of (attribute, old value, new value)
+            changes
+        """
+        changes = []
+        for attribute in self.__slots__[1:]:
+            old_value = getattr(self, attribute)
+            new_value = getattr(task, attribute)
+            if new_value != old_value:
+                setattr(self, attribute, new_value)
+                changes.append((attribute, old_value, new_value))
+        return changes
 
 
 class Story(object):
     """ The class represents a Pivotal Tracker User Story
+
+        Stories without labels, notes or tasks share EMPTY_LIST and
+        EMPTY_DICT, add notes and tasks with add_note and add_task.
     """
 
+    __slots__ = ('id', 'project_id', 'story_type', 'url', 'estimate',
+                 'current_state', 'description', 'name', 'requested_by',
+                 'owned_by', 'created_at', 'accepted_at', 'labels', 'notes',
+                 'tasks')
+
+    # The values of these attributes are interned
+    INTERNED = frozenset(['story_type', 'current_state', 'requested_by',
+                          'owned_by'])
+
+    # The attributes that say what the story is, but for the labels, notes
+    # and tasks
+    CONTENT = ('project_id', 'story_type', 'url', 'estimate', 'current_state',
+               'description', 'name', 'requested_by', 'owned_by',
+               'created_at', 'accepted_at')
+
     DELIVERED = 'delivered'
     UNSCHEDULED = 'unscheduled'
     RELEASE = 'release'
     ACCEPTED = 'accepted'
 
+    # The attributes get_data_from_story_xml reads, with their types
+    FIELD_TYPES = {'story_type': unicode, 'url': unicode, 'estimate': int,
+                   'current_state': unicode, 'description': unicode,
+                   'name': unicode, 'requested_by': unicode,
+                   'owned_by': unicode, 'created_at': unicode,
+                   'accepted_at': unicode, 'labels': unicode}
+
     @staticmethod
     def get_data_from_story_xml(storyxml):
-        data = {}
-        for attribute, attr_type in [('story_type', unicode), ('url', unicode),
-                                     ('estimate', int),
-                                     ('current_state', unicode),
-                                     ('description', unicode),
-                                     ('name', unicode),
-                                     ('requested_by', unicode),
-                                     ('owned_by', unicode),
-                                     ('created_at', unicode),
-                                     ('accepted_at', unicode),
-                                     ('labels', unicode)]:
-            data[attribute] = getattr(storyxml, attribute, None)
-            if data[attribute] is not None:
-                data[attribute] = attr_type(data[attribute])
-
-        notes = {}
-        if hasattr(storyxml, 'notes'):
-            for notexml in storyxml.notes.iterchildren():
+        # The children are read in one pass: looking up a child that is not
+        # there, as most are not in an activity, is slow with objectify
+        data = dict.fromkeys(Story.FIELD_TYPES)
+        notesxml = tasksxml = None
+        for child in storyxml.iterchildren():
+            tag = child.tag
+            attr_type = Story.FIELD_TYPES.get(tag)
+            if attr_type is not None:
+                if data[tag] is None:
+                    value = attr_type(child)
+                    if tag in Story.INTERNED:
+                        value = intern_text(value)
+                    data[tag] = value
+            elif tag == 'notes':
+                notesxml = notesxml if notesxml is not None else child
+            elif tag == 'tasks':
+                tasksxml = tasksxml if tasksxml is not None else child
+
+        notes = None
+        if notesxml is not None:
+            notes = {}
+            for notexml in notesxml.iterchildren():
                 note = Note(int(notexml.id),
                             unicode(notexml['text'].text),
                             unicode(notexml.author),
                             unicode(notexml.noted_at))
                 notes[note.id] = note
-        else:
-            notes = None
         data['notes'] = notes
 
-        tasks = {}
-        if hasattr(storyxml, 'tasks'):
-            for taskxml in storyxml.tasks.iterchildren():
+        tasks = None
+        if tasksxml is not None:
+            tasks = {}
+            for taskxml in tasksxml.iterchildren():
                 task = Task(int(taskxml.id),
                             unicode(taskxml.description),
                             unicode(taskxml.created_at),
                             position=int(taskxml.position),
                             complete=taskxml.complete)
                 tasks[task.id] = task
-        else:
-            tasks = None
         data['tasks'] = tasks
         return data
 
@@ -114,33 +235,35 @@ class Story(object):
                      data['tasks'], data['created_at'], data['accepted_at'],
                      data['labels'])
 
+    @staticmethod
+    def from_fields(project_id, story_id, fields, notes, tasks):
+        """ Build a story from the fields pt_api.iterparse_stories parsed
+        """
+        get = fields.get
+        return Story(story_id, project_id, get('story_type'), get('url'),
+                     get('estimate'), get('current_state'),
+                     get('description'), get('name'), get('requested_by'),
+                     get('owned_by'), notes, tasks, get('created_at'),
+                     get('accepted_at'), get('labels'))
+
     def __init__(self, story_id, project_id, story_type, url, estimate,
                  current_state, description, name, requested_by, owned_by,
                  notes, tasks, created_at, accepted_at, labels):
         self.id = story_id
         self.project_id = project_id
-        self.story_type = story_type
+        self.story_type = intern_text(story_type)
         self.url = url
         self.estimate = estimate
-        self.current_state = current_state
+        self.current_state = intern_text(current_state)
         self.description = description
         self.name = name
-        self.requested_by = requested_by
-        self.owned_by = owned_by
+        self.requested_by = intern_text(requested_by)
+        self.owned_by = intern_text(owned_by)
         self.created_at = created_at
         self.accepted_at = accepted_at
-        if labels is None:
-            self.labels = []
-        else:
-            self.labels = unicode(labels).split(',')
-        if notes is None:
-            self.notes = {}
-        else:
-            self.notes = notes
-        if tasks is None:
-            self.tasks = {}
-        else:
-            self.tasks = tasks
+        self.labels = _split_labels(labels)
+        self.notes = notes or EMPTY_DICT
+        self.tasks = tasks or EMPTY_DICT
 
     def __str__(self):
         return """
@@ -154,27 +277,98 @@ class Story(object):
             self.id, self.name, self.story_type, self.current_state, self.accepted_at, self.labels
         )
 
+    def copy(self):
+        """ Return a copy of the story, that shares nothing mutable with it
+        """
+        story = copy.copy(self)
+        if self.labels:
+            story.labels = list(self.labels)
+        if self.notes:
+            story.notes = dict(self.notes)
+        if self.tasks:
+            story.tasks = dict((task_id, copy.copy(task))
+                               for task_id, task in self.tasks.items())
+        return story
+
+    def fingerprint(self):
+        """ Return a hash of the content of the story, its notes and tasks,
+            that is the same for stories that are the same
+        """
+        return hash((tuple(getattr(self, attribute)
+                           for attribute in self.CONTENT),
+                     tuple(self.labels),
+                     tuple(sorted(note.content()
+                                  for note in self.notes.values())),
+                     tuple(sorted(task.content()
+                                  for task in self.tasks.values()))))
+
+    def reconcile_from(self, story):
+        """ Make the attributes of the story the same as those of story, a
+            fresh copy of it from the tracker, return the list of
+            (attribute, old value, new value) changes. Unlike update, this
+            clears the attributes story does not have.
+        """
+        changes = []
+        for attribute in self.CONTENT + ('labels',):
+            old_value = getattr(self, attribute)
+            new_value = getattr(story, attribute)
+            if new_value != old_value:
+                setattr(self, attribute, new_value)
+                changes.append((attribute, old_value, new_value))
+        return changes
+
+    def add_note(self, note):
+        """ Add the note, return False if the story already has it
+        """
+        if note.id in self.notes:
+            return False
+        if not self.notes:
+            self.notes = {}
+        self.notes[note.id] = note
+        return True
+
+    def add_task(self, task):
+        """ Add the task, return False if the story already has it
+        """
+        if task.id in self.tasks:
+            return False
+        if not self.tasks:
+            self.tasks = {}
+        self.tasks[task.id] = task
+        return True
+
     def update(self, activity, storyxml):
+        """ Update the story from the story xml of the activity, return the
+            list of (attribute, old value, new value) changes
+        """
+        changes = []
 
         # Update story attributes
         data = Story.get_data_from_story_xml(storyxml)
         for attribute, new_value in data.items():
             if attribute == 'labels' and new_value is not None:
-                new_value = new_value.split(',')
+                new_value = _split_labels(new_value)
             oldValue = getattr(self, attribute)
             if new_value is not None and new_value != oldValue:
-                logger.info("Changed story %s from %s to %s" %
-                            (attribute, oldValue, new_value))
+                logger.info("Changed story %s from %s to %s",
+                            attribute, oldValue, new_value)
                 setattr(self, attribute, new_value)
-                logger.info(str(self))
+                changes.append((attribute, oldValue, new_value))
 
         # Update the project_id if needed
         project_id = activity.project_id
         if self.project_id != project_id:
-            logger.info('Changed story project_id changed from %s to %s' %
-                        (self.project_id, project_id))
+            logger.info('Changed story project_id changed from %s to %s',
+                        self.project_id, project_id)
+            changes.append(('project_id', self.project_id, project_id))
             self.project_id = project_id
-            logger.info(str(self))
+        if changes:
+            # formatted by the handlers, only if they log it
+            logger.debug('%s', self)
+        return changes
+
+
+STORY_BUILDER = pt_api.StoryBuilder(Story.from_fields, Note, Task)
 
 
 def _flatten_list(alist):
@@ -186,27 +380,185 @@ def _flatten_list(alist):
     return return_list
 
 
+def _merge_by_occurred_at(streams):
+    """ Merge lists of activities, each sorted by occurred_at, into one
+        iterator sorted by occurred_at. Ties keep the order of the streams.
+    """
+    decorated = [[(activity.occurred_at, stream_index, position, activity)
+                  for position, activity in enumerate(stream)]
+                 for stream_index, stream in enumerate(streams)]
+    for _, _, _, activity in heapq.merge(*decorated):
+        yield activity
+
+
+def _activity_story_ids(activity):
+    """ Return the ids of the stories of the activity, or None if they can
+        not be told
+    """
+    try:
+        return [int(storyxml.id)
+                for storyxml in activity.stories.iterchildren()]
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _merge_story_updates(activities):
+    """ Return a copy of the last of the story_updates of a story, with the
+        fields it does not have from the latest of the others that has them
+    """
+    merged = copy.deepcopy(activities[-1])
+    storyxml = next(merged.stories.iterchildren())
+    tags = set(fieldxml.tag for fieldxml in storyxml.iterchildren())
+    for activity in reversed(activities[:-1]):
+        for fieldxml in next(activity.stories.iterchildren()).iterchildren():
+            if fieldxml.tag not in tags:
+                tags.add(fieldxml.tag)
+                storyxml.append(copy.deepcopy(fieldxml))
+    return merged
+
+
+# What Sleuth.process_activities did with a batch: how many activities it
+# received, how many of them were put aside until their project is loaded,
+# how many were repeats, how many were merged into a later story_update,
+# how many were applied, how many seconds it all took and how many failed
+BatchStats = collections.namedtuple('BatchStats', ['received', 'buffered',
+                                                   'repeats', 'coalesced',
+                                                   'applied', 'seconds',
+                                                   'failed'])
+
+
+# What Sleuth.reconcile_project did to the stories of a project: how many it
+# fetched, added, changed, removed and found unchanged, how many it left
+# alone because activities changed them while it was fetching, and how
+# many seconds it all took
+ReconcileStats = collections.namedtuple('ReconcileStats', [
+    'project_id', 'fetched', 'added', 'changed', 'removed', 'unchanged',
+    'skipped', 'seconds'])
+
+
+class ProjectLoad(object):
+    """ How far the loading of the stories of a project has got, and the
+        activities that came for it in the meantime
+    """
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.loaded = 0
+        self.failed = 0
+        self.ready = False
+        # (activity, record) pairs, in the order they came
+        self.buffered = []
+
+
 class Sleuth(object):
     """ This class receives the activity xml parsed from the web app,
         and updates all the data
     """
-    def __init__(self, project_ids, track_blocks, token, overlap_seconds):
+    def __init__(self, project_ids, track_blocks, token, overlap_seconds,
+                 poll_workers=10, snapshot_path=None,
+                 snapshot_max_age=datetime.timedelta(hours=6), journal=None):
         self._last_updated = {}
-        self.processed_activities = []
+        self.processed_activities = RecentActivities()
         self.overlap_seconds = overlap_seconds
-        self.project_ids = project_ids
+        self.poll_workers = poll_workers
+        self.project_ids = list(project_ids)
         new_last_updated = datetime.datetime.utcnow()
         for project_id in self.project_ids:
-            self._set_last_updated(new_last_updated, project_id, 'v3')
-            self._set_last_updated(new_last_updated, project_id, 'v4')
+            self._set_last_updated(new_last_updated, project_id,
+                                   ACTIVITIES_VERSION)
         self.token = token
+        # Every api request sleuth makes, loading or polling, shares this
+        self.executor = ThreadPoolExecutor(max_workers=poll_workers)
         self.track_blocks = track_blocks
         self.stories = {}
-        self.update_lock = Lock()
-        self.load_stories_thread = threading.Thread(target=self.load_stories())
+        # structure_lock guards which stories there are, the story locks
+        # guard the contents of the stories. Take them in that order.
+        self.structure_lock = RLock()
+        self.story_locks = StripedLock()
+        self.processed_activities_lock = Lock()
+        # The ids in processed_activities whose activities are still being
+        # applied, guarded by processed_activities_lock too
+        self._applying_activity_ids = set()
+        self.handlers = dict((event_type, getattr(self, method_name))
+                             for event_type, method_name
+                             in self.EVENT_HANDLERS.items())
+        self._event_timings = {}
+        self._event_timings_lock = Lock()
+        self._reconcile_turn = -1
+        # The stories reconcile found outside the tracked blocks, that are
+        # not looked up again, saved in the snapshots too
+        self._kept_story_ids = set()
+        # Set once the stories of all the projects are loaded. Until a
+        # project is, its activities are buffered, see load_stories.
+        self.ready = threading.Event()
+        self._project_loads = {}
+        self._loading = {}
+        self._loading_lock = Lock()
+        # The projects some of whose blocks failed to load, until they are
+        # reconciled. Snapshots leave them out, so they are loaded again.
+        self._incomplete_project_ids = set()
+        self.snapshot_path = snapshot_path
+        self.snapshot_max_age = snapshot_max_age
+        self.journal = journal
+        self.observers = []
+        self.indexes = StoryIndexes()
+        self.add_observer(self.indexes)
+        self.time_index = TimeIndex()
+        self.add_observer(self.time_index)
+        self.aggregates = PointAggregates()
+        self.add_observer(self.aggregates)
+        # Subscribe to it for the changes, see changes.ChangeFeed
+        self.changes = ChangeFeed()
+        self.add_observer(self.changes)
+        if snapshot_path is not None and self.restore_snapshot():
+            return
+        self._start_background_load(self.project_ids)
+
+    def _start_background_load(self, project_ids, set_ready=True):
+        """ Load the stories of the projects in a daemon thread, and unless
+            set_ready is False set ready once they are loaded
+        """
+        # Buffering starts now, so no activity slips in before the thread
+        # gets going
+        project_loads = self._start_loading(project_ids)
+        self.load_stories_thread = threading.Thread(
+            target=self._load_in_background, args=(project_loads, set_ready))
         self.load_stories_thread.daemon = True
         self.load_stories_thread.start()
-        self.load_stories_thread.join()
+
+    def _load_in_background(self, project_loads, set_ready):
+        start = time.time()
+        try:
+            self._load_stories(project_loads)
+        except Exception:
+            logger.exception('Problem loading the stories')
+        finally:
+            if set_ready:
+                self.ready.set()
+        logger.info('Loaded %s in %.3fs', project_loads.keys(),
+                    time.time() - start)
+
+    def wait_until_ready(self, timeout=None):
+        """ Wait until the stories of all the projects are loaded, at most
+            timeout seconds, return whether they are
+        """
+        return self.ready.wait(timeout)
+
+    def is_loaded(self, project_id):
+        return project_id not in self._loading
+
+    def load_progress(self):
+        """ Return how far the loading of each project has got
+        """
+        with self._loading_lock:
+            return dict((project_id,
+                         {'blocks': project_load.blocks,
+                          'loaded': project_load.loaded,
+                          'failed': project_load.failed,
+                          'buffered': len(project_load.buffered),
+                          'ready': project_load.ready})
+                        for project_id, project_load
+                        in self._project_loads.items())
 
     def _set_last_updated(self, new_last_updated, project_id, version):
         self._last_updated['%s-%s' % (project_id, version)] = new_last_updated
@@ -214,242 +566,946 @@ class Sleuth(object):
     def _get_last_updated(self, project_id, version):
         return self._last_updated['%s-%s' % (project_id, version)]
 
-    def load_stories(self):
-        """ Reload the stories from the trackers
-        """
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            with self.update_lock:
-                results = {}
-                for project_id in self.project_ids:
-                    for track_block in self.track_blocks:
-                        project_block = "%s-%s" % (project_id, track_block)
-                        stories = executor.submit(pt_api.get_stories,
-                                                  project_id, track_block,
-                                                  self.token, Story.create)
-                        results[project_block] = stories
-                        # results[project_block] = pt_api.get_stories(
-                        #     project_id, track_block, self.token, Story.create
-                        # )
-
-                for result_id, result in results.items():
-                    self.stories.update(dict([(story.id, story)
-                                              for story
-                                              in _flatten_list(result.result())]))
-                    logger.info('Loaded stories %s' % result_id)
+    def add_observer(self, observer):
+        """ Tell the StoryObserver observer about every change to the
+            stories from now on, starting with the stories there are
+        """
+        with self.structure_lock:
+            observer.stories_reset(self.stories)
+            # Replaced, never changed in place, as _notify goes through it
+            # holding only a story lock
+            self.observers = self.observers + [observer]
+
+    def remove_observer(self, observer):
+        with self.structure_lock:
+            self.observers = [other for other in self.observers
+                              if other is not observer]
+
+    def _notify(self, event, *args):
+        for observer in self.observers:
+            try:
+                getattr(observer, event)(*args)
+            except Exception:
+                logger.exception('Problem telling %r about %s' %
+                                 (observer, event))
+
+    def _set_stories(self, stories):
+        with self.structure_lock:
+            self.stories = stories
+            self._notify('stories_reset', stories)
+
+    def _add_stories(self, stories):
+        """ Add the stories, replacing the ones with the same ids
+        """
+        with self.structure_lock:
+            for story in stories:
+                old_story = self.stories.get(story.id)
+                if old_story is not None:
+                    self._notify('story_removed', old_story)
+                self.stories[story.id] = story
+                self._notify('story_added', story)
+
+    def query(self, **criteria):
+        """ Return the stories that match all the criteria, looked up in the
+            indexes, eg query(project_id=1, owned_by=u'Rob', label=u'ui').
+            See StoryIndexes.FIELDS for the attributes there are indexes of.
+        """
+        return self._stories_by_id(self.indexes.query(**criteria))
+
+    def _stories_by_id(self, story_ids):
+        with self.structure_lock:
+            return [self.stories[story_id] for story_id in story_ids
+                    if story_id in self.stories]
+
+    def stories_between(self, field, start=None, end=None):
+        """ Return the stories with a field (accepted_at or created_at)
+            timestamp from start up to end, in time order. start and end are
+            epoch seconds or utc datetimes.
+        """
+        return self._stories_by_id(self.time_index.between(field, start, end))
+
+    def latest_stories(self, field, count):
+        """ Return the count stories with the latest field timestamps, eg
+            latest_stories('accepted_at', 10), latest first
+        """
+        return self._stories_by_id(self.time_index.latest(field, count))
+
+    def check_aggregates(self):
+        """ Recompute the aggregates from the stories, log and return any
+            drift, see PointAggregates.check
+        """
+        with self.structure_lock:
+            with self.story_locks.all():
+                drift = self.aggregates.check(self.stories)
+        if drift:
+            logger.warning('The aggregates had drifted, corrected %s' %
+                           drift)
+        return drift
+
+    def reconcile_project(self, project_id):
+        """ Bring the stories of the project in line with the tracker,
+            return its ReconcileStats.
+
+            The stories are fetched like load_stories does, and told apart
+            from the ones sleuth has by their fingerprints. Only the new
+            stories are added and the changed ones are changed in place,
+            each with only its own lock held. A story no longer in the
+            tracked blocks is looked up, and only removed if the tracker no
+            longer has it: an accepted story leaves the current block when
+            its iteration is done. Such a story is kept, and not looked up
+            again. The stories activities change while they are being
+            fetched are left alone, as the fetched copy may be older.
+        """
+        start = time.time()
+        touched = TouchedStories()
+        self.add_observer(touched)
+        try:
+            results = [pt_api.get_stories_async(
+                project_id, track_block, self.token, Story.create,
+                story_builder=STORY_BUILDER, executor=self.executor)
+                for track_block in self.track_blocks]
+            fetched = {}
+            for result in results:
+                for story in _flatten_list(result.result()):
+                    fetched[story.id] = story
+            counts = self._reconcile(project_id, fetched, touched)
+        finally:
+            self.remove_observer(touched)
+        # Every block was fetched, so the project is whole again
+        self._incomplete_project_ids.discard(project_id)
+        stats = ReconcileStats(project_id, len(fetched), *counts,
+                               seconds=time.time() - start)
+        logger.info('Reconciled project %s: %s fetched, %s added, %s '
+                    'changed, %s removed, %s unchanged, %s skipped in '
+                    '%.3fs', *stats)
+        return stats
+
+    def _reconcile(self, project_id, fetched, touched):
+        counts = collections.Counter()
+        self._kept_story_ids.difference_update(fetched)
+        for story_id, fetched_story in fetched.items():
+            with self.structure_lock:
+                story = self.stories.get(story_id)
+                if story is None and story_id not in touched:
+                    self.stories[story_id] = fetched_story
+                    self._notify('story_added', fetched_story)
+                    counts['added'] += 1
+                    continue
+            if story is None:
+                counts['skipped'] += 1
+                continue
+            counts[self._reconcile_fetched(story, fetched_story, touched)] += 1
+
+        # Looked up all at once, the tracked blocks do not say whether a
+        # story missing from them was deleted
+        lookups = [(story, pt_api.get_story_async(
+            project_id, story.id, self.token, STORY_BUILDER,
+            executor=self.executor))
+            for story in self.query(project_id=project_id)
+            if story.id not in fetched and
+            story.id not in self._kept_story_ids]
+        for story, lookup in lookups:
+            try:
+                found = lookup.result()
+            except Exception:
+                logger.exception('Problem looking up story %s' % story.id)
+                counts['skipped'] += 1
+                continue
+            if found is not None:
+                self._kept_story_ids.add(story.id)
+                counts[self._reconcile_fetched(story, found, touched)] += 1
+                continue
+            with self.structure_lock:
+                with self.story_locks(story.id):
+                    if story.id in touched:
+                        counts['skipped'] += 1
+                    elif self.stories.pop(story.id, None) is not None:
+                        self._notify('story_removed', story)
+                        counts['removed'] += 1
+        return tuple(counts[count] for count in
+                     ['added', 'changed', 'removed', 'unchanged', 'skipped'])
+
+    def _reconcile_fetched(self, story, fetched_story, touched):
+        """ Reconcile the story with fetched_story, return whether it was
+            skipped, unchanged or changed
+        """
+        with self.story_locks(story.id):
+            if story.id in touched or not self._is_tracked(story):
+                return 'skipped'
+            if story.fingerprint() == fetched_story.fingerprint():
+                return 'unchanged'
+            self._reconcile_story(story, fetched_story)
+            return 'changed'
+
+    def _reconcile_story(self, story, fetched_story):
+        """ Change the story in place to be the same as fetched_story, with
+            the story lock held
+        """
+        changes = story.reconcile_from(fetched_story)
+        if changes:
+            self._notify('story_changed', story, changes)
+        for note_id, note in story.notes.items():
+            fetched_note = fetched_story.notes.get(note_id)
+            if (fetched_note is None or
+                    note.content() != fetched_note.content()):
+                del story.notes[note_id]
+                self._notify('note_removed', story, note)
+        for note_id, note in fetched_story.notes.items():
+            if story.add_note(note):
+                self._notify('note_added', story, note)
+        for task_id, task in story.tasks.items():
+            if task_id not in fetched_story.tasks:
+                del story.tasks[task_id]
+                self._notify('task_removed', story, task)
+        for task_id, fetched_task in fetched_story.tasks.items():
+            task = story.tasks.get(task_id)
+            if task is None:
+                story.add_task(fetched_task)
+                self._notify('task_added', story, fetched_task)
+            else:
+                changes = task.reconcile_from(fetched_task)
+                if changes:
+                    self._notify('task_changed', story, task, changes)
+
+    def reconcile_next(self):
+        """ Reconcile the next project, in turn, see reconcile_project. Run
+            every so often, this reconciles all of them in a rolling way.
+        """
+        project_ids = self.project_ids
+        if not project_ids or not self.ready.is_set():
+            return None
+        self._reconcile_turn = (self._reconcile_turn + 1) % len(project_ids)
+        return self.reconcile_project(project_ids[self._reconcile_turn])
+
+    def _start_loading(self, project_ids):
+        """ Start buffering the activities of the projects, return their
+            ProjectLoads by project id, in order
+        """
+        project_loads = collections.OrderedDict()
+        with self._loading_lock:
+            for project_id in project_ids:
+                if project_id not in self._loading:
+                    project_load = ProjectLoad(len(self.track_blocks))
+                    self._project_loads[project_id] = project_load
+                    self._loading[project_id] = project_load
+                project_loads[project_id] = self._loading[project_id]
+        return project_loads
+
+    def _buffer_activities(self, activities, record):
+        """ Put aside the activities of the projects that are loading, in
+            order, return the others
+        """
+        # Once everything is loaded this is all it costs
+        if not self._loading:
+            return activities
+        others = []
+        with self._loading_lock:
+            for activity in activities:
+                project_load = self._loading.get(
+                    getattr(activity, 'project_id', None))
+                if project_load is None:
+                    others.append(activity)
+                else:
+                    project_load.buffered.append((activity, record))
+        return others
+
+    def _project_loaded(self, project_id):
+        """ Apply the activities buffered while the project was loading,
+            and stop buffering them
+        """
+        # More can come while the buffered ones are applied, so the project
+        # only stops buffering once there are none left
+        while True:
+            with self._loading_lock:
+                project_load = self._loading.get(project_id)
+                if project_load is None:
+                    # removed meanwhile, along with what was buffered
+                    return
+                buffered, project_load.buffered = project_load.buffered, []
+                if not buffered:
+                    project_load.ready = True
+                    del self._loading[project_id]
+                    return
+            logger.info('Applying %s activities of %s that came while it '
+                        'was loading', len(buffered), project_id)
+            for record, group in itertools.groupby(buffered,
+                                                   operator.itemgetter(1)):
+                self._process_activities([activity for activity, _ in group],
+                                         record, 0)
+
+    def load_stories(self, project_ids=None):
+        """ Reload the stories from the trackers, of all the projects or
+            only of project_ids
+
+            The activities of a project are buffered until its stories are
+            loaded, and then applied in the order they came. A block that
+            fails to load is logged and left to reconcile_project. The
+            stories of a project removed while it loads are not added.
+        """
+        if project_ids is None:
+            project_ids = list(self.project_ids)
+        self._load_stories(self._start_loading(project_ids))
+
+    def _load_stories(self, project_loads):
+        results = []
+        for project_id in project_loads:
+            for track_block in self.track_blocks:
+                results.append((project_id, track_block,
+                                pt_api.get_stories_async(
+                                    project_id, track_block, self.token,
+                                    Story.create, story_builder=STORY_BUILDER,
+                                    executor=self.executor)))
+
+        for project_id, track_block, result in results:
+            project_load = project_loads[project_id]
+            try:
+                stories = _flatten_list(result.result())
+                with self.structure_lock:
+                    # remove_project stops the loading before it takes
+                    # this lock to remove the stories
+                    if self._loading.get(project_id) is project_load:
+                        self._add_stories(stories)
+            except Exception:
+                logger.exception('Problem loading stories %s-%s' %
+                                 (project_id, track_block))
+                project_load.failed += 1
+            else:
+                logger.info('Loaded stories %s-%s' % (project_id, track_block))
+                project_load.loaded += 1
+            if project_load.loaded + project_load.failed == project_load.blocks:
+                with self._loading_lock:
+                    if self._loading.get(project_id) is not project_load:
+                        continue
+                    if project_load.failed:
+                        self._incomplete_project_ids.add(project_id)
+                    else:
+                        self._incomplete_project_ids.discard(project_id)
+                self._project_loaded(project_id)
         logger.info('Stories are loaded')
+        logger.info('Response cache: %s' % pt_api.response_cache.stats())
+        logger.info('Interned values: %s' % interning.stats())
+
+    def add_project(self, project_id):
+        """ Start tracking the project, and load its stories in the
+            background. Its activities are buffered until they are loaded,
+            see load_stories.
+        """
+        if project_id in self.project_ids:
+            return
+        new_last_updated = datetime.datetime.utcnow()
+        self._set_last_updated(new_last_updated, project_id,
+                               ACTIVITIES_VERSION)
+        self._start_background_load([project_id], set_ready=False)
+        self.project_ids = self.project_ids + [project_id]
+        logger.info('Added project %s' % project_id)
+
+    def remove_project(self, project_id):
+        """ Stop tracking the project, stop loading it, and forget its
+            stories
+        """
+        if project_id not in self.project_ids:
+            return
+        self.project_ids = [an_id for an_id in self.project_ids
+                            if an_id != project_id]
+        self._last_updated.pop('%s-%s' % (project_id, ACTIVITIES_VERSION),
+                               None)
+        with self._loading_lock:
+            self._loading.pop(project_id, None)
+            self._project_loads.pop(project_id, None)
+            self._incomplete_project_ids.discard(project_id)
+        with self.structure_lock:
+            for story_id, story in self.stories.items():
+                with self.story_locks(story_id):
+                    if story.project_id != project_id:
+                        continue
+                    del self.stories[story_id]
+                    self._kept_story_ids.discard(story_id)
+                    self._notify('story_removed', story)
+        logger.info('Removed project %s' % project_id)
+
+    def close(self):
+        """ Wait for the api requests in flight, and stop the workers
+        """
+        self.executor.shutdown(wait=True)
+
+    def save_snapshot(self):
+        """ Write the stories, the watermarks and the recent activities to
+            snapshot_path
+        """
+        # A snapshot of half loaded stories would be restored as if whole
+        if not self.ready.is_set():
+            logger.info('Not saving a snapshot, the stories are loading')
+            return
+        # The watermarks and journal position are copied before the
+        # stories, so the activities applied in between are asked for, or
+        # replayed, again after a restore
+        last_updated = dict(self._last_updated)
+        journal_position = None
+        if self.journal is not None:
+            journal_position = self.journal.position()
+        with self.processed_activities_lock:
+            processed_activities = self.processed_activities.copy()
+            # Their changes may be missing from the stories copied below,
+            # so they are applied again after a restore
+            processed_activities.discard(self._applying_activity_ids)
+        # A project that did not load whole, or that was added and is still
+        # loading, is loaded again after a restore, as if it were new
+        snapshot.save(self.snapshot_path, {
+            'project_ids': [project_id for project_id in self.project_ids
+                            if project_id not in
+                            self._incomplete_project_ids and
+                            self.is_loaded(project_id)],
+            'track_blocks': list(self.track_blocks),
+            'last_updated': last_updated,
+            'journal_position': journal_position,
+            'processed_activities': processed_activities,
+            'kept_story_ids': set(self._kept_story_ids),
+            'stories': self.stories_view(),
+        })
+        logger.info('Saved snapshot %s' % self.snapshot_path)
+        # A restore only replays the journal from the snapshot on
+        if journal_position is not None:
+            removed = self.journal.remove_before(journal_position)
+            if removed:
+                logger.info('Removed %s journal segments' % removed)
+
+    def restore_snapshot(self):
+        """ Restore the state saved in snapshot_path, return False if there
+            is no usable snapshot and the stories must be loaded instead.
+            The projects the snapshot does not have are loaded in the
+            background.
+        """
+        try:
+            state = snapshot.load(self.snapshot_path, self.snapshot_max_age)
+        except snapshot.SnapshotError as e:
+            logger.warning('Not using the snapshot: %s' % e)
+            return False
+        if state['track_blocks'] != self.track_blocks:
+            logger.warning('Not using the snapshot: it tracks blocks %s' %
+                           state['track_blocks'])
+            return False
+        known_project_ids = set(state['project_ids'])
+        self._set_stories(dict(
+            (story_id, story)
+            for story_id, story in state['stories'].items()
+            if story.project_id in self.project_ids))
+        with self.processed_activities_lock:
+            self.processed_activities = state['processed_activities']
+        # Older snapshots do not have them, the stories are looked up again
+        self._kept_story_ids = set(
+            story_id for story_id in state.get('kept_story_ids', ())
+            if story_id in self.stories)
+        # Older snapshots have v3 watermarks too, they are not needed now
+        for project_id in known_project_ids.intersection(self.project_ids):
+            key = '%s-%s' % (project_id, ACTIVITIES_VERSION)
+            if key in state['last_updated']:
+                self._last_updated[key] = state['last_updated'][key]
+        journal_position = state.get('journal_position')
+        if self.journal is not None and journal_position is not None:
+            self.replay_journal(journal_position)
+        new_project_ids = [project_id for project_id in self.project_ids
+                           if project_id not in known_project_ids]
+        logger.info('Restored %s stories from snapshot %s, saved at %s' %
+                    (len(self.stories), self.snapshot_path,
+                     state['saved_at']))
+        if new_project_ids:
+            self._start_background_load(new_project_ids)
+        else:
+            self.ready.set()
+        return True
+
+    def stories_view(self):
+        """ Return a consistent copy of the stories, for building reports.
+
+            The story locks are only held while each story is copied, so
+            building a report never holds up the activities.
+        """
+        with self.structure_lock:
+            stories = self.stories.items()
+        view = {}
+        for story_id, story in stories:
+            with self.story_locks(story_id):
+                view[story_id] = story.copy()
+        return view
 
     @staticmethod
     def log_unknown_story(storyxml):
-            logger.warning('Story unknown: %s' % storyxml.id)
-            if __debug__:
+            logger.warning('Story unknown: %s', storyxml.id)
+            if logger.isEnabledFor(logging.DEBUG):
                 logger.debug(pt_api.to_str(storyxml))
 
     @staticmethod
     def log_unknown_task(taskxml):
-            logger.warning('Task unknown: %s' % taskxml.id)
-            if __debug__:
+            logger.warning('Task unknown: %s', taskxml.id)
+            if logger.isEnabledFor(logging.DEBUG):
                 logger.debug(pt_api.to_str(taskxml))
 
     @staticmethod
     def log_unknown_comment(commentxml):
-            logger.warning('Comment unknown: %s' % commentxml.id)
-            if __debug__:
+            logger.warning('Comment unknown: %s', commentxml.id)
+            if logger.isEnabledFor(logging.DEBUG):
                 logger.debug(pt_api.to_str(commentxml))
 
     def getStory(self, storyxml):
         """ If the story is tracked return it
             else return None and log the unknwon story
         """
-        if storyxml.id in self.stories:
-            return self.stories[storyxml.id]
-        else:
+        story = self.stories.get(storyxml.id)
+        if story is None:
             self.log_unknown_story(storyxml)
+        return story
+
+    def _is_tracked(self, story):
+        """ Whether story is still the one tracked under its id. Checked
+            holding its story lock before changing it, since it may have been
+            removed after getStory returned it.
+        """
+        return self.stories.get(story.id) is story
 
     def getTask(self, story, taskxml):
-        if taskxml.id in story.tasks:
-            task = story.tasks[taskxml.id]
-            return task
-        else:
+        task = story.tasks.get(taskxml.id)
+        if task is None:
             self.log_unknown_task(taskxml)
-            return None
+        return task
+
+    def register_handler(self, event_type, handler):
+        """ Have process_activity call handler(activity) for the activities
+            of event_type, instead of the handler there was for it, or of
+            logging them as unknown
+        """
+        handlers = dict(self.handlers)
+        handlers[event_type] = handler
+        self.handlers = handlers
+
+    def _time_event(self, event_type, seconds):
+        with self._event_timings_lock:
+            timing = self._event_timings.get(event_type)
+            if timing is None:
+                timing = self._event_timings[event_type] = [0, 0.0]
+            timing[0] += 1
+            timing[1] += seconds
+
+    def event_stats(self):
+        """ Return how many activities of each event type were processed,
+            and how many seconds that took
+        """
+        with self._event_timings_lock:
+            return dict((event_type, {'count': count, 'seconds': seconds})
+                        for event_type, (count, seconds)
+                        in self._event_timings.items())
 
-    def process_activity(self, activity):
+    def process_activity(self, activity, record=True):
         """ To be run in a thread, process all the activities in the queue
+
+            Each story is only locked while it is being changed, so
+            activities for different stories can be processed concurrently.
+            Activities for the same story must still be processed in order.
+            Unless record is False the activity is appended to the journal.
+            The activity is handed to the handler of its event type, see
+            register_handler.
         """
-        with self.update_lock:
-            if activity.id in self.processed_activities:
-                if __debug__:
-                    logger.debug('Ignoring repeat activity %s.' % activity.id)
-                    return
-            if __debug__:
-                logger.debug(pt_api.to_str(activity))
+        if not self._buffer_activities([activity], record):
+            return
+        # A plain int, an objectified id would keep its whole document alive
+        activity_id = int(activity.id)
+        with self.processed_activities_lock:
+            is_new = self.processed_activities.add(activity_id)
+            if is_new:
+                self._applying_activity_ids.add(activity_id)
+        if not is_new:
+            logger.debug('Ignoring repeat activity %s.', activity.id)
+            return
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(pt_api.to_str(activity))
+        if logger.isEnabledFor(logging.INFO):
             logger.info('--------------------')
             logger.info('')
             logger.info('--------------------')
             logger.info(activity.event_type)
             logger.info(activity.description)
-            self.processed_activities.append(activity.id)
-            if activity.event_type in ['story_update', 'move_into_project']:
-                for storyxml in activity.stories.iterchildren():
-                    story = self.getStory(storyxml)
-                    if story:
-                        logger.info('%s: %s' %
-                                    (activity.event_type, storyxml.id))
-                        story.update(activity, storyxml)
-                        logger.info("<Updated Story> %s:%s" %
-                                    (story.id, story.description))
-
-            elif activity.event_type == 'story_create':
-                for storyxml in activity.stories.iterchildren():
-                    logger.info('%s: %s' % (activity.event_type, storyxml.id))
-                    story = Story.create(activity.project_id, storyxml)
-                    if story.id not in self.stories:
-                        self.stories[story.id] = story
-                        logger.info("<Added Story> %s:%s" % (
-                            story.id, story.description
-                        ))
-                    else:
-                        logger.info("Ignoring already known about story")
-
-            elif activity.event_type in ['story_delete', 'multi_story_delete']:
-                for storyxml in activity.stories.iterchildren():
-                    logger.info('%s: %s' % (activity.event_type, storyxml.id))
-                    story = self.getStory(storyxml)
-                    if story:
-                        del self.stories[storyxml.id]
-                        logger.info("<Deleted Story> %s:%s" %
-                                    (story.id, story.description))
-            elif activity.event_type == 'note_create':
-                for storyxml in activity.stories.iterchildren():
-                    logger.info('%s: %s' % (activity.event_type, storyxml.id))
-                    story = self.getStory(storyxml)
-                    if story:
-                        for notexml in storyxml.notes.iterchildren():
-                            note = Note(int(notexml.id),
-                                        unicode(notexml['text'].text),
-                                        unicode(activity.author),
-                                        unicode(activity.occurred_at))
-                            if note.id not in story.notes:
-                                story.notes[note.id] = note
-                                logger.info("<Created Note> %s:%s" %
-                                            (note.id, note.text))
-                            else:
-                                logger.info("Ignoring already known about note")
-
-            elif activity.event_type == 'task_create':
-                for storyxml in activity.stories.iterchildren():
-                    logger.info('%s: %s' %
-                                (activity.event_type, storyxml.id))
-                    story = self.getStory(storyxml)
-                    if story:
-                        for taskxml in storyxml.tasks.iterchildren():
-                            position = getattr(taskxml, 'position', -1)
-                            complete = getattr(taskxml, 'complete', False)
-                            created_at = getattr(taskxml, 'created_at', None)
-                            task = Task(int(taskxml.id),
-                                        unicode(taskxml.description),
-                                        created_at,
-                                        position=position, complete=complete)
-                            if task.id not in story.tasks:
-                                story.tasks[task.id] = task
-                                logger.info("<Created Task> %s:%s" %
-                                            (task.id, task.description))
-                            else:
-                                logger.info("Ignoring already known about task")
-
-            elif activity.event_type == 'task_edit':
-                for storyxml in activity.stories.iterchildren():
-                    story = self.getStory(storyxml)
-                    if story:
-                        logger.info('%s: %s' % (activity.event_type,
-                                                storyxml.id))
-                        for taskxml in storyxml.tasks.iterchildren():
-                            task = self.getTask(story, taskxml)
-                            if task:
-                                task.update(taskxml)
-                                logger.info("<Updated Task> %s:%s" %
-                                            (task.id, task.description))
-
-            elif activity.event_type == 'task_delete':
-                for storyxml in activity.stories.iterchildren():
-                    story = self.getStory(storyxml)
-                    if story:
-                        logger.info('%s: %s' % (activity.event_type,
-                                                storyxml.id))
-                        for taskxml in storyxml.tasks.iterchildren():
-                            task = self.getTask(story, taskxml)
-                            if task:
-                                del story.tasks[taskxml.id]
-                                logger.info("<Deleted Task> %s:%s" %
-                                            (task.id, task.description))
-
-            elif activity.event_type == 'comment_delete':
-                for storyxml in activity.stories.iterchildren():
-                    story = self.getStory(storyxml)
-                    if story:
-                        logger.info('%s: %s' % (activity.event_type,
-                                                storyxml.id))
-                        for commentxml in storyxml.comments.iterchildren():
-                            if commentxml.id in story.notes:
-                                note = story.notes[commentxml.id]
-                                del story.notes[commentxml.id]
-                                logger.info("<Deleted Note> %s:%s" %
-                                            (note.id, note.text))
-                            else:
-                                self.log_unknown_comment(commentxml)
-
-            elif activity.event_type in ['move_from_project']:
-                # because all the projects are mixed together move_from_project
-                # event_type can be ignored
-                pass
+        applied = False
+        try:
+            self._apply_activity(activity)
+            applied = True
+        finally:
+            with self.processed_activities_lock:
+                self._applying_activity_ids.discard(activity_id)
+                if not applied:
+                    # Not a repeat when it comes again
+                    self.processed_activities.discard([activity_id])
+
+        if record and self.journal is not None:
+            self.journal.append(pt_api.to_str(activity))
+
+    def _apply_activity(self, activity):
+        event_type = activity.event_type
+        handler = self.handlers.get(event_type)
+        start = time.time()
+        if handler is not None:
+            handler(activity)
+        else:
+            logger.warning('Unknown event type: %s', event_type)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(pt_api.to_str(activity))
+        self._time_event(unicode(event_type), time.time() - start)
+
+    def process_activities(self, activities, record=True):
+        """ Process a batch of activities, in order, return its BatchStats
+
+            The batch is checked for repeats in one go. Successive
+            story_updates of a story are merged, as long as nothing else
+            touches the story in between, and only the final state is
+            applied, at the place of the last of them. Unless record is
+            False every applied activity is appended to the journal, merged
+            or not. An activity whose handler raises is logged and left
+            out, along with the ones merged with it, and is not counted as
+            processed, so that it is not a repeat when it comes again. The
+            activities of a project that is still loading are put aside,
+            see load_stories.
+        """
+        received = len(activities)
+        activities = self._buffer_activities(activities, record)
+        return self._process_activities(activities, record,
+                                        received - len(activities))
+
+    def _process_activities(self, activities, record, buffered):
+        start = time.time()
+        with self.processed_activities_lock:
+            # Plain ints, see process_activity
+            new_activities = [
+                activity for activity in activities
+                if self.processed_activities.add(int(activity.id))]
+            new_ids = [int(activity.id) for activity in new_activities]
+            self._applying_activity_ids.update(new_ids)
+        failed = []
+        try:
+            applied = self._apply_batch(new_activities, failed)
+        finally:
+            failed_ids = set(int(activity.id) for activity in failed)
+            with self.processed_activities_lock:
+                self._applying_activity_ids.difference_update(new_ids)
+                self.processed_activities.discard(failed_ids)
+        if record and self.journal is not None:
+            for activity in new_activities:
+                if activity.id not in failed_ids:
+                    self.journal.append(pt_api.to_str(activity))
+
+        stats = BatchStats(len(activities) + buffered, buffered,
+                           len(activities) - len(new_activities),
+                           len(new_activities) - len(failed) - applied,
+                           applied, time.time() - start, len(failed))
+        logger.info('Processed a batch of %s activities: %s buffered, %s '
+                    'repeats, %s merged, %s applied in %.3fs, %s failed',
+                    *stats)
+        return stats
 
+    def _apply_batch(self, activities, failed):
+        """ Apply the new activities, merging the story_updates that can be
+            merged, return how many were applied. The activities that could
+            not be applied are added to failed.
+        """
+        # Merging only makes sense for the handler that applies the story
+        # xml, not for one registered instead of it
+        coalesce = (self.handlers.get('story_update') ==
+                    self._apply_story_update)
+        # The activities to apply, in order, each a list of the
+        # story_updates to merge into one, or None where they were taken
+        # out to be merged into a later one
+        pending = {}
+        to_apply = []
+        for activity in activities:
+            story_ids = _activity_story_ids(activity)
+            chain = [activity]
+            if (coalesce and activity.event_type == 'story_update' and
+                    story_ids is not None and len(story_ids) == 1):
+                index = pending.get(story_ids[0])
+                if (index is not None and
+                        to_apply[index][-1].project_id == activity.project_id):
+                    chain = to_apply[index]
+                    chain.append(activity)
+                    to_apply[index] = None
+                pending[story_ids[0]] = len(to_apply)
+            elif story_ids is None:
+                pending.clear()
+            else:
+                for story_id in story_ids:
+                    pending.pop(story_id, None)
+            to_apply.append(chain)
+
+        applied = 0
+        for chain in to_apply:
+            if chain is None:
+                continue
+            try:
+                self._apply_activity(chain[0] if len(chain) == 1
+                                     else _merge_story_updates(chain))
+            except Exception:
+                logger.exception('Could not apply the %s activities %s',
+                                 chain[-1].event_type,
+                                 [activity.id for activity in chain])
+                failed.extend(chain)
+            else:
+                applied += 1
+        return applied
+
+    def _apply_story_update(self, activity):
+        """ Update the stories, and move them into the activity project
+        """
+        for storyxml in activity.stories.iterchildren():
+            story = self.getStory(storyxml)
+            if story:
+                logger.info('%s: %s', activity.event_type, storyxml.id)
+                with self.story_locks(story.id):
+                    if not self._is_tracked(story):
+                        self.log_unknown_story(storyxml)
+                        continue
+                    changes = story.update(activity, storyxml)
+                    if changes:
+                        self._notify('story_changed', story, changes)
+                logger.info("<Updated Story> %s:%s",
+                            story.id, story.description)
+
+    def _apply_story_create(self, activity):
+        """ Add the new stories
+        """
+        for storyxml in activity.stories.iterchildren():
+            logger.info('%s: %s', activity.event_type, storyxml.id)
+            story = Story.create(activity.project_id, storyxml)
+            with self.structure_lock:
+                is_new = story.id not in self.stories
+                if is_new:
+                    self.stories[story.id] = story
+                    self._notify('story_added', story)
+            if is_new:
+                logger.info("<Added Story> %s:%s",
+                            story.id, story.description)
             else:
-                logger.warning('Unknown event type: %s' % activity.event_type)
-                if __debug__:
-                    logger.debug(pt_api.to_str(activity))
+                logger.info("Ignoring already known about story")
+
+    def _apply_story_delete(self, activity):
+        """ Forget the deleted stories
+        """
+        for storyxml in activity.stories.iterchildren():
+            logger.info('%s: %s', activity.event_type, storyxml.id)
+            story = self.getStory(storyxml)
+            if story:
+                with self.structure_lock:
+                    with self.story_locks(story.id):
+                        deleted = self._is_tracked(story)
+                        if deleted:
+                            del self.stories[story.id]
+                            self._notify('story_removed', story)
+                logger.info("<Deleted Story> %s:%s",
+                            story.id, story.description)
 
-    def collect_task_updates(self):
-        """ Update the stories since the last time this method was called.
+    def _apply_note_create(self, activity):
+        """ Add the new notes to their stories
         """
+        for storyxml in activity.stories.iterchildren():
+            logger.info('%s: %s', activity.event_type, storyxml.id)
+            story = self.getStory(storyxml)
+            if story:
+                for notexml in storyxml.notes.iterchildren():
+                    note = Note(int(notexml.id),
+                                unicode(notexml['text'].text),
+                                unicode(activity.author),
+                                unicode(activity.occurred_at))
+                    with self.story_locks(story.id):
+                        if not self._is_tracked(story):
+                            self.log_unknown_story(storyxml)
+                            break
+                        is_new = story.add_note(note)
+                        if is_new:
+                            self._notify('note_added', story, note)
+                    if is_new:
+                        logger.info("<Created Note> %s:%s",
+                                    note.id, note.text)
+                    else:
+                        logger.info("Ignoring already known about note")
+
+    def _apply_task_create(self, activity):
+        """ Add the new tasks to their stories
+        """
+        for storyxml in activity.stories.iterchildren():
+            logger.info('%s: %s', activity.event_type, storyxml.id)
+            story = self.getStory(storyxml)
+            if story:
+                for taskxml in storyxml.tasks.iterchildren():
+                    position = getattr(taskxml, 'position', -1)
+                    complete = getattr(taskxml, 'complete', False)
+                    created_at = getattr(taskxml, 'created_at', None)
+                    task = Task(int(taskxml.id),
+                                unicode(taskxml.description),
+                                created_at,
+                                position=position, complete=complete)
+                    with self.story_locks(story.id):
+                        if not self._is_tracked(story):
+                            self.log_unknown_story(storyxml)
+                            break
+                        is_new = story.add_task(task)
+                        if is_new:
+                            self._notify('task_added', story, task)
+                    if is_new:
+                        logger.info("<Created Task> %s:%s",
+                                    task.id, task.description)
+                    else:
+                        logger.info("Ignoring already known about task")
+
+    def _apply_task_edit(self, activity):
+        """ Update the tasks
+        """
+        for storyxml in activity.stories.iterchildren():
+            story = self.getStory(storyxml)
+            if story:
+                logger.info('%s: %s', activity.event_type, storyxml.id)
+                for taskxml in storyxml.tasks.iterchildren():
+                    task = self.getTask(story, taskxml)
+                    if task:
+                        with self.story_locks(story.id):
+                            if not self._is_tracked(story):
+                                self.log_unknown_story(storyxml)
+                                break
+                            changes = task.update(taskxml)
+                            if changes:
+                                self._notify('task_changed', story, task,
+                                             changes)
+                        logger.info("<Updated Task> %s:%s",
+                                    task.id, task.description)
+
+    def _apply_task_delete(self, activity):
+        """ Remove the deleted tasks from their stories
+        """
+        for storyxml in activity.stories.iterchildren():
+            story = self.getStory(storyxml)
+            if story:
+                logger.info('%s: %s', activity.event_type, storyxml.id)
+                for taskxml in storyxml.tasks.iterchildren():
+                    task = self.getTask(story, taskxml)
+                    if task:
+                        with self.story_locks(story.id):
+                            if not self._is_tracked(story):
+                                self.log_unknown_story(storyxml)
+                                break
+                            removed = story.tasks.pop(taskxml.id, None)
+                            if removed is not None:
+                                self._notify('task_removed', story,
+                                             removed)
+                        logger.info("<Deleted Task> %s:%s",
+                                    task.id, task.description)
+
+    def _apply_comment_delete(self, activity):
+        """ Remove the deleted notes from their stories
+        """
+        for storyxml in activity.stories.iterchildren():
+            story = self.getStory(storyxml)
+            if story:
+                logger.info('%s: %s', activity.event_type, storyxml.id)
+                for commentxml in storyxml.comments.iterchildren():
+                    with self.story_locks(story.id):
+                        if not self._is_tracked(story):
+                            self.log_unknown_story(storyxml)
+                            break
+                        note = story.notes.pop(commentxml.id, None)
+                        if note is not None:
+                            self._notify('note_removed', story, note)
+                    if note is not None:
+                        logger.info("<Deleted Note> %s:%s",
+                                    note.id, note.text)
+                    else:
+                        self.log_unknown_comment(commentxml)
+
+    def _ignore_activity(self, activity):
+        """ All the projects are mixed together, so a story moving out of a
+            project is handled by the move_into_project of the other one
+        """
+
+    # The methods that handle each event type, for every Sleuth
+    EVENT_HANDLERS = {
+        'story_update': '_apply_story_update',
+        'move_into_project': '_apply_story_update',
+        'story_create': '_apply_story_create',
+        'story_delete': '_apply_story_delete',
+        'multi_story_delete': '_apply_story_delete',
+        'note_create': '_apply_note_create',
+        'task_create': '_apply_task_create',
+        'task_edit': '_apply_task_edit',
+        'task_delete': '_apply_task_delete',
+        'comment_delete': '_apply_comment_delete',
+        'move_from_project': '_ignore_activity',
+    }
+
+    def replay_journal(self, since=(0, 0)):
+        """ Apply the activities of the journal from the position since on,
+            in batches, see process_activities
+        """
+        count = journal.replay_batches(
+            self.journal.directory,
+            lambda activities: self.process_activities(activities,
+                                                       record=False),
+            since)
+        logger.info('Replayed %s activities from the journal' % count)
+        return count
+
+    def collect_task_updates(self, project_ids=None):
+        """ Update the stories of the projects, all of them by default,
+            since the last time they were polled. Return how many new
+            activities each project had, leaving out the ones that could not
+            be polled.
+        """
+        if project_ids is None:
+            project_ids = self.project_ids
         def getLastUpdated(a_project_id, version):
             overlap_delta = datetime.timedelta(seconds=self.overlap_seconds)
             new_last_updated = datetime.datetime.utcnow() - overlap_delta
 
             l_updated = self._get_last_updated(a_project_id, version)
             self._set_last_updated(new_last_updated, a_project_id, version)
-            if __debug__:
-                logger.debug('%s-%s: %s' % (a_project_id, version, l_updated))
+            logger.debug('%s-%s: %s', a_project_id, version, l_updated)
             return l_updated
 
-        for project_id in self.project_ids:
-            last_updated = getLastUpdated(project_id, 'v3')
-            activitiesxml = pt_api.get_project_activities_v3(project_id,
-                                                             last_updated,
-                                                             self.token)
-            if activitiesxml is not None:
-                activities = [activityxml
-                              for activityxml in activitiesxml.iterchildren()]
-                activities.sort(key=operator.attrgetter('occurred_at'))
-                for activityxml in activities:
-                    self.process_activity(activityxml)
-
-            last_updated = getLastUpdated(project_id, 'v4')
-            activitiesxml = pt_api.get_project_activities(project_id,
-                                                          last_updated,
-                                                          self.token)
-            if activitiesxml is not None:
-                activities = [activityxml
-                              for activityxml in activitiesxml.iterchildren()]
+        # An activity seen before the oldest watermark occurred before it
+        # too, so no request from now on can return it again
+        if self._last_updated:
+            with self.processed_activities_lock:
+                self.processed_activities.expire(
+                    min(self._last_updated.values()))
+
+        # Fetch stage: every project concurrently, skipping the activities
+        # nothing would be done with while they are parsed
+        event_types = frozenset(
+            event_type for event_type, handler in self.handlers.items()
+            if handler != self._ignore_activity)
+        fetches = []
+        for project_id in project_ids:
+            last_updated = getLastUpdated(project_id, ACTIVITIES_VERSION)
+            future = pt_api.stream_project_activities_async(
+                project_id, last_updated, self.token, event_types,
+                executor=self.executor)
+            fetches.append((project_id, last_updated, future))
+
+        streams = []
+        new_activities = {}
+        for project_id, last_updated, future in fetches:
+            try:
+                activities = list(future.result().iterchildren())
                 activities.sort(key=operator.attrgetter('occurred_at'))
-                for activityxml in activities:
-                    if activityxml.event_type in ['task_delete',
-                                                  'task_edit',
-                                                  'task_create',
-                                                  'comment_delete']:
-                        if __debug__:
-                            logger.debug(pt_api.to_str(activityxml))
-                        logger.info(activityxml.event_type)
-                        self.process_activity(activityxml)
+            except Exception:
+                logger.exception('Problem getting the activities of %s' %
+                                 project_id)
+                # so the next poll asks for these activities again
+                self._set_last_updated(last_updated, project_id,
+                                       ACTIVITIES_VERSION)
+                continue
+            streams.append(activities)
+            new_activities[project_id] = sum(
+                1 for activity in activities
+                if activity.id not in self.processed_activities)
+        logger.debug('Activity streams: %s',
+                     pt_api.activity_counters.stats())
+
+        # Apply stage: all the activities, in the order they occurred
+        self.process_activities(list(_merge_by_occurred_at(streams)))
+        return new_activities
 
 
 def continue_tracking():
@@ -474,6 +1530,67 @@ def main(input_args=None):
                         default=10,
                         help='Seconds to overlap activity requests.'
                              ' To avoid missing some activities')
+    parser.add_argument('--poll-workers', dest='poll_workers', type=int,
+                        default=10,
+                        help='How many api requests to make at once.')
+    parser.add_argument('--listen-port', dest='listen_port', type=int,
+                        default=None,
+                        help='Listen for web hook activities on this port.')
+    parser.add_argument('--listen-address', dest='listen_address', type=str,
+                        default='127.0.0.1',
+                        help='The address to listen for activities on.')
+    parser.add_argument('--listen-secret', dest='listen_secret', type=str,
+                        default=None,
+                        help='Only take the activities POSTed to'
+                             ' /<listen-secret>, the url of the web hook.')
+    parser.add_argument('--listen-queue-size', dest='listen_queue_size',
+                        type=int, default=1000,
+                        help='How many web hook activities to queue, before'
+                             ' asking the tracker to retry later.')
+    parser.add_argument('--poll-seconds', dest='poll_seconds', type=int,
+                        default=None,
+                        help='Seconds between the activity polls of a busy'
+                             ' project. Defaults to 1, or 60 when listening'
+                             ' for activities.')
+    parser.add_argument('--max-poll-seconds', dest='max_poll_seconds',
+                        type=int, default=300,
+                        help='Seconds between the activity polls of an idle'
+                             ' project.')
+    parser.add_argument('--max-requests-per-second',
+                        dest='max_requests_per_second', type=float,
+                        default=5.0,
+                        help='How many activity polls to make a second, at'
+                             ' most, across all the projects.')
+    parser.add_argument('--snapshot-file', dest='snapshot_file', type=str,
+                        default=None,
+                        help='Where to save the state, to restart from.')
+    parser.add_argument('--snapshot-seconds', dest='snapshot_seconds',
+                        type=int, default=300,
+                        help='Seconds between saving snapshots.')
+    parser.add_argument('--snapshot-max-age', dest='snapshot_max_age',
+                        type=int, default=6 * 60 * 60,
+                        help='Seconds after which a snapshot is too old to'
+                             ' restart from, and the stories are reloaded.')
+    parser.add_argument('--journal-dir', dest='journal_dir', type=str,
+                        default=None,
+                        help='Where to journal the applied activities.')
+    parser.add_argument('--journal-segment-mb', dest='journal_segment_mb',
+                        type=int, default=64,
+                        help='Size of the journal segment files.')
+    parser.add_argument('--aggregates-check-seconds',
+                        dest='aggregates_check_seconds', type=int,
+                        default=600,
+                        help='Seconds between checking the aggregates'
+                             ' against the stories.')
+    parser.add_argument('--reconcile-seconds', dest='reconcile_seconds',
+                        type=int, default=120,
+                        help='Seconds between reconciling the stories of a'
+                             ' project with the tracker, a project at a'
+                             ' time.')
+    parser.add_argument('--audit-log', dest='audit_log', type=str,
+                        default=None,
+                        help='Where to write every change to the stories,'
+                             ' as a line of json.')
     parser.add_argument('--log-file', dest='log_file', type=str, default=None,
                         help='Where to log the output to.')
     parser.add_argument('--log-file-level', dest='log_file_level', type=str,
@@ -482,26 +1599,69 @@ def main(input_args=None):
                         default='INFO', help='The stream logger level.')
     args = parser.parse_args(input_args)
 
-    logger.setLevel(logging.DEBUG)
-
     log_format = "%(asctime)s/+%(relativeCreated)7.0f|%(levelname)s" \
                  "| %(filename)s:%(lineno)-4s | %(message)s"
     stream_handler = logging.StreamHandler()
     formatter = logging.Formatter(log_format)
     stream_handler.setFormatter(formatter)
-    stream_handler.setLevel(parse_logging_level(args.log_level))
+    handler_levels = [parse_logging_level(args.log_level)]
+    stream_handler.setLevel(handler_levels[0])
     logger.addHandler(stream_handler)
 
     if args.log_file:
         file_handler = logging.FileHandler(args.log_file)
         formatter = logging.Formatter(log_format)
         file_handler.setFormatter(formatter)
-        file_handler.setLevel(parse_logging_level(args.log_file_level))
+        handler_levels.append(parse_logging_level(args.log_file_level))
+        file_handler.setLevel(handler_levels[-1])
         logger.addHandler(file_handler)
 
+    # Records no handler would log are dropped before they are formatted
+    logger.setLevel(min(handler_levels))
+
+    activity_journal = None
+    if args.journal_dir:
+        activity_journal = ActivityJournal(
+            args.journal_dir,
+            segment_bytes=args.journal_segment_mb * 1024 * 1024)
     sleuth = Sleuth(project_ids=args.projects,
                     track_blocks=['current', 'backlog', 'icebox'],
-                    token=args.token, overlap_seconds=args.overlap_seconds)
-    while continue_tracking():
-        sleuth.collect_task_updates()
-        time.sleep(1)
+                    token=args.token, overlap_seconds=args.overlap_seconds,
+                    poll_workers=args.poll_workers,
+                    snapshot_path=args.snapshot_file,
+                    snapshot_max_age=datetime.timedelta(
+                        seconds=args.snapshot_max_age),
+                    journal=activity_journal)
+    if args.audit_log:
+        AuditLog(sleuth.changes, args.audit_log)
+    poll_seconds = args.poll_seconds
+    if args.listen_port is not None:
+        # The web hook delivers the activities, polling only reconciles
+        listener = ActivityListener((args.listen_address, args.listen_port),
+                                    sleuth.process_activity,
+                                    queue_size=args.listen_queue_size,
+                                    secret=args.listen_secret)
+        listener.start()
+        if poll_seconds is None:
+            poll_seconds = 60
+    scheduler = Scheduler()
+    # Each project is polled as often as it changes, see polling
+    poller = AdaptivePoller(
+        sleuth.collect_task_updates, lambda: sleuth.project_ids,
+        min_interval=poll_seconds or 1, max_interval=args.max_poll_seconds,
+        max_requests_per_second=args.max_requests_per_second)
+    scheduler.every(1, poller.poll, name='poll')
+    if args.snapshot_file:
+        # Saved between polls, so the snapshot never sees half a poll
+        scheduler.every(args.snapshot_seconds, sleuth.save_snapshot,
+                        name='snapshot', delay=args.snapshot_seconds)
+    if activity_journal is not None:
+        scheduler.every(1, activity_journal.sync, name='journal')
+    scheduler.every(args.aggregates_check_seconds, sleuth.check_aggregates,
+                    name='check_aggregates',
+                    delay=args.aggregates_check_seconds)
+    # In a thread of its own, so the polls go on while it fetches
+    scheduler.every(args.reconcile_seconds, sleuth.reconcile_next,
+                    name='reconcile', delay=args.reconcile_seconds,
+                    executor=ThreadPoolExecutor(max_workers=1))
+    scheduler.run(continue_tracking)
@@ -0,0 +1,112 @@
+""" Story points and story counts, grouped by state, project and owner, kept
+    up to date as the stories change, so reading them never scans the
+    stories.
+"""
+import collections
+import threading
+
+from observers import StoryObserver
+
+
+def _points(estimate):
+    """ Unestimated stories have no estimate, or an estimate of -1
+    """
+    if estimate is None or estimate < 0:
+        return 0
+    return estimate
+
+
+class PointAggregates(StoryObserver):
+    """ The sum of the estimates, and the number of stories, with each value
+        of the FIELDS attributes, kept up to date as a StoryObserver with a
+        delta for each change.
+    """
+
+    FIELDS = ('current_state', 'project_id', 'owned_by')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self._points = dict((field, collections.defaultdict(int))
+                            for field in self.FIELDS)
+        self._counts = dict((field, collections.defaultdict(int))
+                            for field in self.FIELDS)
+
+    def _apply(self, values, sign):
+        points = sign * _points(values['estimate'])
+        for field in self.FIELDS:
+            value = values[field]
+            self._points[field][value] += points
+            self._counts[field][value] += sign
+            if not self._counts[field][value]:
+                del self._points[field][value]
+                del self._counts[field][value]
+
+    @classmethod
+    def _values(cls, story):
+        return dict((field, getattr(story, field))
+                    for field in cls.FIELDS + ('estimate',))
+
+    def stories_reset(self, stories):
+        with self._lock:
+            self._clear()
+            for story in stories.values():
+                self._apply(self._values(story), 1)
+
+    def story_added(self, story):
+        with self._lock:
+            self._apply(self._values(story), 1)
+
+    def story_removed(self, story):
+        with self._lock:
+            self._apply(self._values(story), -1)
+
+    def story_changed(self, story, changes):
+        new_values = self._values(story)
+        old_values = dict(new_values)
+        for attribute, old_value, _ in changes:
+            if attribute in old_values:
+                old_values[attribute] = old_value
+        if old_values != new_values:
+            with self._lock:
+                self._apply(old_values, -1)
+                self._apply(new_values, 1)
+
+    def points(self, field):
+        """ Return the {value: points} of the field, eg points('owned_by')
+        """
+        with self._lock:
+            return dict(self._points[field])
+
+    def counts(self, field):
+        """ Return the {value: number of stories} of the field
+        """
+        with self._lock:
+            return dict(self._counts[field])
+
+    def check(self, stories):
+        """ Recompute the aggregates from stories, and return how far the
+            kept ones had drifted from them, as {(field, value): (kept
+            points, kept count, points, count)}. The recomputed aggregates
+            replace the kept ones.
+
+            The stories must not change while they are checked.
+        """
+        recomputed = PointAggregates()
+        recomputed.stories_reset(stories)
+        with self._lock:
+            drift = {}
+            for field in self.FIELDS:
+                for value in (set(self._counts[field]) |
+                              set(recomputed._counts[field])):
+                    kept = (self._points[field].get(value, 0),
+                            self._counts[field].get(value, 0))
+                    actual = (recomputed._points[field].get(value, 0),
+                              recomputed._counts[field].get(value, 0))
+                    if kept != actual:
+                        drift[(field, value)] = kept + actual
+            self._points = recomputed._points
+            self._counts = recomputed._counts
+        return drift
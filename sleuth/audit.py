@@ -0,0 +1,39 @@
+""" An audit log of every change to the stories, written from the change
+    feed by a thread of its own, so it costs the activities only a queue put
+    per change.
+"""
+import json
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class AuditLog(object):
+    """ Append every change of the ChangeFeed feed to the file at path, as a
+        line of json: {"at": epoch seconds, "kind": ..., "story_id": ...,
+        "item_id": ..., "field": ..., "old": ..., "new": ...}
+    """
+
+    def __init__(self, feed, path, queue_size=100000, batch_size=1000):
+        self.path = path
+        self._file = open(path, 'a')
+        self.subscription = feed.subscribe(queue_size=queue_size,
+                                           batch_size=batch_size)
+        self.subscription.start(self.write)
+        logger.info('Writing the audit log to %s', path)
+
+    def write(self, changes):
+        at = time.time()
+        lines = []
+        for change in changes:
+            record = change._asdict()
+            record['at'] = at
+            lines.append(json.dumps(record, default=unicode))
+        self._file.write('\n'.join(lines) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self.subscription.close()
+        self._file.close()
@@ -0,0 +1,157 @@
+""" A feed of the changes Sleuth makes to the stories, for consumers that
+    would otherwise have to rescan the stories to find out what changed.
+
+    Every subscriber has its own bounded queue. Publishing never waits: when
+    a subscriber's queue is full its changes are dropped and counted, so a
+    slow consumer can only lose changes, never hold up the activities.
+"""
+import collections
+import logging
+import Queue
+import threading
+
+from observers import StoryObserver
+
+
+logger = logging.getLogger(__name__)
+
+# kind is stories_reset, story_added, story_removed, story_changed,
+# note_added, note_removed, task_added, task_removed or task_changed. item_id
+# is the id of the note or task, field, old and new are only set for the
+# *_changed kinds.
+Change = collections.namedtuple('Change', ['kind', 'story_id', 'item_id',
+                                           'field', 'old', 'new'])
+
+
+class Subscription(object):
+    """ The queue of changes of a subscriber, taken off in batches
+    """
+
+    def __init__(self, feed, queue_size, batch_size):
+        self.feed = feed
+        self.batch_size = batch_size
+        self.queue = Queue.Queue(maxsize=queue_size)
+        self.delivered = 0
+        self.dropped = 0
+        self.closed = False
+        self._thread = None
+
+    def put(self, change):
+        try:
+            self.queue.put_nowait(change)
+        except Queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or not self.dropped % 1000:
+                logger.warning('Change subscriber is too slow, dropped %s '
+                               'changes' % self.dropped)
+
+    def get_batch(self, timeout=None):
+        """ Return the next changes, at most batch_size of them. Wait up to
+            timeout seconds for the first, return [] if none came.
+        """
+        try:
+            batch = [self.queue.get(timeout=timeout)]
+        except Queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Queue.Empty:
+                break
+        self.delivered += len(batch)
+        return batch
+
+    def start(self, handler, timeout=1):
+        """ Call handler with every batch of changes, from a daemon thread
+            of its own, until the subscription is closed
+        """
+        def deliver():
+            while not self.closed:
+                batch = self.get_batch(timeout)
+                if batch:
+                    try:
+                        handler(batch)
+                    except Exception:
+                        logger.exception('Problem handling changes')
+
+        self._thread = threading.Thread(target=deliver)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        """ Stop receiving changes, and wait for the handler to finish
+        """
+        self.feed.unsubscribe(self)
+        self.closed = True
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self):
+        return {'queued': self.queue.qsize(), 'delivered': self.delivered,
+                'dropped': self.dropped}
+
+
+class ChangeFeed(StoryObserver):
+    """ Publish a Change for every change to the stories to every
+        Subscription
+    """
+
+    def __init__(self):
+        self._subscriptions = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, queue_size=10000, batch_size=100):
+        """ Return a new Subscription to the changes from now on
+        """
+        subscription = Subscription(self, queue_size, batch_size)
+        with self._lock:
+            self._subscriptions = self._subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions = [other for other in self._subscriptions
+                                   if other is not subscription]
+
+    def publish(self, changes):
+        subscriptions = self._subscriptions
+        for change in changes:
+            for subscription in subscriptions:
+                subscription.put(change)
+
+    def stories_reset(self, stories):
+        self.publish([Change('stories_reset', None, None, None, None, None)])
+
+    def story_added(self, story):
+        self.publish([Change('story_added', story.id, None, None, None,
+                             None)])
+
+    def story_removed(self, story):
+        self.publish([Change('story_removed', story.id, None, None, None,
+                             None)])
+
+    def story_changed(self, story, changes):
+        self.publish([Change('story_changed', story.id, None, attribute,
+                             old_value, new_value)
+                      for attribute, old_value, new_value in changes])
+
+    def note_added(self, story, note):
+        self.publish([Change('note_added', story.id, note.id, None, None,
+                             None)])
+
+    def note_removed(self, story, note):
+        self.publish([Change('note_removed', story.id, note.id, None, None,
+                             None)])
+
+    def task_added(self, story, task):
+        self.publish([Change('task_added', story.id, task.id, None, None,
+                             None)])
+
+    def task_removed(self, story, task):
+        self.publish([Change('task_removed', story.id, task.id, None, None,
+                             None)])
+
+    def task_changed(self, story, task, changes):
+        self.publish([Change('task_changed', story.id, task.id, attribute,
+                             old_value, new_value)
+                      for attribute, old_value, new_value in changes])
@@ -0,0 +1,58 @@
+import collections
+import datetime
+
+
+class RecentActivities(object):
+    """ The ids of the activities that have been processed recently.
+
+        Membership is a set lookup. The ids are also kept in the order they
+        were seen, so that expire() can forget the ones seen before a given
+        time, and so that there are never more than max_size of them.
+    """
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self._ids = set()
+        self._seen = collections.deque()
+
+    def __contains__(self, activity_id):
+        return activity_id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def copy(self):
+        recent_activities = RecentActivities(self.max_size)
+        recent_activities._ids = set(self._ids)
+        recent_activities._seen = collections.deque(self._seen)
+        return recent_activities
+
+    def add(self, activity_id, seen_at=None):
+        """ Remember the activity id, return False if it was already known
+        """
+        if activity_id in self._ids:
+            return False
+        if seen_at is None:
+            seen_at = datetime.datetime.utcnow()
+        self._ids.add(activity_id)
+        self._seen.append((seen_at, activity_id))
+        while len(self._seen) > self.max_size:
+            self._ids.discard(self._seen.popleft()[1])
+        return True
+
+    def discard(self, activity_ids):
+        """ Forget the activity ids
+        """
+        activity_ids = set(activity_ids)
+        if not activity_ids.intersection(self._ids):
+            return
+        self._ids.difference_update(activity_ids)
+        self._seen = collections.deque(
+            (seen_at, activity_id) for seen_at, activity_id in self._seen
+            if activity_id not in activity_ids)
+
+    def expire(self, before):
+        """ Forget the activities seen before the utc datetime before
+        """
+        while self._seen and self._seen[0][0] < before:
+            self._ids.discard(self._seen.popleft()[1])
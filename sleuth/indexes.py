@@ -0,0 +1,228 @@
+""" Secondary indexes over the stories, so that reports can look stories up
+    by their attributes instead of scanning them all.
+"""
+import bisect
+import calendar
+import collections
+import datetime
+import threading
+import time
+
+from observers import StoryObserver
+
+
+class StoryIndexes(StoryObserver):
+    """ The ids of the stories with each value of the FIELDS attributes, and
+        with each label, kept up to date as a StoryObserver.
+    """
+
+    FIELDS = ('project_id', 'current_state', 'owned_by', 'story_type')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self._indexes = dict((field, collections.defaultdict(set))
+                             for field in self.FIELDS + ('label',))
+
+    def _add(self, field, value, story_id):
+        self._indexes[field][value].add(story_id)
+
+    def _discard(self, field, value, story_id):
+        index = self._indexes[field]
+        story_ids = index.get(value)
+        if story_ids is not None:
+            story_ids.discard(story_id)
+            if not story_ids:
+                del index[value]
+
+    def _add_story(self, story):
+        for field in self.FIELDS:
+            self._add(field, getattr(story, field), story.id)
+        for label in story.labels:
+            self._add('label', label, story.id)
+
+    def stories_reset(self, stories):
+        with self._lock:
+            self._clear()
+            for story in stories.values():
+                self._add_story(story)
+
+    def story_added(self, story):
+        with self._lock:
+            self._add_story(story)
+
+    def story_removed(self, story):
+        with self._lock:
+            for field in self.FIELDS:
+                self._discard(field, getattr(story, field), story.id)
+            for label in story.labels:
+                self._discard('label', label, story.id)
+
+    def story_changed(self, story, changes):
+        with self._lock:
+            for attribute, old_value, new_value in changes:
+                if attribute == 'labels':
+                    old_labels = set(old_value or [])
+                    new_labels = set(new_value or [])
+                    for label in old_labels - new_labels:
+                        self._discard('label', label, story.id)
+                    for label in new_labels - old_labels:
+                        self._add('label', label, story.id)
+                elif attribute in self._indexes:
+                    self._discard(attribute, old_value, story.id)
+                    self._add(attribute, new_value, story.id)
+
+    def values(self, field):
+        """ Return the values of field that some story has
+        """
+        with self._lock:
+            return list(self._indexes[field])
+
+    def query(self, **criteria):
+        """ Return the set of ids of the stories that match all the criteria,
+            eg query(project_id=1, current_state='delivered', label='ui').
+
+            The smallest index set is copied, and only narrowed down by the
+            others, so no story is ever looked at.
+        """
+        unknown = set(criteria) - set(self._indexes)
+        if unknown:
+            raise ValueError('Can not query by %s, only by %s' %
+                             (', '.join(sorted(unknown)),
+                              ', '.join(sorted(self._indexes))))
+        with self._lock:
+            matches = sorted((self._indexes[field].get(value, ())
+                              for field, value in criteria.items()), key=len)
+            if not matches:
+                return set()
+            story_ids = set(matches[0])
+            for other in matches[1:]:
+                story_ids.intersection_update(other)
+                if not story_ids:
+                    break
+            return story_ids
+
+
+TIMESTAMP_FORMATS = ['%Y/%m/%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S']
+
+
+def parse_timestamp(text):
+    """ Return the epoch seconds of a tracker utc timestamp, like
+        2009/03/16 16:55:04 UTC, or None if it can not be parsed
+    """
+    if not text:
+        return None
+    text = text[:19]
+    for timestamp_format in TIMESTAMP_FORMATS:
+        try:
+            return calendar.timegm(time.strptime(text, timestamp_format))
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+def _as_epoch(value):
+    if isinstance(value, datetime.datetime):
+        return calendar.timegm(value.utctimetuple())
+    return value
+
+
+class TimeIndex(StoryObserver):
+    """ The stories in the order of their FIELDS timestamps, kept up to date
+        as a StoryObserver.
+
+        Each field has a sorted list of (epoch, story id), so ranges and the
+        earliest or latest stories are found by bisection. The timestamps
+        are parsed once, when a story is added or they change.
+    """
+
+    FIELDS = ('accepted_at', 'created_at')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self._sorted = dict((field, []) for field in self.FIELDS)
+        self._epochs = dict((field, {}) for field in self.FIELDS)
+
+    def _add(self, field, story_id, text):
+        epoch = parse_timestamp(text)
+        if epoch is not None:
+            self._epochs[field][story_id] = epoch
+            bisect.insort(self._sorted[field], (epoch, story_id))
+
+    def _discard(self, field, story_id):
+        epoch = self._epochs[field].pop(story_id, None)
+        if epoch is not None:
+            entries = self._sorted[field]
+            del entries[bisect.bisect_left(entries, (epoch, story_id))]
+
+    def stories_reset(self, stories):
+        with self._lock:
+            self._clear()
+            for field in self.FIELDS:
+                epochs = self._epochs[field]
+                for story in stories.values():
+                    epoch = parse_timestamp(getattr(story, field))
+                    if epoch is not None:
+                        epochs[story.id] = epoch
+                self._sorted[field] = sorted(
+                    (epoch, story_id) for story_id, epoch in epochs.items())
+
+    def story_added(self, story):
+        with self._lock:
+            for field in self.FIELDS:
+                self._discard(field, story.id)
+                self._add(field, story.id, getattr(story, field))
+
+    def story_removed(self, story):
+        with self._lock:
+            for field in self.FIELDS:
+                self._discard(field, story.id)
+
+    def story_changed(self, story, changes):
+        with self._lock:
+            for attribute, _, new_value in changes:
+                if attribute in self._epochs:
+                    self._discard(attribute, story.id)
+                    self._add(attribute, story.id, new_value)
+
+    def epoch(self, field, story_id):
+        """ Return the parsed field timestamp of the story, or None
+        """
+        with self._lock:
+            return self._epochs[field].get(story_id)
+
+    def between(self, field, start=None, end=None):
+        """ Return the ids of the stories with a field timestamp from start
+            up to, but not including, end, in time order. start and end are
+            epoch seconds or utc datetimes, None for no limit.
+        """
+        with self._lock:
+            entries = self._sorted[field]
+            low = 0
+            high = len(entries)
+            if start is not None:
+                low = bisect.bisect_left(entries, (_as_epoch(start),))
+            if end is not None:
+                high = bisect.bisect_left(entries, (_as_epoch(end),))
+            return [story_id for _, story_id in entries[low:high]]
+
+    def latest(self, field, count):
+        """ Return the ids of the count stories with the latest field
+            timestamps, latest first
+        """
+        with self._lock:
+            entries = self._sorted[field]
+            return [story_id for _, story_id
+                    in reversed(entries[max(len(entries) - count, 0):])]
+
+    def earliest(self, field, count):
+        """ Return the ids of the count stories with the earliest field
+            timestamps, earliest first
+        """
+        with self._lock:
+            return [story_id for _, story_id in self._sorted[field][:count]]
@@ -0,0 +1,61 @@
+""" A process wide table of interned field values.
+
+    Most story fields come from a small vocabulary, so rather than every
+    story holding its own copy of u'feature' or u'accepted', they all share
+    the one copy in the table. intern() does not take unicode in python 2,
+    hence the table.
+"""
+import sys
+import threading
+
+
+class InternTable(object):
+    """ Hand out one shared copy of each equal value.
+
+        Counts the lookups, and the bytes saved by dropping the copies that
+        were replaced by the shared one.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.replaced = 0
+        self.bytes_saved = 0
+
+    def __len__(self):
+        return len(self._values)
+
+    def intern(self, value):
+        """ Return the shared copy of value, or None if value is None
+        """
+        if value is None:
+            return None
+        with self._lock:
+            self.lookups += 1
+            interned = self._values.setdefault(value, value)
+            if interned is not value:
+                self.replaced += 1
+                self.bytes_saved += sys.getsizeof(value)
+        return interned
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def stats(self):
+        return {'distinct': len(self._values), 'lookups': self.lookups,
+                'replaced': self.replaced, 'bytes_saved': self.bytes_saved}
+
+
+table = InternTable()
+
+
+def intern_text(text):
+    """ Return the shared copy of text from the process wide table
+    """
+    return table.intern(text)
+
+
+def stats():
+    return table.stats()
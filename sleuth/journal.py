@@ -0,0 +1,235 @@
+""" An append-only journal of the activities sleuth has applied.
+
+    The journal is a directory of numbered segment files. Each record is the
+    length of the activity xml on a line of its own, then the xml, then a
+    newline. Positions in the journal are (segment number, offset) tuples,
+    so they order the same way as the records. The segments from before the
+    last snapshot are deleted once it is saved, a restore does not need them.
+"""
+import logging
+import os
+import re
+import threading
+import time
+
+import lxml.etree
+from lxml import objectify as lxml_objectify
+
+import pt_api
+
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_NAME = 'activities-%010d.journal'
+SEGMENT_PATTERN = re.compile(r'^activities-(\d{10})\.journal$')
+
+
+class ActivityJournal(object):
+    """ Append records to the segments of a journal directory.
+
+        A new segment is started when the current one reaches segment_bytes.
+        Appends are fsynced in batches, once fsync_every records or
+        fsync_seconds seconds have been appended, whichever is first.
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024,
+                 fsync_every=100, fsync_seconds=1.0):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_every = fsync_every
+        self.fsync_seconds = fsync_seconds
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._synced_at = time.time()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        segments = list_segments(directory)
+        self._segment = segments[-1] if segments else 0
+        # Drop a record that was only partly written before a crash
+        end = 0
+        for (_, offset), record in read(directory, (self._segment, 0)):
+            end = offset + len('%d\n%s\n' % (len(record), record))
+        self._file = open(self._segment_path(self._segment), 'ab')
+        self._file.truncate(end)
+        self._file.seek(0, os.SEEK_END)
+        self._offset = self._file.tell()
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, SEGMENT_NAME % segment)
+
+    def position(self):
+        """ Return the position the next record will be appended at
+        """
+        with self._lock:
+            return (self._segment, self._offset)
+
+    def append(self, record):
+        """ Append the record, return the position it was written at
+        """
+        with self._lock:
+            if self._offset and self._offset + len(record) > self.segment_bytes:
+                self._rotate()
+            position = (self._segment, self._offset)
+            data = '%d\n%s\n' % (len(record), record)
+            self._file.write(data)
+            self._offset += len(data)
+            self._unsynced += 1
+            if (self._unsynced >= self.fsync_every or
+                    time.time() - self._synced_at >= self.fsync_seconds):
+                self._sync()
+        return position
+
+    def remove_before(self, position):
+        """ Delete the segments whose records are all from before position,
+            never the one being appended to. Return how many were deleted.
+        """
+        with self._lock:
+            last = min(position[0], self._segment)
+        removed = 0
+        for segment in list_segments(self.directory):
+            if segment >= last:
+                break
+            os.remove(self._segment_path(segment))
+            removed += 1
+        return removed
+
+    def _rotate(self):
+        self._sync()
+        self._file.close()
+        self._segment += 1
+        self._file = open(self._segment_path(self._segment), 'ab')
+        self._offset = 0
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._synced_at = time.time()
+
+    def sync(self):
+        """ fsync the records appended since the last fsync
+        """
+        with self._lock:
+            if self._unsynced:
+                self._sync()
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            self._file.close()
+
+
+def list_segments(directory):
+    """ Return the numbers of the segments in the journal directory, in order
+    """
+    segments = []
+    for name in os.listdir(directory):
+        match = SEGMENT_PATTERN.match(name)
+        if match:
+            segments.append(int(match.group(1)))
+    return sorted(segments)
+
+
+def read(directory, since=(0, 0)):
+    """ Yield the (position, record) pairs of the journal from since on.
+
+        Reading stops at a record that was only partly written.
+    """
+    for segment in list_segments(directory):
+        if segment < since[0]:
+            continue
+        path = os.path.join(directory, SEGMENT_NAME % segment)
+        with open(path, 'rb') as segment_file:
+            if segment == since[0]:
+                segment_file.seek(since[1])
+            while True:
+                offset = segment_file.tell()
+                header = segment_file.readline()
+                if not header:
+                    break
+                record = None
+                if header.endswith('\n') and header[:-1].isdigit():
+                    length = int(header)
+                    record = segment_file.read(length)
+                    if len(record) != length or segment_file.read(1) != '\n':
+                        record = None
+                if record is None:
+                    logger.warning('Partly written record at %s:%s' %
+                                   (path, offset))
+                    return
+                yield (segment, offset), record
+
+
+def _parse(records, parse):
+    """ Return the activities of the (position, record) pairs, skipping the
+        records parse returns None for
+    """
+    activities = []
+    for position, record in records:
+        activity = parse(record)
+        if activity is None:
+            logger.warning('Skipping the unparsable record at %s:%s' %
+                           position)
+            continue
+        activities.append(activity)
+    return activities
+
+
+def _objectify_batch(records):
+    """ Return the objectified activities of the (position, record) pairs.
+
+        They are parsed as the children of one document, which is quicker
+        than a document each. If a record is not one well formed element
+        they are parsed one by one instead, to skip only that one.
+    """
+    try:
+        activitiesxml = lxml_objectify.fromstring(
+            '<activities>%s</activities>' %
+            ''.join(record for _, record in records))
+    except lxml.etree.XMLSyntaxError:
+        activitiesxml = None
+    if (activitiesxml is None or
+            activitiesxml.countchildren() != len(records)):
+        return _parse(records, pt_api.objectify)
+    return list(activitiesxml.iterchildren())
+
+
+def replay(directory, apply, since=(0, 0), parse=None):
+    """ Call apply with every activity of the journal from since on, parsed
+        with parse (pt_api.objectify by default). Return how many there were.
+        Records parse returns None for are skipped.
+    """
+    if parse is None:
+        parse = pt_api.objectify
+    count = 0
+    for record in read(directory, since):
+        for activity in _parse([record], parse):
+            apply(activity)
+            count += 1
+    return count
+
+
+def replay_batches(directory, apply_batch, since=(0, 0), parse=None,
+                   batch_size=10000):
+    """ Like replay, but call apply_batch with lists of up to batch_size
+        activities, in order. Unless parse is given the records of a batch
+        are objectified together, see _objectify_batch.
+    """
+    if parse is None:
+        parse_batch = _objectify_batch
+    else:
+        parse_batch = lambda records: _parse(records, parse)
+    count = 0
+    records = []
+    for record in read(directory, since):
+        records.append(record)
+        if len(records) == batch_size:
+            batch = parse_batch(records)
+            apply_batch(batch)
+            count += len(batch)
+            records = []
+    if records:
+        batch = parse_batch(records)
+        apply_batch(batch)
+        count += len(batch)
+    return count
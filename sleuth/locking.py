@@ -0,0 +1,33 @@
+import contextlib
+import threading
+
+
+class StripedLock(object):
+    """ A fixed number of locks shared out between keys by their hash.
+
+        Keys that share a stripe serialise, all the others can be worked on
+        concurrently, without needing a lock per key.
+    """
+
+    def __init__(self, stripes=64):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def __len__(self):
+        return len(self._locks)
+
+    def __call__(self, key):
+        """ Return the lock for the key
+        """
+        return self._locks[hash(key) % len(self._locks)]
+
+    @contextlib.contextmanager
+    def all(self):
+        """ Hold every stripe, always taken in the same order
+        """
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(self._locks):
+                lock.release()
@@ -0,0 +1,84 @@
+class StoryObserver(object):
+    """ Told about every change Sleuth makes to its stories.
+
+        Sleuth calls story_added and story_removed with the structure lock
+        held, and the other methods with the story's lock held, so an
+        observer sees the changes of each story in the order they were made. The
+        calls must be quick, they hold up the activities.
+    """
+
+    def stories_reset(self, stories):
+        """ The stories dict was replaced, start again from stories
+        """
+
+    def story_added(self, story):
+        pass
+
+    def story_removed(self, story):
+        pass
+
+    def story_changed(self, story, changes):
+        """ changes is the list of (attribute, old value, new value) of the
+            story that Story.update returned
+        """
+
+    def note_added(self, story, note):
+        pass
+
+    def note_removed(self, story, note):
+        pass
+
+    def task_added(self, story, task):
+        pass
+
+    def task_removed(self, story, task):
+        pass
+
+    def task_changed(self, story, task, changes):
+        """ changes is the list of (attribute, old value, new value) of the
+            task that Task.update returned
+        """
+
+
+class TouchedStories(StoryObserver):
+    """ Collect the ids of the stories that are changed, for as long as it
+        is observing. story_id in touched_stories is True for every story
+        once the stories are reset.
+    """
+
+    def __init__(self):
+        self.story_ids = set()
+        self.reset = False
+        self._observing = False
+
+    def __contains__(self, story_id):
+        return self.reset or story_id in self.story_ids
+
+    def stories_reset(self, stories):
+        # The first reset is the one add_observer starts it with
+        self.reset = self.reset or self._observing
+        self._observing = True
+
+    def story_added(self, story):
+        self.story_ids.add(story.id)
+
+    def story_removed(self, story):
+        self.story_ids.add(story.id)
+
+    def story_changed(self, story, changes):
+        self.story_ids.add(story.id)
+
+    def note_added(self, story, note):
+        self.story_ids.add(story.id)
+
+    def note_removed(self, story, note):
+        self.story_ids.add(story.id)
+
+    def task_added(self, story, task):
+        self.story_ids.add(story.id)
+
+    def task_removed(self, story, task):
+        self.story_ids.add(story.id)
+
+    def task_changed(self, story, task, changes):
+        self.story_ids.add(story.id)
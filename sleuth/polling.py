@@ -0,0 +1,129 @@
+""" Poll each project for activities as often as it changes.
+
+    Every project has a poll interval of its own. A poll that finds new
+    activities brings the interval of the project down to min_interval, a
+    poll that finds none multiplies it by backoff, up to max_interval. So a
+    busy project is polled every few seconds, and one that has been idle
+    for a week every few minutes. All the projects share a budget of
+    requests per second: when it is spent, the projects that are due wait,
+    and the ones that have been due longest go first.
+"""
+import logging
+import operator
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class ProjectPoll(object):
+    """ When a project is next due to be polled, and how often it is
+    """
+
+    def __init__(self, project_id, interval, due):
+        self.project_id = project_id
+        self.interval = interval
+        self.due = due
+        self.polls = 0
+        self.activities = 0
+
+
+class AdaptivePoller(object):
+    """ Call collect with the ids of the projects that are due to be polled.
+
+        collect(project_ids) returns a dict of how many new activities it
+        found for each project, a project it could not poll is left out.
+        project_ids() returns the ids of the projects to poll, it is asked
+        every time so that projects can be added and removed.
+    """
+
+    def __init__(self, collect, project_ids, min_interval=1,
+                 max_interval=300, backoff=2.0, max_requests_per_second=5.0):
+        self.collect = collect
+        self.project_ids = project_ids
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.backoff = backoff
+        self.max_requests_per_second = max_requests_per_second
+        # A second's worth of requests can be made at once
+        self._budget_size = max(1.0, max_requests_per_second)
+        self._budget = self._budget_size
+        self._budget_at = time.time()
+        self._projects = {}
+        self._lock = threading.Lock()
+        self.deferred = 0
+
+    def _sync_projects(self, now):
+        project_ids = set(self.project_ids())
+        for project_id in project_ids.difference(self._projects):
+            self._projects[project_id] = ProjectPoll(project_id,
+                                                     self.min_interval, now)
+        for project_id in set(self._projects).difference(project_ids):
+            del self._projects[project_id]
+
+    def _take_due(self, now):
+        """ Return the projects that are due, as many as the budget allows
+        """
+        self._budget = min(self._budget_size,
+                           self._budget + (now - self._budget_at) *
+                           self.max_requests_per_second)
+        self._budget_at = now
+        due = sorted((project for project in self._projects.values()
+                      if project.due <= now),
+                     key=operator.attrgetter('due'))
+        polled = due[:int(self._budget)]
+        self._budget -= len(polled)
+        if len(polled) < len(due):
+            self.deferred += len(due) - len(polled)
+            logger.debug('Request budget spent, %s projects wait',
+                         len(due) - len(polled))
+        return polled
+
+    def poll(self):
+        """ Poll the projects that are due, return what collect returned
+        """
+        with self._lock:
+            now = time.time()
+            self._sync_projects(now)
+            polled = self._take_due(now)
+        if not polled:
+            return {}
+        try:
+            counts = self.collect([project.project_id for project in polled])
+        except Exception:
+            logger.exception('Problem polling projects %s' %
+                             [project.project_id for project in polled])
+            counts = {}
+        with self._lock:
+            now = time.time()
+            for project in polled:
+                count = counts.get(project.project_id)
+                if count:
+                    project.interval = self.min_interval
+                    project.activities += count
+                elif count is not None:
+                    project.interval = min(project.interval * self.backoff,
+                                           self.max_interval)
+                project.polls += 1
+                project.due = now + project.interval
+        return counts
+
+    def boost(self, project_id):
+        """ Poll the project as soon as the budget allows, and often after
+        """
+        with self._lock:
+            project = self._projects.get(project_id)
+            if project is not None:
+                project.interval = self.min_interval
+                project.due = time.time()
+
+    def stats(self):
+        with self._lock:
+            return {'deferred': self.deferred,
+                    'projects': dict(
+                        (project.project_id,
+                         {'interval': project.interval,
+                          'polls': project.polls,
+                          'activities': project.activities})
+                        for project in self._projects.values())}
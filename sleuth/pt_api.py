@@ -1,15 +1,25 @@
+import collections
+import copy
+import cStringIO
 import lxml
+import lxml.etree
 import logging
+import random
+import threading
 import urllib
+import urlparse
 import time
 import requests
+import requests.adapters
 
+from futures import ThreadPoolExecutor
 from lxml import objectify as lxml_objectify
 
 logger = logging.getLogger(__name__)
 
-URL_API3 = 'https://www.pivotaltracker.com/services/v3'
-URL_API4 = 'https://www.pivotaltracker.com/services/v4'
+URL_ROOT = 'https://www.pivotaltracker.com'
+URL_API3 = '%s/services/v3' % URL_ROOT
+URL_API4 = '%s/services/v4' % URL_ROOT
 BLOCKS = ['current', 'icebox', 'backlog', 'done']
 
 
@@ -17,8 +27,415 @@ class PT_APIException(Exception):
     pass
 
 
+class CircuitOpenError(PT_APIException):
+    """ Raised instead of calling a host that keeps failing
+    """
+
+
+class HTTPStatusError(PT_APIException):
+    """ Raised when the tracker answers with an error status, that is not
+        worth trying again
+    """
+
+    def __init__(self, message, status_code):
+        PT_APIException.__init__(self, message)
+        self.status_code = status_code
+
+
+# The answers that say to try again later
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+class TokenBucket(object):
+    """ Let through rate calls a second on average, and up to burst of them
+        at once. pause() holds every call for a while, as a Retry-After
+        asks.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, rate))
+        self._tokens = self.burst
+        self._updated_at = time.time()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+        self.waited = 0.0
+
+    def _wait_seconds(self):
+        now = time.time()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """ Wait until the call is let through
+        """
+        while True:
+            with self._lock:
+                wait = self._wait_seconds()
+                if not wait:
+                    return
+                self.waited += wait
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until,
+                                     time.time() + seconds)
+
+
+class CircuitBreaker(object):
+    """ Count the failures of calls to a host. After failures of them in a
+        row the circuit opens and no calls are let through for
+        reset_seconds, then one is, to try the host again.
+    """
+
+    def __init__(self, failures=5, reset_seconds=30):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self._failed = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def open(self):
+        return self._opened_at is not None
+
+    def allow(self):
+        """ Return True if a call can be made now
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.time() - self._opened_at >= self.reset_seconds:
+                # half open: let this call through, and no other until it
+                # has failed or succeeded
+                self._opened_at = time.time()
+                return True
+            return False
+
+    def succeeded(self):
+        with self._lock:
+            self._failed = 0
+            self._opened_at = None
+
+    def failed(self):
+        with self._lock:
+            self._failed += 1
+            if self._failed >= self.failures:
+                if self._opened_at is None:
+                    logger.warning('%s calls in a row failed, not calling'
+                                   ' the host for %ss', self._failed,
+                                   self.reset_seconds)
+                self._opened_at = time.time()
+
+
+def _retry_after(response):
+    """ Return the seconds the Retry-After header of response asks to wait
+    """
+    try:
+        return max(0, int(response.headers.get('Retry-After')))
+    except (TypeError, ValueError):
+        return None
+
+
+class APIClient(object):
+    """ A thread safe, keep-alive HTTP client for the Pivotal Tracker API.
+
+        Every thread gets its own requests.Session, so the TCP+TLS
+        connections it opens are reused between calls instead of doing a
+        new handshake each time. max_connections bounds the number of
+        requests in flight across all the threads sharing the client.
+        api_root replaces URL_ROOT in every url, which lets the tests point
+        the client at a local stand-in server.
+
+        All the calls share a TokenBucket of requests_per_second. A call
+        that is throttled, fails on the server or can not connect is tried
+        again up to retries times, after a random wait of up to backoff
+        seconds, doubled every time up to max_backoff, or after the
+        Retry-After the tracker asked for. Every host has a CircuitBreaker.
+    """
+
+    def __init__(self, max_connections=20, timeout=(5, 30), api_root=None,
+                 requests_per_second=10, retries=4, backoff=0.5,
+                 max_backoff=30, breaker_failures=5,
+                 breaker_reset_seconds=30):
+        self.timeout = timeout
+        self.api_root = api_root
+        self.limiter = TokenBucket(requests_per_second)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker_failures = breaker_failures
+        self.breaker_reset_seconds = breaker_reset_seconds
+        self._breakers = {}
+        self._breakers_lock = threading.Lock()
+        self._local = threading.local()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
+
+    def session(self):
+        """ Return the session of the calling thread, creating it if needed
+        """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=2,
+                                                    pool_maxsize=2)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers['Accept-Encoding'] = 'gzip, deflate'
+            self._local.session = session
+            with self._sessions_lock:
+                self._sessions.append(session)
+        return session
+
+    def url(self, url):
+        if self.api_root is not None and url.startswith(URL_ROOT):
+            return self.api_root + url[len(URL_ROOT):]
+        return url
+
+    def breaker(self, host):
+        """ Return the CircuitBreaker of the host
+        """
+        with self._breakers_lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker(
+                    self.breaker_failures, self.breaker_reset_seconds)
+            return breaker
+
+    def get(self, url, token, headers=None, stream=False):
+        """ GET the url and return the requests response. With stream the
+            body is left to be read from the response, which must be closed.
+
+            Raise PT_APIException when the call still fails once it has
+            been retried, HTTPStatusError when it fails in a way that is not
+            retried, and CircuitOpenError when the host is not called.
+        """
+        url = self.url(url)
+        host = urlparse.urlparse(url).netloc
+        breaker = self.breaker(host)
+        request_headers = {'X-TrackerToken': token}
+        if headers:
+            request_headers.update(headers)
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise CircuitOpenError('Not calling %s, it keeps failing' %
+                                       host)
+            self.limiter.acquire()
+            try:
+                with self._slots:
+                    response = self.session().get(
+                        url, headers=request_headers, timeout=self.timeout,
+                        stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                breaker.failed()
+                problem = repr(e)
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    breaker.succeeded()
+                    if response.status_code >= 400:
+                        response.close()
+                        raise HTTPStatusError(
+                            'GET %s failed with status %s' %
+                            (url, response.status_code),
+                            response.status_code)
+                    return response
+                if response.status_code == 429:
+                    # throttled, the host is up
+                    breaker.succeeded()
+                else:
+                    breaker.failed()
+                retry_after = _retry_after(response)
+                if retry_after is not None:
+                    self.limiter.pause(retry_after)
+                response.close()
+                problem = 'status %s' % response.status_code
+            if attempt >= self.retries:
+                raise PT_APIException('GET %s failed %s times, last with %s' %
+                                      (url, attempt + 1, problem))
+            delay = random.uniform(0, min(self.max_backoff,
+                                          self.backoff * 2 ** attempt))
+            logger.warning('GET %s failed with %s, trying again in %.1fs',
+                           url, problem, delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self):
+        """ Close the connections of every session the client created
+        """
+        with self._sessions_lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.close()
+        self._local = threading.local()
+
+
+_client = APIClient()
+
+
+def get_client():
+    return _client
+
+
+def set_client(client):
+    """ Replace the client shared by all the api calls, returning the old one
+    """
+    global _client
+    old_client, _client = _client, client
+    return old_client
+
+
 def APICall(url, token):
-    return requests.get(url, headers={'X-TrackerToken': token}).text
+    """ GET the url and return the undecoded body, for objectify to parse
+    """
+    return get_client().get(url, token).content
+
+
+class ResponseCache(object):
+    """ A cache of parsed responses, keyed by url, bounded by the bytes of
+        the bodies they were parsed from.
+
+        Each entry keeps the ETag and Last-Modified validators of the
+        response it was parsed from, so the next request for the url can be
+        conditional. The entries not used for max_idle seconds are evicted
+        first. When that does not make room for a new url it is not cached:
+        evicting the least recently used entry instead would never hit when
+        more urls than fit are requested in turn, as polling does. An entry
+        that is cached already is kept, evicting the least recently used
+        ones.
+    """
+
+    def __init__(self, max_bytes=128 * 1024 * 1024, max_idle=3600):
+        self.max_bytes = max_bytes
+        self.max_idle = max_idle
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+        # key: (etag, last_modified, value, size, used_at), least recently
+        # used first
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def validators(self, key):
+        """ Return the conditional request headers for the cached response
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return {}
+        etag, last_modified = entry[:2]
+        headers = {}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        if last_modified is not None:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def hit(self, key):
+        """ Count a hit and return the cached value
+        """
+        with self._lock:
+            entry = self._entries.pop(key)
+            self._entries[key] = entry[:4] + (time.time(),)
+            self.hits += 1
+        return entry[2]
+
+    def store(self, key, response_headers, value, size):
+        """ Count a miss and cache the value, parsed from a body of size
+            bytes, if the response can be validated and there is room for
+            it. Return whether it was cached.
+        """
+        etag = response_headers.get('ETag')
+        last_modified = response_headers.get('Last-Modified')
+        now = time.time()
+        with self._lock:
+            self.misses += 1
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry[3]
+            if etag is None and last_modified is None:
+                return False
+            while self._entries and self.bytes + size > self.max_bytes:
+                oldest_key, oldest = next(self._entries.iteritems())
+                if entry is None and now - oldest[4] < self.max_idle:
+                    break
+                del self._entries[oldest_key]
+                self.bytes -= oldest[3]
+                self.evictions += 1
+            if self.bytes + size > self.max_bytes:
+                self.rejections += 1
+                return False
+            self._entries[key] = (etag, last_modified, value, size, now)
+            self.bytes += size
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return {'entries': len(self._entries), 'bytes': self.bytes,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'rejections': self.rejections}
+
+
+response_cache = ResponseCache()
+
+
+def cached_call(url, token, parse, copy_value, key=None, cache=None):
+    """ GET the url with a conditional request and return parse(data).
+
+        When the tracker answers 304 Not Modified the value parsed from the
+        previous response is used, without parsing anything. The cache
+        keeps what parse returned and the caller gets copy_value of it,
+        so that the objects it keeps and changes are never the cached ones.
+        Raise HTTPStatusError for any other answer than 200.
+    """
+    if key is None:
+        key = url
+    if cache is None:
+        cache = response_cache
+    response = get_client().get(url, token, headers=cache.validators(key))
+    if response.status_code == 304:
+        try:
+            return copy_value(cache.hit(key))
+        except KeyError:
+            # evicted while the request was in flight
+            response = get_client().get(url, token)
+    if response.status_code != 200:
+        raise HTTPStatusError('GET %s answered with status %s' %
+                              (url, response.status_code),
+                              response.status_code)
+    data = response.content
+    value = parse(data)
+    if cache.store(key, response.headers, value, len(data)):
+        return copy_value(value)
+    return value
+
+
+def _copy_stories(stories):
+    """ Return a copy of the lists of stories get_stories returns, copying
+        each story with its copy method where it has one, see Story.copy
+    """
+    return [[story.copy() if hasattr(story, 'copy') else copy.deepcopy(story)
+             for story in iteration]
+            for iteration in stories]
 
 
 class StorySearch():
@@ -53,87 +470,348 @@ class StorySearch():
         return data
 
 
+# The functions iterparse_stories builds the stories, notes and tasks with
+StoryBuilder = collections.namedtuple('StoryBuilder', ['story', 'note', 'task'])
+
+STORY_FIELDS = {'story_type': unicode, 'url': unicode, 'estimate': int,
+                'current_state': unicode, 'description': unicode,
+                'name': unicode, 'requested_by': unicode, 'owned_by': unicode,
+                'created_at': unicode, 'accepted_at': unicode,
+                'labels': unicode}
+
+
+def _child_texts(element):
+    return dict((child.tag, child.text) for child in element)
+
+
+def _unicode(text):
+    return unicode(text) if text is not None else u''
+
+
+def iterparse_stories(source, project_id, builder):
+    """ Yield the stories of the iterations or stories xml in the file like
+        source, as they are parsed.
+
+        The stories, notes and tasks are built straight from the elements
+        with the StoryBuilder builder: builder.story(project_id, story_id,
+        fields, notes, tasks), builder.note(note_id, text, author, noted_at)
+        and builder.task(task_id, description, created_at, position,
+        complete). Each story element is cleared once it is built, so the
+        whole document is never held in memory. Raise PT_APIException once
+        it is parsed if it is not stories xml, like an error message.
+    """
+    context = lxml.etree.iterparse(source, events=('end',), tag='story')
+    for _, storyxml in context:
+        story_id = None
+        fields = {}
+        notes = None
+        tasks = None
+        for child in storyxml:
+            tag = child.tag
+            if tag == 'id':
+                story_id = int(child.text)
+            elif tag in STORY_FIELDS:
+                attr_type = STORY_FIELDS[tag]
+                if attr_type is int:
+                    fields[tag] = int(child.text) if child.text else None
+                else:
+                    fields[tag] = _unicode(child.text)
+            elif tag == 'notes':
+                notes = {}
+                for notexml in child:
+                    values = _child_texts(notexml)
+                    note = builder.note(int(values['id']),
+                                        _unicode(values.get('text')),
+                                        _unicode(values.get('author')),
+                                        _unicode(values.get('noted_at')))
+                    notes[note.id] = note
+            elif tag == 'tasks':
+                tasks = {}
+                for taskxml in child:
+                    values = _child_texts(taskxml)
+                    task = builder.task(int(values['id']),
+                                        _unicode(values.get('description')),
+                                        _unicode(values.get('created_at')),
+                                        int(values.get('position') or -1),
+                                        values.get('complete') == 'true')
+                    tasks[task.id] = task
+        yield builder.story(project_id, story_id, fields, notes, tasks)
+        storyxml.clear()
+        while storyxml.getprevious() is not None:
+            del storyxml.getparent()[0]
+    _check_stories_root(context.root)
+
+
+def _check_stories_root(root):
+    """ Raise PT_APIException unless root is the root of stories xml, or
+        of a story, so an error message is never taken for no stories
+    """
+    if root is None or root.tag not in ('iterations', 'stories', 'story'):
+        raise PT_APIException('Not stories xml: %s' %
+                              (None if root is None else '<%s>' % root.tag))
+
+
 def get_stories(project_id, block, token, story_constructor=lambda project_id,
-                storyxml: storyxml):
+                storyxml: storyxml, story_builder=None):
     """ Return the stories for all the stories in the block eg current,
         for project with ID project_id
+
+        With a StoryBuilder story_builder the stories are streamed with
+        iterparse_stories, instead of objectified and built with
+        story_constructor.
     """
     if block not in BLOCKS:
         value_error_tmpl = 'The block value must be in %s, not %s'
         raise ValueError(value_error_tmpl % (BLOCKS, block))
 
-    stories = []
     if block == 'icebox':
         # icebox stories are 'unscheduled', can't query directly for icebox
         # stories, like we can with the other blocks
         story_search = StorySearch(project_id).filter_by_states(['unscheduled'])
-        data = story_search.get(token)
-        storiesxml = objectify(data)
-        if storiesxml is not None:
+        url = story_search.url
+
+        def parse(data):
+            stories = []
+            storiesxml = objectify(data)
+            _check_stories_root(storiesxml)
             stories.append([story_constructor(project_id, storyxml)
-                            for storyxml
-                            in storiesxml.iterchildren()])
+                            for storyxml in storiesxml.iterchildren()])
+            return stories
     else:
         if block == "done":
             url_tmpl = '%s/projects/%s/iterations/%s?offset=-6'
             url = url_tmpl % (URL_API3, project_id, block)
         else:
             url = '%s/projects/%s/iterations/%s' % (URL_API3, project_id, block)
-        data = APICall(url, token)
-        iterations = objectify(data)
-        try:
-            for iteration in iterations.iterchildren():
-                try:
-                    stories.append([story_constructor(project_id, storyxml)
-                                    for storyxml
-                                    in iteration.stories.iterchildren()])
-                except Exception:
-                    logger.exception("Problem loading stories from iteration")
-        except Exception:
-            logger.exception(dir(iterations))
 
-    return stories
+        def parse(data):
+            stories = []
+            iterations = objectify(data)
+            _check_stories_root(iterations)
+            try:
+                for iteration in iterations.iterchildren():
+                    try:
+                        stories.append([story_constructor(project_id, storyxml)
+                                        for storyxml
+                                        in iteration.stories.iterchildren()])
+                    except Exception:
+                        logger.exception("Problem loading stories from iteration")
+            except Exception:
+                logger.exception(dir(iterations))
+            return stories
+
+    if story_builder is not None:
+        def parse(data):
+            # cStringIO reads the body in place, io.BytesIO would copy it
+            source = cStringIO.StringIO(data)
+            return [list(iterparse_stories(source, project_id,
+                                           story_builder))]
 
+    return cached_call(url, token, parse, _copy_stories,
+                       key=(url, story_constructor, story_builder))
 
-def get_project_activities(project_id, since, token):
+
+def get_story(project_id, story_id, token, story_builder):
+    """ Return the story of the project, built with the StoryBuilder
+        story_builder, or None if the tracker has no such story
+    """
+    url = '%s/projects/%s/stories/%s' % (URL_API3, project_id, story_id)
+    try:
+        response = get_client().get(url, token)
+    except HTTPStatusError as e:
+        if e.status_code == 404:
+            return None
+        raise
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        raise HTTPStatusError('GET %s answered with status %s' %
+                              (url, response.status_code),
+                              response.status_code)
+    stories = list(iterparse_stories(cStringIO.StringIO(response.content),
+                                     project_id, story_builder))
+    return stories[0] if stories else None
+
+
+def _since_param(since):
     # 2010/3/15%0000:00:00%20PST
-    since = "%s%s%s%s%s%s%s" % (since.strftime('%Y/'),
-                                str(since.month),
-                                since.strftime('/%d'),
-                                '%00',
-                                since.strftime('%H:%M:%S'),
-                                '%20',
-                                time.tzname[0])
-    url_tmpl = '%s/projects/%s/activities?occurred_since_date=%s'
-    data = APICall(url_tmpl % (URL_API4, project_id, since), token)
-    activitiesxml = objectify(data)
+    return "%s%s%s%s%s%s%s" % (since.strftime('%Y/'),
+                               str(since.month),
+                               since.strftime('/%d'),
+                               '%00',
+                               since.strftime('%H:%M:%S'),
+                               '%20',
+                               time.tzname[0])
+
+
+class ActivityCounters(object):
+    """ Count the activities the activity streams downloaded, with their
+        bytes, and the ones they skipped without objectifying them
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.bytes = 0
+        self.activities = 0
+        self.skipped = 0
+
+    def count(self, data_bytes, activities, skipped):
+        with self._lock:
+            self.requests += 1
+            self.bytes += data_bytes
+            self.activities += activities
+            self.skipped += skipped
+
+    def stats(self):
+        return {'requests': self.requests, 'bytes': self.bytes,
+                'activities': self.activities, 'skipped': self.skipped}
+
+
+activity_counters = ActivityCounters()
+
+# The v4 names of the event types and elements that sleuth knows by their
+# v3 names: v4 calls the notes of a story comments
+V4_EVENT_TYPES = {'comment_create': 'note_create'}
+V4_TAGS = {'comments': 'notes', 'comment': 'note'}
+
+
+def _translate_activity(activityxml, event_type):
+    """ Rename the v4 event type and elements of activityxml to their v3
+        names, in place
+    """
+    activityxml.find('event_type')._setText(event_type)
+    stories = activityxml.find('stories')
+    if stories is not None:
+        for element in stories.iter(*V4_TAGS):
+            element.tag = V4_TAGS[element.tag]
+
+
+def parse_activities(chunks, event_types, counters=None):
+    """ Return the objectified activities xml of the chunks of v4 activities
+        xml, with only the activities of event_types, translated to v3.
+
+        The activities are filtered as they are parsed, the ones that are not
+        wanted are dropped before they are objectified. Raise
+        PT_APIException if the xml is not well formed, or is not a list of
+        activities, like an error message or a maintenance page.
+    """
+    if counters is None:
+        counters = activity_counters
+    parser = lxml.etree.XMLPullParser(events=('end',), tag='activity',
+                                      remove_blank_text=True)
+    parser.set_element_class_lookup(
+        lxml_objectify.ObjectifyElementClassLookup())
+    data_bytes = activities = skipped = 0
+    try:
+        for chunk in chunks:
+            data_bytes += len(chunk)
+            parser.feed(chunk)
+            for _, activityxml in parser.read_events():
+                activities += 1
+                v4_event_type = activityxml.findtext('event_type')
+                event_type = V4_EVENT_TYPES.get(v4_event_type, v4_event_type)
+                if event_type in event_types:
+                    # Only the renamed event types have their elements
+                    # renamed, the others are handled by their v4 names,
+                    # like the comments of a comment_delete
+                    if event_type != v4_event_type:
+                        _translate_activity(activityxml, event_type)
+                else:
+                    skipped += 1
+                    activityxml.getparent().remove(activityxml)
+            # An element made while parsing may not be typed the way
+            # objectify types it in the finished tree, so none are kept
+            activityxml = None
+        activitiesxml = parser.close()
+    except lxml.etree.XMLSyntaxError as e:
+        raise PT_APIException('Not well formed activities xml: %s' % e)
+    finally:
+        counters.count(data_bytes, activities, skipped)
+    if activitiesxml.tag != 'activities':
+        raise PT_APIException('Not activities xml: <%s>' % activitiesxml.tag)
     return activitiesxml
 
 
-def get_project_activities_v3(project_id, since, token):
-    # 2010/3/15%0000:00:00%20PST
-    since = "%s%s%s%s%s%s%s" % (since.strftime('%Y/'),
-                                str(since.month),
-                                since.strftime('/%d'),
-                                '%00',
-                                since.strftime('%H:%M:%S'),
-                                '%20',
-                                time.tzname[0])
+def stream_project_activities(project_id, since, token, event_types,
+                              chunk_size=64 * 1024):
+    """ Return the activities of the project since, with only the ones of
+        event_types, see parse_activities. One v4 request covers all the
+        event types sleuth applies.
+    """
     url_tmpl = '%s/projects/%s/activities?occurred_since_date=%s'
-    data = APICall(url_tmpl % (URL_API3, project_id, since), token)
-    activitiesxml = objectify(data)
-    return activitiesxml
+    response = get_client().get(
+        url_tmpl % (URL_API4, project_id, _since_param(since)), token,
+        stream=True)
+    try:
+        if not 200 <= response.status_code < 300:
+            raise HTTPStatusError('Activities of %s: status %s' %
+                                  (project_id, response.status_code),
+                                  response.status_code)
+        return parse_activities(response.iter_content(chunk_size),
+                                event_types)
+    finally:
+        response.close()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """ Return the executor the async calls use when they are not given one
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=20)
+        return _executor
+
+
+def get_stories_async(project_id, block, token, story_constructor,
+                      story_builder=None, executor=None):
+    """ Return a future of get_stories
+    """
+    executor = executor or get_executor()
+    return executor.submit(get_stories, project_id, block, token,
+                           story_constructor, story_builder)
+
+
+def get_story_async(project_id, story_id, token, story_builder,
+                    executor=None):
+    """ Return a future of get_story
+    """
+    executor = executor or get_executor()
+    return executor.submit(get_story, project_id, story_id, token,
+                           story_builder)
+
+
+def stream_project_activities_async(project_id, since, token, event_types,
+                                    executor=None):
+    """ Return a future of stream_project_activities
+    """
+    executor = executor or get_executor()
+    return executor.submit(stream_project_activities, project_id, since,
+                           token, event_types)
 
 
 def objectify(some_xml):
-    ''' Safely objectify the xml
+    ''' Safely objectify the xml, bytes or a file like object. Return None
+        if it is not well formed.
+
+        The bytes are handed to lxml as they are, so it decodes them as the
+        xml declaration says. unicode is encoded as utf-8 first.
     '''
     try:
-        return lxml_objectify.fromstring(some_xml.replace(' encoding="UTF-8"', ""))
+        if isinstance(some_xml, unicode):
+            some_xml = some_xml.encode('utf-8')
+        if not isinstance(some_xml, str) and hasattr(some_xml, 'read'):
+            return lxml_objectify.parse(some_xml).getroot()
+        return lxml_objectify.fromstring(some_xml)
     except Exception:
-        logger.exception("Problem objectifying the xml \n %s" % some_xml)
-        import sys
-        sys.exit(1)
+        # An error page from a throttled or failing call, say. The callers
+        # treat None as no data, and carry on.
+        logger.exception('Problem objectifying the xml \n %s', some_xml)
         return None
 
 
@@ -0,0 +1,119 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class Job(object):
+    """ A function the scheduler runs every interval seconds
+    """
+
+    def __init__(self, name, interval, function, executor=None):
+        self.name = name
+        self.interval = interval
+        self.function = function
+        self.executor = executor
+        self.future = None
+        self.cancelled = False
+
+    @property
+    def running(self):
+        return self.future is not None and not self.future.done()
+
+    def run(self):
+        """ Run the function, in the executor if the job has one. A job
+            that is still running from last time is not started again.
+        """
+        if self.executor is None:
+            try:
+                self.function()
+            except Exception:
+                logger.exception('Problem running job %s' % self.name)
+        elif not self.running:
+            self.future = self.executor.submit(self.function)
+            self.future.add_done_callback(self._log_exception)
+        else:
+            logger.warning('Job %s is still running, skipping it' % self.name)
+
+    def _log_exception(self, future):
+        if future.exception() is not None:
+            logger.error('Problem running job %s: %r' %
+                         (self.name, future.exception()))
+
+
+class Scheduler(object):
+    """ Run jobs, each at its own interval, from a single loop.
+
+        The loop sleeps until the next job is due. Jobs without an executor
+        run in the loop, and the next run is interval seconds after they
+        finish. Jobs with an executor are handed to it, so a slow one does
+        not hold up the others. Jobs can be added and cancelled while the
+        loop is running.
+    """
+
+    def __init__(self):
+        self._queue = []
+        self._jobs = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def every(self, interval, function, name=None, executor=None, delay=0):
+        """ Run function every interval seconds, the first time after delay
+        """
+        if name is None:
+            name = function.__name__
+        job = Job(name, interval, function, executor=executor)
+        with self._lock:
+            if name in self._jobs:
+                self._jobs[name].cancelled = True
+            self._jobs[name] = job
+            self._push(time.time() + delay, job)
+        return job
+
+    def cancel(self, name):
+        with self._lock:
+            job = self._jobs.pop(name, None)
+        if job is not None:
+            job.cancelled = True
+
+    def jobs(self):
+        with self._lock:
+            return dict(self._jobs)
+
+    def _push(self, due, job):
+        heapq.heappush(self._queue, (due, next(self._counter), job))
+
+    def _pop(self):
+        with self._lock:
+            while self._queue:
+                due, _, job = heapq.heappop(self._queue)
+                if not job.cancelled:
+                    return due, job
+        return None, None
+
+    def run_next(self, idle_seconds=1):
+        """ Wait for the next job to be due and run it
+        """
+        due, job = self._pop()
+        if job is None:
+            time.sleep(idle_seconds)
+            return
+        delay = due - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        if job.cancelled:
+            return
+        job.run()
+        with self._lock:
+            if not job.cancelled:
+                self._push(time.time() + job.interval, job)
+
+    def run(self, keep_running=lambda: True):
+        """ Run the jobs for as long as keep_running() returns True
+        """
+        while keep_running():
+            self.run_next()
@@ -0,0 +1,69 @@
+""" Save and load snapshots of the state of a Sleuth, so that it can resume
+    polling after a restart instead of reloading every story.
+
+    A snapshot file is a header line with the format version and the CRC32
+    of the data, followed by the data: the zlib compressed pickle of the
+    state dict.
+"""
+import cPickle as pickle
+import datetime
+import os
+import tempfile
+import zlib
+
+
+FORMAT_VERSION = 1
+MAGIC = 'sleuth-snapshot'
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def save(path, state):
+    """ Atomically write the state dict to path, with the time it was saved
+    """
+    state = dict(state, saved_at=datetime.datetime.utcnow())
+    data = zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temp_path = tempfile.mkstemp(dir=directory,
+                                         prefix='.sleuth-snapshot-')
+    try:
+        with os.fdopen(handle, 'wb') as temp_file:
+            temp_file.write('%s %d %d\n' % (MAGIC, FORMAT_VERSION,
+                                            zlib.crc32(data)))
+            temp_file.write(data)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.rename(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def load(path, max_age=None):
+    """ Return the state dict saved at path.
+
+        Raise SnapshotError when there is no snapshot, when it is corrupt or
+        from another format version, or when it is older than max_age
+        (a timedelta).
+    """
+    try:
+        with open(path, 'rb') as snapshot_file:
+            header = snapshot_file.readline().split()
+            if header[:2] != [MAGIC, str(FORMAT_VERSION)]:
+                raise SnapshotError('Unknown snapshot format %r' % header)
+            data = snapshot_file.read()
+            if zlib.crc32(data) != int(header[2]):
+                raise SnapshotError('The snapshot %s is corrupt' % path)
+            state = pickle.loads(zlib.decompress(data))
+    except SnapshotError:
+        raise
+    except Exception as e:
+        raise SnapshotError('Can not load snapshot %s: %r' % (path, e))
+    if max_age is not None:
+        age = datetime.datetime.utcnow() - state['saved_at']
+        if age > max_age:
+            raise SnapshotError('The snapshot is stale, it is %s old' % age)
+    return state
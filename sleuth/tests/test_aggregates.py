@@ -0,0 +1,66 @@
+import unittest2
+
+from sleuth.aggregates import PointAggregates
+from sleuth import Story
+
+
+def make_story(story_id, project_id, current_state, owned_by, estimate):
+    return Story(story_id, project_id, u'feature', None, estimate, current_state, None, u'name', None, owned_by,
+                 None, None, None, None, None)
+
+
+class Test_PointAggregates(unittest2.TestCase):
+
+    def setUp(self):
+        self.aggregates = PointAggregates()
+        self.stories = {1: make_story(1, 1, u'delivered', u'Rob', 3),
+                        2: make_story(2, 1, u'started', u'Dana', 2),
+                        3: make_story(3, 2, u'delivered', u'Rob', None),
+                        4: make_story(4, 2, u'delivered', None, -1)}
+        self.aggregates.stories_reset(self.stories)
+
+    def test_reset(self):
+        # action / confirm
+        self.assertEqual(self.aggregates.points('current_state'), {u'delivered': 3, u'started': 2})
+        self.assertEqual(self.aggregates.counts('current_state'), {u'delivered': 3, u'started': 1})
+        self.assertEqual(self.aggregates.points('project_id'), {1: 5, 2: 0})
+        self.assertEqual(self.aggregates.points('owned_by'), {u'Rob': 3, u'Dana': 2, None: 0})
+
+    def test_added_and_removed(self):
+        # action
+        self.aggregates.story_added(make_story(5, 3, u'accepted', u'Dana', 5))
+        self.aggregates.story_removed(self.stories[2])
+
+        # confirm
+        self.assertEqual(self.aggregates.points('current_state'), {u'delivered': 3, u'accepted': 5})
+        self.assertEqual(self.aggregates.points('owned_by'), {u'Rob': 3, u'Dana': 5, None: 0})
+        self.assertEqual(self.aggregates.counts('project_id'), {1: 1, 2: 2, 3: 1})
+
+    def test_changed(self):
+        # setup
+        story = self.stories[1]
+        story.current_state = u'accepted'
+        story.estimate = 5
+        story.project_id = 2
+
+        # action
+        self.aggregates.story_changed(story, [('current_state', u'delivered', u'accepted'), ('estimate', 3, 5),
+                                              ('project_id', 1, 2), ('name', u'name', u'new name')])
+
+        # confirm
+        self.assertEqual(self.aggregates.points('current_state'), {u'delivered': 0, u'started': 2, u'accepted': 5})
+        self.assertEqual(self.aggregates.points('project_id'), {1: 2, 2: 5})
+        self.assertEqual(self.aggregates.points('owned_by'), {u'Rob': 5, u'Dana': 2, None: 0})
+        self.assertEqual(self.aggregates.check(self.stories), {})
+
+    def test_check(self):
+        # setup
+        self.stories[2].owned_by = u'Rob'
+
+        # action
+        drift = self.aggregates.check(self.stories)
+
+        # confirm
+        self.assertEqual(drift, {('owned_by', u'Rob'): (3, 2, 5, 3), ('owned_by', u'Dana'): (2, 1, 0, 0)})
+        self.assertEqual(self.aggregates.points('owned_by'), {u'Rob': 5, None: 0})
+        self.assertEqual(self.aggregates.check(self.stories), {})
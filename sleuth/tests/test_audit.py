@@ -0,0 +1,39 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest2
+
+from mock import MagicMock
+
+from sleuth.audit import AuditLog
+from sleuth.changes import ChangeFeed
+
+
+class Test_AuditLog(unittest2.TestCase):
+
+    def test_write(self):
+        # setup
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'audit.log')
+        feed = ChangeFeed()
+        audit_log = AuditLog(feed, path)
+
+        # action
+        feed.story_changed(MagicMock(id=1), [('current_state', u'started', u'finished'), ('labels', [], [u'ui'])])
+        feed.task_added(MagicMock(id=1), MagicMock(id=2))
+        while audit_log.subscription.stats()['delivered'] < 3:
+            pass
+        audit_log.close()
+
+        # confirm
+        with open(path) as audit_file:
+            records = [json.loads(line) for line in audit_file]
+        for record in records:
+            self.assertIsInstance(record.pop('at'), float)
+        self.assertEqual(records, [
+            {'kind': 'story_changed', 'story_id': 1, 'item_id': None, 'field': 'current_state', 'old': 'started',
+             'new': 'finished'},
+            {'kind': 'story_changed', 'story_id': 1, 'item_id': None, 'field': 'labels', 'old': [], 'new': ['ui']},
+            {'kind': 'task_added', 'story_id': 1, 'item_id': 2, 'field': None, 'old': None, 'new': None}])
@@ -0,0 +1,92 @@
+import threading
+import unittest2
+
+from mock import MagicMock
+
+from sleuth.changes import Change, ChangeFeed
+
+
+class Test_ChangeFeed(unittest2.TestCase):
+
+    def test_publish(self):
+        # setup
+        feed = ChangeFeed()
+        first = feed.subscribe()
+        second = feed.subscribe()
+        story = MagicMock(id=1)
+        task = MagicMock(id=2)
+
+        # action
+        feed.story_changed(story, [('current_state', u'started', u'finished'), ('estimate', 1, 2)])
+        feed.task_changed(story, task, [('complete', False, True)])
+        feed.story_removed(story)
+
+        # confirm
+        expected = [Change('story_changed', 1, None, 'current_state', u'started', u'finished'),
+                    Change('story_changed', 1, None, 'estimate', 1, 2),
+                    Change('task_changed', 1, 2, 'complete', False, True),
+                    Change('story_removed', 1, None, None, None, None)]
+        self.assertEqual(first.get_batch(timeout=0), expected)
+        self.assertEqual(second.get_batch(timeout=0), expected)
+        self.assertEqual(first.get_batch(timeout=0), [])
+
+    def test_batches(self):
+        # setup
+        feed = ChangeFeed()
+        subscription = feed.subscribe(batch_size=2)
+
+        # action
+        for story_id in range(5):
+            feed.story_added(MagicMock(id=story_id))
+
+        # confirm
+        self.assertEqual([[change.story_id for change in subscription.get_batch(timeout=0)] for _ in range(3)],
+                         [[0, 1], [2, 3], [4]])
+        self.assertEqual(subscription.stats(), {'queued': 0, 'delivered': 5, 'dropped': 0})
+
+    def test_slow_subscriber_drops(self):
+        # setup
+        feed = ChangeFeed()
+        slow = feed.subscribe(queue_size=2)
+        fast = feed.subscribe(queue_size=10)
+
+        # action
+        for story_id in range(5):
+            feed.story_added(MagicMock(id=story_id))
+
+        # confirm
+        self.assertEqual([change.story_id for change in slow.get_batch(timeout=0)], [0, 1])
+        self.assertEqual(slow.dropped, 3)
+        self.assertEqual([change.story_id for change in fast.get_batch(timeout=0)], [0, 1, 2, 3, 4])
+
+    def test_unsubscribe(self):
+        # setup
+        feed = ChangeFeed()
+        subscription = feed.subscribe()
+
+        # action
+        subscription.close()
+        feed.story_added(MagicMock(id=1))
+
+        # confirm
+        self.assertEqual(subscription.get_batch(timeout=0), [])
+
+    def test_start(self):
+        # setup
+        feed = ChangeFeed()
+        subscription = feed.subscribe()
+        batches = []
+        handled = threading.Event()
+
+        def handler(batch):
+            batches.append(batch)
+            handled.set()
+
+        # action
+        subscription.start(handler, timeout=0.01)
+        feed.note_added(MagicMock(id=1), MagicMock(id=3))
+        handled.wait(5)
+        subscription.close()
+
+        # confirm
+        self.assertEqual(batches, [[Change('note_added', 1, 3, None, None, None)]])
@@ -0,0 +1,69 @@
+import datetime
+import unittest2
+
+from sleuth.dedup import RecentActivities
+
+
+class Test_RecentActivities(unittest2.TestCase):
+
+    def setUp(self):
+        self.start = datetime.datetime(2013, 8, 7, 20, 33, 30)
+
+    def test_add(self):
+        # setup
+        recent_activities = RecentActivities()
+
+        # action
+        added = recent_activities.add(1, self.start)
+        added_again = recent_activities.add(1, self.start)
+
+        # confirm
+        self.assertTrue(added)
+        self.assertFalse(added_again)
+        self.assertIn(1, recent_activities)
+        self.assertNotIn(2, recent_activities)
+        self.assertEqual(len(recent_activities), 1)
+
+    def test_max_size(self):
+        # setup
+        recent_activities = RecentActivities(max_size=2)
+
+        # action
+        for activity_id in [1, 2, 3]:
+            recent_activities.add(activity_id, self.start)
+
+        # confirm
+        self.assertNotIn(1, recent_activities)
+        self.assertIn(2, recent_activities)
+        self.assertIn(3, recent_activities)
+
+    def test_expire(self):
+        # setup
+        recent_activities = RecentActivities()
+        for seconds, activity_id in [(0, 1), (5, 2), (10, 3)]:
+            recent_activities.add(activity_id, self.start + datetime.timedelta(seconds=seconds))
+
+        # action
+        recent_activities.expire(self.start + datetime.timedelta(seconds=5))
+
+        # confirm
+        self.assertNotIn(1, recent_activities)
+        self.assertIn(2, recent_activities)
+        self.assertIn(3, recent_activities)
+        self.assertEqual(len(recent_activities), 2)
+
+    def test_discard(self):
+        # setup
+        recent_activities = RecentActivities(max_size=2)
+        for activity_id in [1, 2]:
+            recent_activities.add(activity_id, self.start)
+
+        # action
+        recent_activities.discard([1, 5])
+        recent_activities.add(3, self.start)
+
+        # confirm
+        self.assertNotIn(1, recent_activities)
+        self.assertIn(2, recent_activities)
+        self.assertIn(3, recent_activities)
+        self.assertEqual(len(recent_activities), 2)
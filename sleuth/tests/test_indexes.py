@@ -0,0 +1,118 @@
+import datetime
+import unittest2
+
+from sleuth.indexes import StoryIndexes, TimeIndex, parse_timestamp
+from sleuth import Story
+
+
+def make_story(story_id, project_id, current_state, owned_by, labels=None):
+    return Story(story_id, project_id, u'feature', None, 1, current_state, None, u'name', None, owned_by,
+                 None, None, None, None, labels)
+
+
+class Test_StoryIndexes(unittest2.TestCase):
+
+    def setUp(self):
+        self.indexes = StoryIndexes()
+        self.stories = {1: make_story(1, 1, u'delivered', u'Rob', u'ui'),
+                        2: make_story(2, 1, u'delivered', u'Dana'),
+                        3: make_story(3, 2, u'delivered', u'Rob', u'ui,api'),
+                        4: make_story(4, 1, u'started', u'Rob', u'api')}
+        self.indexes.stories_reset(self.stories)
+
+    def test_query(self):
+        # action / confirm
+        self.assertEqual(self.indexes.query(project_id=1, current_state=u'delivered', owned_by=u'Rob'), set([1]))
+        self.assertEqual(self.indexes.query(label=u'api'), set([3, 4]))
+        self.assertEqual(self.indexes.query(current_state=u'delivered', label=u'ui'), set([1, 3]))
+        self.assertEqual(self.indexes.query(project_id=3), set())
+
+    def test_query_unknown_field(self):
+        # action / confirm
+        self.assertRaises(ValueError, self.indexes.query, name=u'name')
+
+    def test_story_added_and_removed(self):
+        # setup
+        story = make_story(5, 1, u'delivered', u'Rob', u'ui')
+
+        # action
+        self.indexes.story_added(story)
+        added = self.indexes.query(project_id=1, label=u'ui')
+        self.indexes.story_removed(self.stories[1])
+        self.indexes.story_removed(story)
+
+        # confirm
+        self.assertEqual(added, set([1, 5]))
+        self.assertEqual(self.indexes.query(label=u'ui'), set([3]))
+        self.assertEqual(sorted(self.indexes.values('owned_by')), [u'Dana', u'Rob'])
+
+    def test_story_changed(self):
+        # setup
+        story = self.stories[1]
+
+        # action
+        self.indexes.story_changed(story, [('current_state', u'delivered', u'accepted'),
+                                           ('labels', [u'ui'], [u'api']),
+                                           ('project_id', 1, 2),
+                                           ('name', u'name', u'new name')])
+
+        # confirm
+        self.assertEqual(self.indexes.query(current_state=u'accepted'), set([1]))
+        self.assertEqual(self.indexes.query(label=u'api', project_id=2), set([1, 3]))
+        self.assertEqual(self.indexes.query(label=u'ui'), set([3]))
+        self.assertEqual(self.indexes.query(project_id=1), set([2, 4]))
+
+
+class Test_parse_timestamp(unittest2.TestCase):
+
+    def test_formats(self):
+        # action / confirm
+        self.assertEqual(parse_timestamp(u'2009/03/16 16:55:04 UTC'), 1237222504)
+        self.assertEqual(parse_timestamp(u'2009-03-16T16:55:04Z'), 1237222504)
+        self.assertIsNone(parse_timestamp(None))
+        self.assertIsNone(parse_timestamp(u'yesterday'))
+
+
+class Test_TimeIndex(unittest2.TestCase):
+
+    def setUp(self):
+        self.time_index = TimeIndex()
+        self.stories = {}
+        for story_id, accepted_at in [(1, u'2013/08/03 10:00:00 UTC'), (2, u'2013/08/01 10:00:00 UTC'),
+                                      (3, None), (4, u'2013/08/02 10:00:00 UTC')]:
+            story = make_story(story_id, 1, u'accepted', u'Rob')
+            story.accepted_at = accepted_at
+            self.stories[story_id] = story
+        self.time_index.stories_reset(self.stories)
+
+    def test_between(self):
+        # action / confirm
+        self.assertEqual(self.time_index.between('accepted_at'), [2, 4, 1])
+        self.assertEqual(self.time_index.between('accepted_at', datetime.datetime(2013, 8, 2, 10),
+                                                 datetime.datetime(2013, 8, 3, 10)), [4])
+        self.assertEqual(self.time_index.between('accepted_at', start=parse_timestamp(u'2013/08/02 00:00:00')),
+                         [4, 1])
+        self.assertEqual(self.time_index.between('created_at'), [])
+
+    def test_latest_and_earliest(self):
+        # action / confirm
+        self.assertEqual(self.time_index.latest('accepted_at', 2), [1, 4])
+        self.assertEqual(self.time_index.latest('accepted_at', 10), [1, 4, 2])
+        self.assertEqual(self.time_index.earliest('accepted_at', 2), [2, 4])
+
+    def test_changes(self):
+        # setup
+        story = make_story(5, 1, u'accepted', u'Rob')
+        story.accepted_at = u'2013/08/04 10:00:00 UTC'
+
+        # action
+        self.time_index.story_added(story)
+        self.time_index.story_changed(self.stories[3], [('accepted_at', None, u'2013/07/31 10:00:00 UTC')])
+        self.time_index.story_changed(self.stories[1], [('accepted_at', u'2013/08/03 10:00:00 UTC',
+                                                         u'2013/08/05 10:00:00 UTC')])
+        self.time_index.story_removed(self.stories[4])
+
+        # confirm
+        self.assertEqual(self.time_index.between('accepted_at'), [3, 2, 5, 1])
+        self.assertEqual(self.time_index.epoch('accepted_at', 1), parse_timestamp(u'2013/08/05 10:00:00'))
+        self.assertIsNone(self.time_index.epoch('accepted_at', 4))
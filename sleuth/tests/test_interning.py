@@ -0,0 +1,43 @@
+import sys
+import unittest2
+
+from sleuth.interning import InternTable
+
+
+class Test_InternTable(unittest2.TestCase):
+
+    def test_intern(self):
+        # setup
+        table = InternTable()
+        first = u''.join([u'acc', u'epted'])
+        second = u''.join([u'acc', u'epted'])
+
+        # action
+        interned = [table.intern(first), table.intern(second), table.intern(first)]
+
+        # confirm
+        self.assertIsNot(first, second)
+        self.assertIs(interned[0], first)
+        self.assertIs(interned[1], first)
+        self.assertIs(interned[2], first)
+
+    def test_none(self):
+        # setup
+        table = InternTable()
+
+        # action / confirm
+        self.assertIsNone(table.intern(None))
+        self.assertEqual(len(table), 0)
+
+    def test_stats(self):
+        # setup
+        table = InternTable()
+        values = [u''.join([u'feat', u'ure']) for _ in range(3)] + [u'bug']
+
+        # action
+        for value in values:
+            table.intern(value)
+
+        # confirm
+        self.assertEqual(table.stats(), {'distinct': 2, 'lookups': 4, 'replaced': 2,
+                                         'bytes_saved': 2 * sys.getsizeof(u'feature')})
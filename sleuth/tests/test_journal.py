@@ -0,0 +1,173 @@
+from mock import patch, MagicMock
+import os
+import shutil
+import tempfile
+import unittest2
+
+from sleuth import journal
+from sleuth.journal import ActivityJournal
+
+
+class Test_ActivityJournal(unittest2.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_append_read(self):
+        # setup
+        activity_journal = ActivityJournal(self.directory)
+
+        # action
+        first_position = activity_journal.append('<activity>1</activity>')
+        second_position = activity_journal.append('<activity>\n2\n</activity>')
+        activity_journal.close()
+
+        # confirm
+        self.assertEqual(list(journal.read(self.directory)), [(first_position, '<activity>1</activity>'),
+                                                              (second_position, '<activity>\n2\n</activity>')])
+        self.assertEqual(list(journal.read(self.directory, second_position)),
+                         [(second_position, '<activity>\n2\n</activity>')])
+
+    def test_rotate(self):
+        # setup
+        activity_journal = ActivityJournal(self.directory, segment_bytes=30)
+
+        # action
+        positions = [activity_journal.append('<activity>%s</activity>' % i) for i in range(3)]
+        activity_journal.close()
+
+        # confirm
+        self.assertEqual(positions, [(0, 0), (1, 0), (2, 0)])
+        self.assertEqual(journal.list_segments(self.directory), [0, 1, 2])
+        self.assertEqual(len(list(journal.read(self.directory, (1, 0)))), 2)
+
+    def test_remove_before(self):
+        # setup
+        activity_journal = ActivityJournal(self.directory, segment_bytes=30)
+        positions = [activity_journal.append('<activity>%s</activity>' % i) for i in range(4)]
+
+        # action
+        removed = activity_journal.remove_before(positions[2])
+        removed_again = activity_journal.remove_before((9, 0))
+
+        # confirm
+        self.assertEqual((removed, removed_again), (2, 1))
+        self.assertEqual(journal.list_segments(self.directory), [3])
+        activity_journal.append('<activity>4</activity>')
+        activity_journal.close()
+        self.assertEqual(len(list(journal.read(self.directory))), 2)
+
+    def test_reopen_appends_to_last_segment(self):
+        # setup
+        activity_journal = ActivityJournal(self.directory)
+        activity_journal.append('<activity>1</activity>')
+        activity_journal.close()
+
+        # action
+        activity_journal = ActivityJournal(self.directory)
+        position = activity_journal.append('<activity>2</activity>')
+        activity_journal.close()
+
+        # confirm
+        self.assertEqual(position, (0, 26))
+        self.assertEqual([record for _, record in journal.read(self.directory)],
+                         ['<activity>1</activity>', '<activity>2</activity>'])
+
+    def test_partly_written_record(self):
+        # setup
+        activity_journal = ActivityJournal(self.directory)
+        activity_journal.append('<activity>1</activity>')
+        activity_journal.close()
+        with open(os.path.join(self.directory, journal.SEGMENT_NAME % 0), 'ab') as segment_file:
+            segment_file.write('22\n<activity>2</')
+
+        # action
+        records = [record for _, record in journal.read(self.directory)]
+        activity_journal = ActivityJournal(self.directory)
+        activity_journal.append('<activity>3</activity>')
+        activity_journal.close()
+
+        # confirm
+        self.assertEqual(records, ['<activity>1</activity>'])
+        self.assertEqual([record for _, record in journal.read(self.directory)],
+                         ['<activity>1</activity>', '<activity>3</activity>'])
+
+    @patch('sleuth.journal.os.fsync')
+    def test_fsync_batching(self, fsync):
+        # setup
+        activity_journal = ActivityJournal(self.directory, fsync_every=3, fsync_seconds=60)
+
+        # action
+        for i in range(7):
+            activity_journal.append('<activity>%s</activity>' % i)
+        fsyncs_before_sync = fsync.call_count
+        activity_journal.sync()
+
+        # confirm
+        self.assertEqual(fsyncs_before_sync, 2)
+        self.assertEqual(fsync.call_count, 3)
+
+    def test_replay(self):
+        # setup
+        activity_journal = ActivityJournal(self.directory)
+        activity_journal.append('<activity><id>1</id></activity>')
+        activity_journal.append('<activity><id>2</id></activity>')
+        activity_journal.close()
+        apply = MagicMock()
+
+        # action
+        count = journal.replay(self.directory, apply)
+
+        # confirm
+        self.assertEqual(count, 2)
+        self.assertEqual([call[0][0].id for call in apply.call_args_list], [1, 2])
+
+    def test_replay_batches(self):
+        # setup
+        activity_journal = ActivityJournal(self.directory)
+        for activity_id in range(5):
+            activity_journal.append('<activity><id>%s</id></activity>' % activity_id)
+        activity_journal.close()
+        apply_batch = MagicMock()
+
+        # action
+        count = journal.replay_batches(self.directory, apply_batch, batch_size=2)
+
+        # confirm
+        self.assertEqual(count, 5)
+        self.assertEqual([[activity.id for activity in call[0][0]] for call in apply_batch.call_args_list],
+                         [[0, 1], [2, 3], [4]])
+
+    def test_replay_batches_skips_unparsable(self):
+        # setup
+        activity_journal = ActivityJournal(self.directory)
+        activity_journal.append('<activity><id>1</id></activity>')
+        activity_journal.append('<activity><id>2</id>')
+        activity_journal.append('<activity><id>3</id></activity>')
+        activity_journal.append('<activity><id>4</id></activity><activity><id>5</id></activity>')
+        activity_journal.close()
+        apply_batch = MagicMock()
+
+        # action
+        count = journal.replay_batches(self.directory, apply_batch)
+
+        # confirm
+        self.assertEqual(count, 2)
+        self.assertEqual([activity.id for activity in apply_batch.call_args[0][0]], [1, 3])
+
+    def test_replay_skips_unparsable(self):
+        # setup
+        activity_journal = ActivityJournal(self.directory)
+        activity_journal.append('<activity><id>1</id></activity>')
+        activity_journal.append('<activity><id>2</id>')
+        activity_journal.append('<activity><id>3</id></activity>')
+        activity_journal.close()
+        apply = MagicMock()
+
+        # action
+        count = journal.replay(self.directory, apply)
+
+        # confirm
+        self.assertEqual(count, 2)
+        self.assertEqual([call[0][0].id for call in apply.call_args_list], [1, 3])
@@ -0,0 +1,36 @@
+import unittest2
+
+from sleuth.locking import StripedLock
+
+
+class Test_StripedLock(unittest2.TestCase):
+
+    def test_same_key_same_lock(self):
+        # setup
+        story_locks = StripedLock(stripes=8)
+
+        # action / confirm
+        self.assertIs(story_locks(15), story_locks(15))
+        self.assertEqual(len(story_locks), 8)
+
+    def test_keys_spread_over_stripes(self):
+        # setup
+        story_locks = StripedLock(stripes=8)
+
+        # action
+        locks = set(id(story_locks(story_id)) for story_id in range(8))
+
+        # confirm
+        self.assertEqual(len(locks), 8)
+
+    def test_all(self):
+        # setup
+        story_locks = StripedLock(stripes=8)
+
+        # action
+        with story_locks.all():
+            held = [story_locks(story_id).locked() for story_id in range(8)]
+
+        # confirm
+        self.assertEqual(held, [True] * 8)
+        self.assertFalse(any(story_locks(story_id).locked() for story_id in range(8)))
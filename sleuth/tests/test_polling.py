@@ -0,0 +1,120 @@
+from mock import patch, call, MagicMock
+import unittest2
+
+from sleuth.polling import AdaptivePoller
+
+
+@patch('sleuth.polling.time')
+class Test_AdaptivePoller(unittest2.TestCase):
+
+    def make_poller(self, time, counts, project_ids=(1, 2), **kwargs):
+        self.clock = [100.0]
+        time.time.side_effect = lambda: self.clock[0]
+        self.project_ids = list(project_ids)
+        collect = MagicMock(side_effect=lambda polled: dict((project_id, counts.get(project_id, 0))
+                                                            for project_id in polled))
+        return AdaptivePoller(collect, lambda: self.project_ids, **kwargs)
+
+    def advance(self, seconds):
+        self.clock[0] += seconds
+
+    def test_polls_every_project_first(self, time):
+        # setup
+        poller = self.make_poller(time, {1: 3})
+
+        # action
+        counts = poller.poll()
+
+        # confirm
+        poller.collect.assert_called_once_with([1, 2])
+        self.assertEqual(counts, {1: 3, 2: 0})
+
+    def test_idle_project_backs_off(self, time):
+        # setup
+        poller = self.make_poller(time, {1: 3}, min_interval=1, max_interval=4)
+
+        # action
+        for _ in range(10):
+            poller.poll()
+            self.advance(1)
+
+        # confirm
+        polled = [project_id for polled_call in poller.collect.call_args_list for project_id in polled_call[0][0]]
+        self.assertEqual(polled.count(1), 10)
+        # due after 0, 2 and 6 seconds
+        self.assertEqual(polled.count(2), 3)
+        self.assertEqual(poller.stats()['projects'][2]['interval'], 4)
+
+    def test_changed_project_speeds_up(self, time):
+        # setup
+        counts = {}
+        poller = self.make_poller(time, counts, project_ids=[1], min_interval=1, max_interval=60)
+        for _ in range(4):
+            poller.poll()
+            self.advance(60)
+
+        # action
+        counts[1] = 2
+        poller.poll()
+
+        # confirm
+        self.assertEqual(poller.stats()['projects'][1]['interval'], 1)
+        self.advance(1)
+        poller.poll()
+        self.assertEqual(poller.collect.call_count, 6)
+
+    def test_request_budget(self, time):
+        # setup
+        poller = self.make_poller(time, {}, project_ids=[1, 2, 3, 4, 5], max_requests_per_second=2)
+
+        # action
+        poller.poll()
+        self.advance(1)
+        poller.poll()
+
+        # confirm
+        self.assertEqual(poller.collect.call_args_list, [call([1, 2]), call([3, 4])])
+        self.assertEqual(poller.deferred, 4)
+
+    def test_added_and_removed_projects(self, time):
+        # setup
+        poller = self.make_poller(time, {1: 1, 3: 1})
+        poller.poll()
+
+        # action
+        self.project_ids = [1, 3]
+        self.advance(1)
+        poller.poll()
+
+        # confirm
+        self.assertEqual(poller.collect.call_args_list, [call([1, 2]), call([1, 3])])
+        self.assertEqual(sorted(poller.stats()['projects']), [1, 3])
+
+    def test_failed_poll_keeps_interval(self, time):
+        # setup
+        poller = self.make_poller(time, {}, project_ids=[1], min_interval=2)
+        poller.collect.side_effect = Exception
+
+        # action
+        poller.poll()
+        self.advance(2)
+        poller.poll()
+
+        # confirm
+        self.assertEqual(poller.collect.call_count, 2)
+        self.assertEqual(poller.stats()['projects'][1]['interval'], 2)
+
+    def test_boost(self, time):
+        # setup
+        poller = self.make_poller(time, {}, project_ids=[1], min_interval=1, max_interval=60)
+        for _ in range(3):
+            poller.poll()
+            self.advance(10)
+
+        # action
+        poller.boost(1)
+        poller.poll()
+
+        # confirm
+        self.assertEqual(poller.collect.call_count, 4)
+        self.assertEqual(poller.stats()['projects'][1]['interval'], 2)
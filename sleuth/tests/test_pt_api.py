@@ -1,7 +1,12 @@
 from mock import patch, MagicMock
+import BaseHTTPServer
 import datetime
+import io
+import threading
 import unittest2
 
+from lxml import objectify as lxml_objectify
+
 from sleuth import pt_api
 
 
@@ -73,29 +78,266 @@ class Test_StorySearch(unittest2.TestCase):
         self.assertEqual(story_search.url, 'https://www.pivotaltracker.com/services/v3/projects/%s/stories?%s' % (project_id, 'filter=state%3Astate1%2Cstate2+state%3Astate3%2Cstate4'))
 
 
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Answer every GET with the request path, and record the requests.
+        The statuses and headers of server.responses are answered first.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers),
+                                     self.client_address))
+        body = self.path
+        status, headers = self.server.status, {}
+        if self.server.responses:
+            status, headers = self.server.responses.pop(0)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer(BaseHTTPServer.HTTPServer):
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           StandInHandler)
+        self.requests = []
+        self.status = 200
+        self.responses = []
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def root(self):
+        return 'http://127.0.0.1:%s' % self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class Test_APIClient(unittest2.TestCase):
+
+    def setUp(self):
+        self.server = StandInServer()
+        self.client = pt_api.APIClient(api_root=self.server.root)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_get(self):
+        # action
+        response = self.client.get('%s/projects/1/activities' % pt_api.URL_API4, '--token--')
+
+        # confirm
+        self.assertEqual(response.text, '/services/v4/projects/1/activities')
+        path, headers, client_address = self.server.requests[0]
+        self.assertEqual(headers['x-trackertoken'], '--token--')
+        self.assertIn('gzip', headers['accept-encoding'])
+
+    def test_keep_alive(self):
+        # action
+        for _ in range(3):
+            self.client.get('%s/projects/1/activities' % pt_api.URL_API3, '--token--')
+
+        # confirm
+        client_addresses = set(request[2] for request in self.server.requests)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(len(client_addresses), 1)
+
+    def test_session_per_thread(self):
+        # setup
+        sessions = []
+
+        def get_session():
+            sessions.append(self.client.session())
+
+        # action
+        threads = [threading.Thread(target=get_session) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # confirm
+        self.assertIsNot(sessions[0], sessions[1])
+        self.assertIs(self.client.session(), self.client.session())
+
+    def test_url_without_api_root(self):
+        # setup
+        client = pt_api.APIClient()
+        url = '%s/projects/1/activities' % pt_api.URL_API3
+
+        # action / confirm
+        self.assertEqual(client.url(url), url)
+
+
+class Test_APIClient_retry(unittest2.TestCase):
+
+    def setUp(self):
+        self.server = StandInServer()
+        self.client = pt_api.APIClient(api_root=self.server.root, backoff=0, breaker_failures=3)
+        self.url = '%s/projects/1/activities' % pt_api.URL_API4
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_retries_server_errors(self):
+        # setup
+        self.server.responses = [(503, {}), (500, {})]
+
+        # action
+        response = self.client.get(self.url, '--token--')
+
+        # confirm
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertFalse(self.client.breaker(self.server.root[len('http://'):]).open)
+
+    def test_honors_retry_after(self):
+        # setup
+        self.server.responses = [(429, {'Retry-After': '7'})]
+        self.client.limiter.pause = MagicMock()
+
+        # action
+        response = self.client.get(self.url, '--token--')
+
+        # confirm
+        self.assertEqual(response.status_code, 200)
+        self.client.limiter.pause.assert_called_once_with(7)
+
+    def test_gives_up(self):
+        # setup
+        self.client.retries = 1
+        self.server.status = 502
+
+        # action / confirm
+        self.assertRaises(pt_api.PT_APIException, self.client.get, self.url, '--token--')
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_other_errors_are_not_retried(self):
+        # setup
+        self.server.status = 404
+
+        # action
+        with self.assertRaises(pt_api.HTTPStatusError) as raised:
+            self.client.get(self.url, '--token--')
+
+        # confirm
+        self.assertEqual(raised.exception.status_code, 404)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertFalse(self.client.breaker(self.server.root[len('http://'):]).open)
+
+    def test_circuit_opens(self):
+        # setup
+        self.client.retries = 0
+        self.server.status = 500
+        for _ in range(3):
+            self.assertRaises(pt_api.PT_APIException, self.client.get, self.url, '--token--')
+
+        # action / confirm
+        self.assertRaises(pt_api.CircuitOpenError, self.client.get, self.url, '--token--')
+        self.assertEqual(len(self.server.requests), 3)
+
+
+@patch('sleuth.pt_api.time')
+class Test_TokenBucket(unittest2.TestCase):
+
+    def test_rate(self, time):
+        # setup
+        clock = [100.0]
+        time.time.side_effect = lambda: clock[0]
+        time.sleep.side_effect = lambda seconds: clock.__setitem__(0, clock[0] + seconds)
+        bucket = pt_api.TokenBucket(2)
+
+        # action
+        for _ in range(6):
+            bucket.acquire()
+
+        # confirm
+        self.assertAlmostEqual(clock[0], 102.0)
+
+    def test_pause(self, time):
+        # setup
+        clock = [100.0]
+        time.time.side_effect = lambda: clock[0]
+        time.sleep.side_effect = lambda seconds: clock.__setitem__(0, clock[0] + seconds)
+        bucket = pt_api.TokenBucket(10)
+
+        # action
+        bucket.pause(30)
+        bucket.acquire()
+
+        # confirm
+        self.assertAlmostEqual(clock[0], 130.0)
+
+
+@patch('sleuth.pt_api.time')
+class Test_CircuitBreaker(unittest2.TestCase):
+
+    def test_opens_and_half_opens(self, time):
+        # setup
+        time.time.return_value = 100
+        breaker = pt_api.CircuitBreaker(failures=2, reset_seconds=30)
+        breaker.failed()
+        self.assertTrue(breaker.allow())
+        breaker.failed()
+
+        # action / confirm
+        self.assertFalse(breaker.allow())
+        time.time.return_value = 130
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.succeeded()
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.open)
+
+
 class Test_APICall(unittest2.TestCase):
 
-    @patch('sleuth.pt_api.subprocess')
-    def test_APICall(self, subprocess):
+    @patch('sleuth.pt_api.get_client')
+    def test_APICall(self, get_client):
         # setup
         url = 'http://www.myurl.co.uk/blah?stuff=things'
         token = 'xxxxxxxxxx'
-        stdout_data = 'std_out'
-        subprocess.Popen.return_value.communicate.return_value = (stdout_data, 'std_in')
 
         # action
         data = pt_api.APICall(url, token)
 
         # confirm
-        subprocess.Popen.assert_called_once_with("curl -H 'X-TrackerToken: xxxxxxxxxx' -X GET http://www.myurl.co.uk/blah?stuff=things",
-                                                 shell=True, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
-        self.assertEqual(stdout_data, data)
+        get_client.return_value.get.assert_called_once_with(url, token)
+        self.assertEqual(get_client.return_value.get.return_value.content, data)
 
+    def test_set_client(self):
+        # setup
+        client = MagicMock()
 
-@patch('sleuth.pt_api.APICall')
+        # action
+        old_client = pt_api.set_client(client)
+        try:
+            # confirm
+            self.assertIs(pt_api.get_client(), client)
+        finally:
+            pt_api.set_client(old_client)
+
+
+@patch('sleuth.pt_api.get_client')
 class Test_get_stories(unittest2.TestCase):
 
     def setUp(self):
+        cache_patcher = patch('sleuth.pt_api.response_cache', pt_api.ResponseCache())
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
         self.token = 'xxxxxxxxxx'
         self.project_id = 1
         self.iterations_reponse = '''<?xml version="1.0" encoding="UTF-8"?>
@@ -206,10 +448,10 @@ class Test_get_stories(unittest2.TestCase):
           </story>
         </stories>'''
 
-    def test_get_stories(self, APICall):
+    def test_get_stories(self, get_client):
         # setup
         block = 'backlog'
-        APICall.return_value = self.iterations_reponse
+        get_client.return_value.get.return_value = MagicMock(status_code=200, content=self.iterations_reponse, headers={})
 
         # action
         stories = pt_api.get_stories(self.project_id, block, self.token)
@@ -220,17 +462,74 @@ class Test_get_stories(unittest2.TestCase):
         self.assertEqual(stories[1][0].id, 2)
         self.assertEqual(stories[1][1].id, 3)
 
-    def test_get_stories_Unknown_Block(self, APICall):
+    def test_get_stories_not_modified(self, get_client):
+        # setup
+        block = 'current'
+        story_constructor = MagicMock()
+        get_client.return_value.get.side_effect = [
+            MagicMock(status_code=200, content=self.iterations_reponse, headers={'ETag': '"v1"'}),
+            MagicMock(status_code=304, content='', headers={'ETag': '"v1"'})]
+        stories = pt_api.get_stories(self.project_id, block, self.token, story_constructor)
+
+        # action
+        cached_stories = pt_api.get_stories(self.project_id, block, self.token, story_constructor)
+
+        # confirm
+        self.assertEqual([len(iteration) for iteration in cached_stories], [2, 2])
+        self.assertIs(cached_stories[0][0], story_constructor.return_value.copy.return_value)
+        self.assertEqual(story_constructor.call_count, 4)
+        self.assertEqual(pt_api.response_cache.stats()['hits'], 1)
+        self.assertEqual(get_client.return_value.get.call_args[1], {'headers': {'If-None-Match': '"v1"'}})
+
+    def test_get_stories_streaming(self, get_client):
+        # setup
+        block = 'backlog'
+        get_client.return_value.get.return_value = MagicMock(status_code=200, content=self.iterations_reponse, headers={})
+        story_builder = pt_api.StoryBuilder(lambda project_id, story_id, fields, notes, tasks: (project_id, story_id, fields),
+                                            MagicMock(), MagicMock())
+
+        # action
+        stories = pt_api.get_stories(self.project_id, block, self.token, story_builder=story_builder)
+
+        # confirm
+        self.assertEqual([story[1] for story in stories[0]], [0, 1, 2, 3])
+        project_id, story_id, fields = stories[0][1]
+        self.assertEqual(project_id, self.project_id)
+        self.assertEqual(fields, {'story_type': u'feature', 'url': u'$STORY_URL', 'estimate': 2,
+                                  'current_state': u'accepted', 'description': u'Windoze Save Dialog thingy',
+                                  'name': u'The Save Dialog 2', 'requested_by': u'Dana Deer', 'owned_by': u'Rob',
+                                  'created_at': u'2009/03/16 16:55:04 UTC', 'accepted_at': u'2009/03/19 19:00:00 UTC'})
+
+    def test_get_stories_error_status(self, get_client):
+        # setup
+        get_client.return_value.get.return_value = MagicMock(status_code=404, content='<message>Resource not found</message>',
+                                                             headers={})
+
+        # action / confirm
+        self.assertRaises(pt_api.HTTPStatusError, pt_api.get_stories, self.project_id, 'current', self.token,
+                          story_builder=MagicMock())
+
+    def test_get_stories_not_stories(self, get_client):
+        # setup
+        get_client.return_value.get.return_value = MagicMock(status_code=200, content='<message>Resource not found</message>',
+                                                             headers={})
+
+        # action / confirm
+        self.assertRaises(pt_api.PT_APIException, pt_api.get_stories, self.project_id, 'current', self.token,
+                          story_builder=MagicMock())
+        self.assertRaises(pt_api.PT_APIException, pt_api.get_stories, self.project_id, 'icebox', self.token)
+
+    def test_get_stories_Unknown_Block(self, get_client):
         # setup
         block = 'UNKOWN_BLOCK'
 
         # action / confirm
         self.assertRaises(ValueError, pt_api.get_stories, self.project_id, block, self.token)
 
-    def test_get_stories_icebox(self, APICall):
+    def test_get_stories_icebox(self, get_client):
         # setup
         block = 'icebox'
-        APICall.return_value = self.ice_box_response
+        get_client.return_value.get.return_value = MagicMock(status_code=200, content=self.ice_box_response, headers={})
 
         # action
         stories = pt_api.get_stories(self.project_id, block, self.token)
@@ -240,42 +539,302 @@ class Test_get_stories(unittest2.TestCase):
         self.assertEqual(stories[0][1].id, 1)
 
 
-@patch('sleuth.pt_api.APICall')
-@patch('sleuth.pt_api.objectify')
-class Test_get_project_activities(unittest2.TestCase):
+@patch('sleuth.pt_api.get_client')
+class Test_get_story(unittest2.TestCase):
 
-    def test(self, objectify, APICall):
+    def test_found(self, get_client):
         # setup
-        project_id = 1
-        since = datetime.datetime(2013, 8, 7, 20, 33, 30)
-        token = '--token--'
+        get_client.return_value.get.return_value = MagicMock(
+            status_code=200, content='<story><id type="integer">7</id><current_state>accepted</current_state></story>')
+        story_builder = pt_api.StoryBuilder(lambda project_id, story_id, fields, notes, tasks: (project_id, story_id, fields),
+                                            MagicMock(), MagicMock())
 
         # action
-        activitiesxml = pt_api.get_project_activities(project_id, since, token)
+        story = pt_api.get_story(1, 7, '--token--', story_builder)
 
         # confirm
-        APICall.assert_called_once_with('https://www.pivotaltracker.com/services/v4/projects/1/activities?occurred_since_date=2013/8/07%0020:33:30%20GMT',
-                                        '--token--')
-        self.assertEqual(activitiesxml, objectify.return_value)
+        self.assertEqual(get_client.return_value.get.call_args[0],
+                         ('https://www.pivotaltracker.com/services/v3/projects/1/stories/7', '--token--'))
+        self.assertEqual(story, (1, 7, {'current_state': u'accepted'}))
 
+    def test_deleted(self, get_client):
+        # setup
+        get_client.return_value.get.side_effect = pt_api.HTTPStatusError('not found', 404)
+
+        # action / confirm
+        self.assertIsNone(pt_api.get_story(1, 7, '--token--', MagicMock()))
+
+    def test_error(self, get_client):
+        # setup
+        get_client.return_value.get.side_effect = pt_api.HTTPStatusError('unauthorized', 401)
+
+        # action / confirm
+        self.assertRaises(pt_api.HTTPStatusError, pt_api.get_story, 1, 7, '--token--', MagicMock())
+
+
+class Test_iterparse_stories(unittest2.TestCase):
+
+    def test_notes_and_tasks(self):
+        # setup
+        source = io.BytesIO('''<?xml version="1.0" encoding="UTF-8"?>
+        <stories type="array">
+          <story>
+            <id type="integer">7</id>
+            <estimate type="integer"></estimate>
+            <labels>a,b</labels>
+            <notes type="array">
+              <note><id type="integer">1</id><text>a note</text><author>Rob</author><noted_at>2009/03/16</noted_at></note>
+            </notes>
+            <tasks type="array">
+              <task><id type="integer">2</id><description>a task</description><position>1</position><complete>true</complete>
+                    <created_at>2009/03/17</created_at></task>
+            </tasks>
+          </story>
+          <story><id type="integer">8</id></story>
+        </stories>''')
+        builder = pt_api.StoryBuilder(MagicMock(), MagicMock(), MagicMock())
+        builder.note.return_value.id = 1
+        builder.task.return_value.id = 2
+
+        # action
+        stories = list(pt_api.iterparse_stories(source, 5, builder))
+
+        # confirm
+        self.assertEqual(len(stories), 2)
+        builder.note.assert_called_once_with(1, u'a note', u'Rob', u'2009/03/16')
+        builder.task.assert_called_once_with(2, u'a task', u'2009/03/17', 1, True)
+        self.assertEqual(builder.story.call_args_list[0][0],
+                         (5, 7, {'estimate': None, 'labels': u'a,b'},
+                          {1: builder.note.return_value}, {2: builder.task.return_value}))
+        self.assertEqual(builder.story.call_args_list[1][0], (5, 8, {}, None, None))
+
+
+class Test_ResponseCache(unittest2.TestCase):
+
+    def test_validators(self):
+        # setup
+        cache = pt_api.ResponseCache()
+        cache.store('url', {'ETag': '"abc"', 'Last-Modified': 'Wed, 07 Aug 2013 20:33:30 GMT'}, 'value', 5)
+
+        # action
+        validators = cache.validators('url')
+
+        # confirm
+        self.assertEqual(validators, {'If-None-Match': '"abc"', 'If-Modified-Since': 'Wed, 07 Aug 2013 20:33:30 GMT'})
+        self.assertEqual(cache.validators('other url'), {})
+
+    def test_not_stored_without_validators(self):
+        # setup
+        cache = pt_api.ResponseCache()
+
+        # action
+        stored = cache.store('url', {}, 'value', 5)
+
+        # confirm
+        self.assertFalse(stored)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats(), {'entries': 0, 'bytes': 0, 'hits': 0, 'misses': 1, 'evictions': 0,
+                                         'rejections': 0})
+
+    def test_hit(self):
+        # setup
+        cache = pt_api.ResponseCache()
+        cache.store('url', {'ETag': '"abc"'}, 'value', 5)
+
+        # action
+        value = cache.hit('url')
+
+        # confirm
+        self.assertEqual(value, 'value')
+        self.assertEqual(cache.hits, 1)
+
+    def test_bounded_by_bytes(self):
+        # setup
+        cache = pt_api.ResponseCache(max_bytes=10)
+        cache.store('url1', {'ETag': '"1"'}, 'value1', 6)
+
+        # action
+        stored = cache.store('url2', {'ETag': '"2"'}, 'value2', 6)
+
+        # confirm
+        self.assertFalse(stored)
+        self.assertEqual(cache.hit('url1'), 'value1')
+        self.assertEqual(cache.validators('url2'), {})
+        self.assertEqual(cache.stats()['bytes'], 6)
+        self.assertEqual(cache.rejections, 1)
+        self.assertFalse(cache.store('url3', {'ETag': '"3"'}, 'value3', 11))
+
+    def test_hits_when_urls_are_requested_in_turn(self):
+        # setup
+        cache = pt_api.ResponseCache(max_bytes=20)
+        urls = ['url%s' % number for number in range(3)]
+
+        # action
+        for _ in range(3):
+            for url in urls:
+                if cache.validators(url):
+                    cache.hit(url)
+                else:
+                    cache.store(url, {'ETag': '"1"'}, url, 10)
+
+        # confirm
+        self.assertEqual(cache.hits, 4)
+        self.assertEqual(cache.evictions, 0)
+
+    @patch('sleuth.pt_api.time')
+    def test_evicts_idle_entries(self, time):
+        # setup
+        cache = pt_api.ResponseCache(max_bytes=20, max_idle=60)
+        time.time.return_value = 1000
+        cache.store('url1', {'ETag': '"1"'}, 'value1', 10)
+        cache.store('url2', {'ETag': '"2"'}, 'value2', 10)
+        time.time.return_value = 1030
+        cache.hit('url1')
+        time.time.return_value = 1070
+
+        # action
+        stored = cache.store('url3', {'ETag': '"3"'}, 'value3', 10)
+
+        # confirm
+        self.assertTrue(stored)
+        self.assertEqual(cache.validators('url2'), {})
+        self.assertEqual(cache.hit('url1'), 'value1')
+        self.assertEqual(cache.hit('url3'), 'value3')
+        self.assertEqual(cache.evictions, 1)
 
-@patch('sleuth.pt_api.APICall')
-@patch('sleuth.pt_api.objectify')
-class Test_get_project_activities_v3(unittest2.TestCase):
+    def test_refresh_evicts_least_recently_used(self):
+        # setup
+        cache = pt_api.ResponseCache(max_bytes=20)
+        cache.store('url1', {'ETag': '"1"'}, 'value1', 10)
+        cache.store('url2', {'ETag': '"2"'}, 'value2', 10)
+
+        # action
+        stored = cache.store('url2', {'ETag': '"3"'}, 'value3', 15)
+
+        # confirm
+        self.assertTrue(stored)
+        self.assertEqual(cache.validators('url1'), {})
+        self.assertEqual(cache.hit('url2'), 'value3')
+        self.assertEqual(cache.stats()['bytes'], 15)
+
+
+ACTIVITIES = '''<?xml version="1.0" encoding="UTF-8"?>
+<activities type="array">
+  <activity>
+    <id type="integer">1</id>
+    <event_type>story_update</event_type>
+    <stories><story><id type="integer">5</id><current_state>started</current_state></story></stories>
+  </activity>
+  <activity>
+    <id type="integer">2</id>
+    <event_type>comment_create</event_type>
+    <stories><story><id type="integer">5</id>
+      <comments><comment><id type="integer">7</id><text>a note</text></comment></comments>
+    </story></stories>
+  </activity>
+  <activity>
+    <id type="integer">3</id>
+    <event_type>move_from_project</event_type>
+    <stories><story><id type="integer">5</id></story></stories>
+  </activity>
+</activities>'''
+
+
+class Test_parse_activities(unittest2.TestCase):
+
+    def test_filters_and_translates(self):
+        # setup
+        counters = pt_api.ActivityCounters()
+        chunks = [ACTIVITIES[start:start + 50] for start in range(0, len(ACTIVITIES), 50)]
+
+        # action
+        activitiesxml = pt_api.parse_activities(chunks, set(['story_update', 'note_create']), counters)
+
+        # confirm
+        activities = list(activitiesxml.iterchildren())
+        self.assertEqual([activity.id for activity in activities], [1, 2])
+        self.assertIsInstance(activities[0].id, lxml_objectify.IntElement)
+        self.assertEqual(activities[1].event_type, 'note_create')
+        self.assertEqual(activities[1].stories.story.notes.note['text'], 'a note')
+        self.assertEqual(counters.stats()['requests'], 1)
+        self.assertEqual(counters.stats()['bytes'], len(ACTIVITIES))
+        self.assertEqual(counters.stats()['activities'], 3)
+        self.assertEqual(counters.stats()['skipped'], 1)
+
+    def test_keeps_other_event_types(self):
+        # setup
+        activities_xml = ACTIVITIES.replace('comment_create', 'comment_delete')
+
+        # action
+        activitiesxml = pt_api.parse_activities([activities_xml], set(['comment_delete']))
+
+        # confirm
+        self.assertEqual(activitiesxml.activity.event_type, 'comment_delete')
+        self.assertEqual(activitiesxml.activity.stories.story.comments.comment.id, 7)
+
+    def test_malformed(self):
+        # setup
+        counters = pt_api.ActivityCounters()
+
+        # action / confirm
+        self.assertRaises(pt_api.PT_APIException, pt_api.parse_activities, [ACTIVITIES[:200]],
+                          set(['story_update']), counters)
+        self.assertEqual(counters.stats()['bytes'], 200)
+
+    def test_not_activities(self):
+        # action / confirm
+        self.assertRaises(pt_api.PT_APIException, pt_api.parse_activities,
+                          ['<message>Resource not found</message>'], set(['story_update']))
+        self.assertRaises(pt_api.PT_APIException, pt_api.parse_activities,
+                          ['<html><body><p>Down for maintenance</p></body></html>'], set(['story_update']))
 
-    def test(self, objectify, APICall):
+
+@patch('sleuth.pt_api.get_client')
+class Test_stream_project_activities(unittest2.TestCase):
+
+    def test(self, get_client):
         # setup
-        project_id = 1
+        response = get_client.return_value.get.return_value
+        response.status_code = 200
+        response.iter_content.return_value = [ACTIVITIES]
         since = datetime.datetime(2013, 8, 7, 20, 33, 30)
-        token = '--token--'
 
         # action
-        activitiesxml = pt_api.get_project_activities_v3(project_id, since, token)
+        activitiesxml = pt_api.stream_project_activities(1, since, '--token--', set(['story_update']))
 
         # confirm
-        APICall.assert_called_once_with('https://www.pivotaltracker.com/services/v3/projects/1/activities?occurred_since_date=2013/8/07%0020:33:30%20GMT',
-                                        '--token--')
-        self.assertEqual(activitiesxml, objectify.return_value)
+        url, token = get_client.return_value.get.call_args[0]
+        self.assertTrue(url.startswith('https://www.pivotaltracker.com/services/v4/projects/1/activities?'))
+        self.assertEqual(get_client.return_value.get.call_args[1], {'stream': True})
+        self.assertEqual([activity.id for activity in activitiesxml.iterchildren()], [1])
+        response.close.assert_called_once_with()
+
+    def test_error_status(self, get_client):
+        # setup
+        response = get_client.return_value.get.return_value
+        response.status_code = 401
+        response.iter_content.return_value = []
+        since = datetime.datetime(2013, 8, 7, 20, 33, 30)
+
+        # action / confirm
+        self.assertRaises(pt_api.HTTPStatusError, pt_api.stream_project_activities, 1, since, '--token--',
+                          set(['story_update']))
+        response.close.assert_called_once_with()
+
+
+class Test_async(unittest2.TestCase):
+
+    @patch('sleuth.pt_api.get_stories')
+    def test_get_stories_async_default_executor(self, get_stories):
+        # setup
+        story_constructor = MagicMock()
+
+        # action
+        future = pt_api.get_stories_async(1, 'current', '--token--', story_constructor)
+
+        # confirm
+        self.assertEqual(future.result(), get_stories.return_value)
+        get_stories.assert_called_once_with(1, 'current', '--token--', story_constructor, None)
 
 
 @patch('sleuth.pt_api.lxml.etree.tostring')
@@ -299,17 +858,50 @@ class Test_objectify(unittest2.TestCase):
     
     def test_ok(self, logger, lxml_objectify):
         # action
-        objectified = pt_api.objectify(MagicMock())
+        objectified = pt_api.objectify('<activity/>')
         
         # confirm
+        lxml_objectify.fromstring.assert_called_once_with('<activity/>')
         self.assertEqual(lxml_objectify.fromstring.return_value, objectified)
 
+    def test_unicode(self, logger, lxml_objectify):
+        # action
+        objectified = pt_api.objectify(u'<activity>\xe9</activity>')
+
+        # confirm
+        lxml_objectify.fromstring.assert_called_once_with('<activity>\xc3\xa9</activity>')
+        self.assertEqual(lxml_objectify.fromstring.return_value, objectified)
+
+    def test_file(self, logger, lxml_objectify):
+        # setup
+        source = io.BytesIO('<activity/>')
+
+        # action
+        objectified = pt_api.objectify(source)
+
+        # confirm
+        lxml_objectify.parse.assert_called_once_with(source)
+        self.assertEqual(lxml_objectify.parse.return_value.getroot.return_value, objectified)
+
     def test_fail(self, logger, lxml_objectify):
         # setup
         lxml_objectify.fromstring.side_effect = Exception
         
         # action
-        objectified = pt_api.objectify(MagicMock())
+        objectified = pt_api.objectify('<activity>')
         
         # confirm
         self.assertIsNone(objectified)
+
+
+class Test_objectify_encoding(unittest2.TestCase):
+
+    def test_declared_encoding(self):
+        # setup
+        data = '<?xml version="1.0" encoding="UTF-8"?>\n<activity><author>Ren\xc3\xa9</author></activity>'
+
+        # action
+        objectified = pt_api.objectify(data)
+
+        # confirm
+        self.assertEqual(objectified.author.text, u'Ren\xe9')
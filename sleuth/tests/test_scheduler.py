@@ -0,0 +1,105 @@
+from futures import ThreadPoolExecutor
+from mock import patch, MagicMock
+import threading
+import unittest2
+
+from sleuth.scheduler import Scheduler
+
+
+@patch('sleuth.scheduler.time')
+class Test_Scheduler(unittest2.TestCase):
+
+    def test_runs_jobs_in_due_order(self, time):
+        # setup
+        clock = [100]
+        time.time.side_effect = lambda: clock[0]
+        time.sleep.side_effect = lambda seconds: clock.__setitem__(0, clock[0] + seconds)
+        scheduler = Scheduler()
+        ran = []
+        scheduler.every(5, lambda: ran.append('slow'), name='slow', delay=2)
+        scheduler.every(1, lambda: ran.append('fast'), name='fast')
+
+        # action
+        for _ in range(3):
+            scheduler.run_next()
+
+        # confirm
+        self.assertEqual(ran, ['fast', 'fast', 'slow'])
+        self.assertEqual([call[0][0] for call in time.sleep.call_args_list], [1, 1])
+
+    def test_cancel(self, time):
+        # setup
+        time.time.return_value = 100
+        scheduler = Scheduler()
+        job = MagicMock()
+        scheduler.every(1, job, name='poll')
+
+        # action
+        scheduler.cancel('poll')
+        scheduler.run_next(idle_seconds=3)
+
+        # confirm
+        self.assertFalse(job.called)
+        self.assertEqual(scheduler.jobs(), {})
+        time.sleep.assert_called_once_with(3)
+
+    def test_replace_job(self, time):
+        # setup
+        time.time.return_value = 100
+        scheduler = Scheduler()
+        old_job = MagicMock()
+        new_job = MagicMock()
+        scheduler.every(1, old_job, name='poll')
+
+        # action
+        scheduler.every(1, new_job, name='poll')
+        scheduler.run_next()
+
+        # confirm
+        self.assertFalse(old_job.called)
+        new_job.assert_called_once_with()
+
+    def test_job_exception_keeps_it_scheduled(self, time):
+        # setup
+        time.time.return_value = 100
+        scheduler = Scheduler()
+        job = MagicMock(side_effect=Exception)
+        scheduler.every(1, job, name='poll')
+
+        # action
+        scheduler.run_next()
+        scheduler.run_next()
+
+        # confirm
+        self.assertEqual(job.call_count, 2)
+
+    def test_run(self, time):
+        # setup
+        time.time.return_value = 100
+        scheduler = Scheduler()
+        job = MagicMock()
+        scheduler.every(1, job, name='poll')
+
+        # action
+        scheduler.run(MagicMock(side_effect=[True, True, False]))
+
+        # confirm
+        self.assertEqual(job.call_count, 2)
+
+    def test_running_job_is_not_started_again(self, time):
+        # setup
+        time.time.return_value = 100
+        scheduler = Scheduler()
+        release = threading.Event()
+        job = MagicMock(side_effect=lambda: release.wait())
+        executor = ThreadPoolExecutor(max_workers=2)
+        scheduler.every(1, job, name='snapshot', executor=executor)
+
+        # action
+        scheduler.run_next()
+        scheduler.run_next()
+        release.set()
+        executor.shutdown(wait=True)
+
+        # confirm
+        self.assertEqual(job.call_count, 1)
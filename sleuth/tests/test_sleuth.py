@@ -1,8 +1,21 @@
+from futures import Future
 from mock import patch, call, MagicMock, Mock
+import cPickle as pickle
+import datetime
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest2
 import logging
 
-from sleuth import Sleuth, Story, Task, main, continue_tracking
+from sleuth import Sleuth, Story, Task, Note, main, continue_tracking, STORY_BUILDER
+from sleuth import EMPTY_DICT, EMPTY_LIST
+from sleuth import pt_api
+from sleuth import snapshot
+from sleuth.changes import Change
 
 
 def flatten_list(alist):
@@ -14,6 +27,35 @@ def flatten_list(alist):
     return return_list
 
 
+def story_xml(children='', **fields):
+    """ Return the objectified story xml with the fields, and the children xml
+    """
+    return pt_api.objectify('<story><id type="integer">1</id>%s%s</story>' % (
+        ''.join('<%s>%s</%s>' % (tag, value, tag) for tag, value in sorted(fields.items())), children))
+
+
+def loaded(sleuth):
+    """ Wait for sleuth to load the stories in the background
+    """
+    assert sleuth.wait_until_ready(5)
+    return sleuth
+
+
+def as_future(function):
+    """ Wrap function to return a future of its result, like the pt_api
+        async calls do
+    """
+    def submit(*args, **kwargs):
+        kwargs.pop('executor', None)
+        future = Future()
+        try:
+            future.set_result(function(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    return submit
+
+
 @patch('sleuth.pt_api')
 @patch('sleuth.Story')
 @patch('sleuth.pt_api.to_str', MagicMock())
@@ -37,27 +79,68 @@ class Test_Sleuth(unittest2.TestCase):
 
     def test_init(self, Story, pt_api):
         # setup
-        pt_api.get_stories.side_effect = [self.project1_current, self.project1_backlog, self.project2_current, self.project2_backlog]
+        pt_api.get_stories_async.side_effect = as_future(MagicMock(side_effect=[self.project1_current, self.project1_backlog,
+                                                                             self.project2_current, self.project2_backlog]))
 
         # action
-        sleuth = Sleuth(self.project_ids, self.track_blocks, self.token, 10)
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
 
         # confirm
         self.assertEqual(sleuth.project_ids, self.project_ids)
         self.assertEqual(sleuth.token, self.token)
         self.assertEqual(sleuth.track_blocks, self.track_blocks)
 
-        expected_get_story_calls = [call(1, 'current', self.token, story_constructor=Story.create),
-                                    call(1, 'backlog', self.token, story_constructor=Story.create),
-                                    call(2, 'current', self.token, story_constructor=Story.create),
-                                    call(2, 'backlog', self.token, story_constructor=Story.create)]
-        self.assertListEqual(expected_get_story_calls, pt_api.get_stories.call_args_list)
+        expected_get_story_calls = [call(1, 'current', self.token, Story.create, story_builder=STORY_BUILDER,
+                                         executor=sleuth.executor),
+                                    call(1, 'backlog', self.token, Story.create, story_builder=STORY_BUILDER,
+                                         executor=sleuth.executor),
+                                    call(2, 'current', self.token, Story.create, story_builder=STORY_BUILDER,
+                                         executor=sleuth.executor),
+                                    call(2, 'backlog', self.token, Story.create, story_builder=STORY_BUILDER,
+                                         executor=sleuth.executor)]
+        self.assertListEqual(expected_get_story_calls, pt_api.get_stories_async.call_args_list)
 
         self.assertDictEqual(self.stories, sleuth.stories)
 
+    def test_add_project(self, Story, pt_api):
+        # setup
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
+        pt_api.get_stories_async.reset_mock()
+        pt_api.get_stories_async.side_effect = as_future(MagicMock(side_effect=[self.project1_current, self.project1_backlog]))
+
+        # action
+        sleuth.add_project(3)
+
+        # confirm
+        sleuth.load_stories_thread.join(5)
+        self.assertTrue(sleuth.is_loaded(3))
+        self.assertEqual(sleuth.project_ids, [1, 2, 3])
+        self.assertEqual(self.project_ids, [1, 2])
+        self.assertListEqual([call(3, 'current', self.token, Story.create, story_builder=STORY_BUILDER,
+                                         executor=sleuth.executor),
+                              call(3, 'backlog', self.token, Story.create, story_builder=STORY_BUILDER,
+                                         executor=sleuth.executor)],
+                             pt_api.get_stories_async.call_args_list)
+        for story in flatten_list([self.project1_current, self.project1_backlog]):
+            self.assertIs(sleuth.stories[story.id], story)
+        self.assertIsNotNone(sleuth._get_last_updated(3, 'v4'))
+
+    def test_remove_project(self, Story, pt_api):
+        # setup
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
+        sleuth.stories = {1: MagicMock(id=1, project_id=1), 2: MagicMock(id=2, project_id=2)}
+
+        # action
+        sleuth.remove_project(2)
+
+        # confirm
+        self.assertEqual(sleuth.project_ids, [1])
+        self.assertEqual(sleuth.stories.keys(), [1])
+        self.assertRaises(KeyError, sleuth._get_last_updated, 2, 'v4')
+
     def test_process_activity_story_update(self, Story, pt_api):
         # setup
-        sleuth = Sleuth(self.project_ids, self.track_blocks, self.token, 10)
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
         sleuth.stories = self.stories
         updated_story = MagicMock(id=15)
         activity = MagicMock(event_type='story_update')
@@ -69,9 +152,39 @@ class Test_Sleuth(unittest2.TestCase):
         # confirm
         sleuth.stories[15].update.assert_called_once_with(activity, updated_story)
 
+    def test_process_activity_repeat(self, Story, pt_api):
+        # setup
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
+        sleuth.stories = self.stories
+        updated_story = MagicMock(id=15)
+        activity = MagicMock(id=100, event_type='story_update')
+        activity.stories.iterchildren.return_value = [updated_story]
+
+        # action
+        sleuth.process_activity(activity)
+        sleuth.process_activity(activity)
+
+        # confirm
+        sleuth.stories[15].update.assert_called_once_with(activity, updated_story)
+
+    def test_process_activity_journal(self, Story, pt_api):
+        # setup
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10, journal=MagicMock()))
+        sleuth.stories = self.stories
+        activity = MagicMock(event_type='story_update')
+        replayed_activity = MagicMock(event_type='story_update')
+        pt_api.to_str.side_effect = lambda activity: activity
+
+        # action
+        sleuth.process_activity(activity)
+        sleuth.process_activity(replayed_activity, record=False)
+
+        # confirm
+        sleuth.journal.append.assert_called_once_with(activity)
+
     def test_process_activity_story_move_into_project(self, Story, pt_api):
         # setup
-        sleuth = Sleuth(self.project_ids, self.track_blocks, self.token, 10)
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
         sleuth.stories = self.stories
         moved_story = MagicMock(id=15)
         activity = MagicMock(event_type='move_into_project')
@@ -85,7 +198,7 @@ class Test_Sleuth(unittest2.TestCase):
 
     def test_process_activity_story_create(self, Story, pt_api):
         # setup
-        sleuth = Sleuth(self.project_ids, self.track_blocks, self.token, 10)
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
         sleuth.stories = self.stories
         created_story = MagicMock(id=19)
         activity = MagicMock(event_type='story_create')
@@ -100,7 +213,7 @@ class Test_Sleuth(unittest2.TestCase):
 
     def test_process_activity_story_delete(self, Story, pt_api):
         # setup
-        sleuth = Sleuth(self.project_ids, self.track_blocks, self.token, 10)
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
         sleuth.stories = self.stories
         deleted_story = MagicMock(id=15)
         activity = MagicMock(event_type='story_delete')
@@ -115,7 +228,7 @@ class Test_Sleuth(unittest2.TestCase):
     @patch('sleuth.Sleuth.log_unknown_story')
     def test_process_activity_delete_unknown_story(self, log_unknown_story, Story, pt_api):
         # setup
-        sleuth = Sleuth(self.project_ids, self.track_blocks, self.token, 10)
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
         sleuth.stories = {}
         deleted_story = MagicMock(id=99999)
         activity = MagicMock(event_type='story_delete')
@@ -130,7 +243,7 @@ class Test_Sleuth(unittest2.TestCase):
     @patch('sleuth.Sleuth.log_unknown_story')
     def test_process_activity_note_create_unknown_story(self, log_unknown_story, Story, pt_api):
         # setup
-        sleuth = Sleuth(self.project_ids, self.track_blocks, self.token, 10)
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
         sleuth.stories = {}
         note_create_story = MagicMock(id=15)
         activity = MagicMock(event_type='note_create')
@@ -144,7 +257,7 @@ class Test_Sleuth(unittest2.TestCase):
 
     def test_process_activity_note_create(self, Story, pt_api):
         # setup
-        sleuth = Sleuth(self.project_ids, self.track_blocks, self.token, 10)
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
         sleuth.stories = self.stories
         note_create_story = MagicMock(id=15)
         notexml = MagicMock()
@@ -160,7 +273,7 @@ class Test_Sleuth(unittest2.TestCase):
 
     def test_process_activity_task_create(self, Story, pt_api):
         # setup
-        sleuth = Sleuth(self.project_ids, self.track_blocks, self.token, 10)
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
         sleuth.stories = self.stories
         task_create_story = MagicMock(id=15)
         taskxml = MagicMock()
@@ -176,7 +289,7 @@ class Test_Sleuth(unittest2.TestCase):
 
     def test_process_activity_task_delete(self, Story, pt_api):
         # setup
-        sleuth = Sleuth(self.project_ids, self.track_blocks, self.token, 10)
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
         sleuth.stories = self.stories
         task_deletes_story = MagicMock(id=15)
         taskxml = MagicMock(id=1)
@@ -193,7 +306,7 @@ class Test_Sleuth(unittest2.TestCase):
     @patch('sleuth.Sleuth.log_unknown_task')
     def test_process_activity_task_delete_unknown_task(self, log_unknown_task, Story, pt_api):
         # setup
-        sleuth = Sleuth(self.project_ids, self.track_blocks, self.token, 10)
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
         sleuth.stories = self.stories
         task_deletes_story = MagicMock(id=15)
         taskxml = MagicMock(id=99999)
@@ -209,7 +322,7 @@ class Test_Sleuth(unittest2.TestCase):
 
     def test_process_activity_task_update(self, Story, pt_api):
         # setup
-        sleuth = Sleuth(self.project_ids, self.track_blocks, self.token, 10)
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
         sleuth.stories = self.stories
         task_updated_story = MagicMock(id=15)
         taskxml = MagicMock(id=1, complete=True)
@@ -225,7 +338,7 @@ class Test_Sleuth(unittest2.TestCase):
 
     def test_process_activity_comment_delete(self, Story, pt_api):
         # setup
-        sleuth = Sleuth(self.project_ids, self.track_blocks, self.token, 10)
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
         sleuth.stories = self.stories
         comment_delete_story = MagicMock(id=15)
         commentxml = MagicMock(id=1)
@@ -242,7 +355,7 @@ class Test_Sleuth(unittest2.TestCase):
     @patch('sleuth.Sleuth.log_unknown_comment')
     def test_process_activity_comment_delete_unknown(self, log_unknown_comment, Story, pt_api):
         # setup
-        sleuth = Sleuth(self.project_ids, self.track_blocks, self.token, 10)
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
         sleuth.stories = self.stories
         comment_delete_story = MagicMock(id=15)
         commentxml = MagicMock(id=99999)
@@ -259,7 +372,7 @@ class Test_Sleuth(unittest2.TestCase):
     @patch('sleuth.logger')
     def test_process_activity_unknown_event(self, logger, Story, pt_api):
         # setup
-        sleuth = Sleuth(self.project_ids, self.track_blocks, self.token, 10)
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
         sleuth.stories = self.stories
         comment_delete_story = MagicMock(id=15)
         commentxml = MagicMock(id=1)
@@ -271,86 +384,909 @@ class Test_Sleuth(unittest2.TestCase):
         sleuth.process_activity(activity)
 
         # confirm
-        logger.warning.assert_called_once_with('Unknown event type: sdhghsldjh176581347687sghfvsdjlh87e5923878')
+        logger.warning.assert_called_once_with('Unknown event type: %s', 'sdhghsldjh176581347687sghfvsdjlh87e5923878')
 
-    @patch('sleuth.Sleuth.process_activity')
-    @patch('sleuth.Sleuth._set_last_updated')
-    @patch('sleuth.Sleuth._get_last_updated')
-    def test_collect_task_stories(self, _get_last_updated, _set_last_updated, process_activity, Story, pt_api):
+    @patch('sleuth.logger')
+    def test_register_handler(self, logger, Story, pt_api):
+        # setup
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
+        handler = MagicMock()
+        activity = MagicMock(event_type='epic_create')
+        sleuth.register_handler('epic_create', handler)
+
+        # action
+        sleuth.process_activity(activity)
+
+        # confirm
+        handler.assert_called_once_with(activity)
+        self.assertFalse(logger.warning.called)
+
+    def test_register_handler_replaces(self, Story, pt_api):
         # setup
-        sleuth = Sleuth(self.project_ids, self.track_blocks, self.token, 10)
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
         sleuth.stories = self.stories
-        v3_project1_activities = [MagicMock()]
-        v4_project1_activities = [MagicMock()]
-        v3_project2_activities = [MagicMock()]
-        v4_project2_activities = [MagicMock(), MagicMock(event_type='task_delete'), MagicMock(event_type='task_edit'),
-                                  MagicMock(event_type='task_create'), MagicMock(event_type='comment_delete')]
-        v3_project1_activities_xml = MagicMock(iterchildren=MagicMock(return_value=v3_project1_activities))
-        v4_project1_activities_xml = MagicMock(iterchildren=MagicMock(return_value=v4_project1_activities))
-        v3_project2_activities_xml = MagicMock(iterchildren=MagicMock(return_value=v3_project2_activities))
-        v4_project2_activities_xml = MagicMock(iterchildren=MagicMock(return_value=v4_project2_activities))
+        handler = MagicMock()
+        activity = MagicMock(event_type='story_update')
+        sleuth.register_handler('story_update', handler)
 
-        pt_api.get_project_activities_v3.side_effect = [v3_project1_activities_xml, v3_project2_activities_xml]
-        pt_api.get_project_activities.side_effect = [v4_project1_activities_xml, v4_project2_activities_xml]
+        # action
+        sleuth.process_activity(activity)
+
+        # confirm
+        handler.assert_called_once_with(activity)
+        self.assertFalse(activity.stories.iterchildren.called)
+
+    def test_event_stats(self, Story, pt_api):
+        # setup
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
+        sleuth.stories = self.stories
+        activities = [MagicMock(id=100, event_type='move_from_project'),
+                      MagicMock(id=101, event_type='move_from_project'), MagicMock(id=102, event_type='epic_create')]
 
         # action
-        sleuth.collect_task_updates()
+        for activity in activities:
+            sleuth.process_activity(activity)
 
         # confirm
-        self.assertListEqual([call(1, _get_last_updated.return_value, '--token--'), call(2, _get_last_updated.return_value, '--token--')], pt_api.get_project_activities_v3.call_args_list)
-        self.assertListEqual([call(1, _get_last_updated.return_value, '--token--'), call(2, _get_last_updated.return_value, '--token--')], pt_api.get_project_activities.call_args_list)
-        expected_process_activity_calls = []
-        for activity in v3_project1_activities + v3_project2_activities + v4_project2_activities[1:]:
-            expected_process_activity_calls.append(call(activity))
-        self.assertListEqual(expected_process_activity_calls, process_activity.call_args_list)
+        event_stats = sleuth.event_stats()
+        self.assertEqual(sorted(event_stats), ['epic_create', 'move_from_project'])
+        self.assertEqual(event_stats['move_from_project']['count'], 2)
+        self.assertEqual(event_stats['epic_create']['count'], 1)
+        self.assertGreaterEqual(event_stats['epic_create']['seconds'], 0)
 
-    @patch('sleuth.Sleuth.process_activity')
+    @patch('sleuth.Sleuth.process_activities')
     @patch('sleuth.Sleuth._set_last_updated')
     @patch('sleuth.Sleuth._get_last_updated')
-    def test_collect_task_stories_None(self, _get_last_updated, _set_last_updated, process_activity, Story, pt_api):
+    def test_collect_task_stories(self, _get_last_updated, _set_last_updated, process_activities, Story, pt_api):
         # setup
-        sleuth = Sleuth(self.project_ids, self.track_blocks, self.token, 10)
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
         sleuth.stories = self.stories
-        v4_project1_activities = [MagicMock()]
-        v3_project2_activities = [MagicMock()]
-        v4_project1_activities_xml = MagicMock(iterchildren=MagicMock(return_value=v4_project1_activities))
-        v3_project2_activities_xml = MagicMock(iterchildren=MagicMock(return_value=v3_project2_activities))
+        project1_activities = [MagicMock(occurred_at='2013/08/07 20:33:31'),
+                               MagicMock(occurred_at='2013/08/07 20:33:30')]
+        project2_activities = [MagicMock(occurred_at='2013/08/07 20:33:34'),
+                               MagicMock(event_type='task_delete', occurred_at='2013/08/07 20:33:35'),
+                               MagicMock(event_type='task_edit', occurred_at='2013/08/07 20:33:32'),
+                               MagicMock(event_type='task_create', occurred_at='2013/08/07 20:33:36'),
+                               MagicMock(event_type='comment_delete', occurred_at='2013/08/07 20:33:37')]
+        activities_xml = {1: MagicMock(iterchildren=MagicMock(return_value=project1_activities)),
+                          2: MagicMock(iterchildren=MagicMock(return_value=project2_activities))}
+
+        pt_api.stream_project_activities_async.side_effect = as_future(
+            lambda project_id, since, token, event_types: activities_xml[project_id])
 
-        pt_api.get_project_activities_v3.side_effect = [None, v3_project2_activities_xml]
-        pt_api.get_project_activities.side_effect = [v4_project1_activities_xml, None]
+        # action
+        sleuth.collect_task_updates()
+
+        # confirm
+        event_types = frozenset(sleuth.EVENT_HANDLERS) - set(['move_from_project'])
+        self.assertListEqual([call(1, _get_last_updated.return_value, '--token--', event_types,
+                                   executor=sleuth.executor),
+                              call(2, _get_last_updated.return_value, '--token--', event_types,
+                                   executor=sleuth.executor)],
+                             pt_api.stream_project_activities_async.call_args_list)
+        process_activities.assert_called_once_with([project1_activities[1], project1_activities[0],
+                                                    project2_activities[2], project2_activities[0],
+                                                    project2_activities[1], project2_activities[3],
+                                                    project2_activities[4]])
+
+    @patch('sleuth.Sleuth.process_activities')
+    def test_collect_task_stories_some_projects(self, process_activities, Story, pt_api):
+        # setup
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
+        sleuth.processed_activities.add(100)
+        activities = [MagicMock(id=100, occurred_at='2013/08/07 20:33:31'),
+                      MagicMock(id=101, occurred_at='2013/08/07 20:33:32')]
+        pt_api.stream_project_activities_async.side_effect = as_future(
+            lambda project_id, since, token, event_types: MagicMock(iterchildren=MagicMock(return_value=activities)))
+        last_updated = sleuth._get_last_updated(1, 'v4')
+
+        # action
+        new_activities = sleuth.collect_task_updates([2])
+
+        # confirm
+        self.assertEqual(new_activities, {2: 1})
+        self.assertEqual(pt_api.stream_project_activities_async.call_args[0][0], 2)
+        self.assertEqual(sleuth._get_last_updated(1, 'v4'), last_updated)
+        process_activities.assert_called_once_with(activities)
+
+    @patch('sleuth.Sleuth.process_activities')
+    def test_collect_task_stories_not_activities(self, process_activities, Story, pt_api):
+        # setup
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
+        last_updated = sleuth._get_last_updated(1, 'v4')
+        project2_activities = [MagicMock(id=101)]
+        activities_xml = {1: MagicMock(iterchildren=MagicMock(return_value=[object()])),
+                          2: MagicMock(iterchildren=MagicMock(return_value=project2_activities))}
+        pt_api.stream_project_activities_async.side_effect = as_future(
+            lambda project_id, since, token, event_types: activities_xml[project_id])
+
+        # action
+        new_activities = sleuth.collect_task_updates()
+
+        # confirm
+        self.assertEqual(new_activities, {2: 1})
+        self.assertEqual(sleuth._get_last_updated(1, 'v4'), last_updated)
+        self.assertNotEqual(sleuth._get_last_updated(2, 'v4'), last_updated)
+        process_activities.assert_called_once_with(project2_activities)
+
+    @patch('sleuth.Sleuth.process_activities')
+    def test_collect_task_stories_fetch_fails(self, process_activities, Story, pt_api):
+        # setup
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10))
+        last_updated = sleuth._get_last_updated(1, 'v4')
+        pt_api.stream_project_activities_async.side_effect = as_future(
+            Mock(side_effect=[Exception, MagicMock(iterchildren=MagicMock(return_value=[]))]))
 
         # action
         sleuth.collect_task_updates()
 
         # confirm
-        self.assertListEqual([call(1, _get_last_updated.return_value, '--token--'), call(2, _get_last_updated.return_value, '--token--')], pt_api.get_project_activities_v3.call_args_list)
-        self.assertListEqual([call(1, _get_last_updated.return_value, '--token--'), call(2, _get_last_updated.return_value, '--token--')], pt_api.get_project_activities.call_args_list)
-        expected_process_activity_calls = []
-        for activity in v3_project2_activities:
-            expected_process_activity_calls.append(call(activity))
-        self.assertListEqual(expected_process_activity_calls, process_activity.call_args_list)
+        self.assertEqual(sleuth._get_last_updated(1, 'v4'), last_updated)
+        self.assertNotEqual(sleuth._get_last_updated(2, 'v4'), last_updated)
+        process_activities.assert_called_once_with([])
 
 
-class Test_Story(unittest2.TestCase):
+@patch('sleuth.pt_api')
+class Test_Sleuth_snapshot(unittest2.TestCase):
 
-    def test_get_data_from_story_xml(self):
+    def setUp(self):
+        self.project_ids = [1, 2]
+        self.track_blocks = ['current', 'backlog']
+        self.token = '--token--'
+
+    def make_snapshot_sleuth(self, pt_api):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        snapshot_path = os.path.join(directory, 'snapshot')
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10, snapshot_path=snapshot_path))
+        sleuth.stories = {1: Story(1, 1, 'feature', None, 1, 'started', None, 'name', None, None, None, None, None, None, None),
+                          2: Story(2, 2, 'bug', None, 2, 'accepted', None, 'name', None, None, None, None, None, None, None)}
+        sleuth.processed_activities.add(100)
+        sleuth._kept_story_ids.update([1, 2])
+        sleuth._set_last_updated(datetime.datetime(2013, 8, 7, 20, 33, 30), 1, 'v4')
+        sleuth.save_snapshot()
+        pt_api.get_stories_async.reset_mock()
+        return snapshot_path
+
+    def test_restore_snapshot(self, pt_api):
         # setup
-        storyxml = Mock(story_type='story_type', current_state='current_state', description='description',
-                        requested_by='requested_by', created_at='created_at', labels='labels')
+        snapshot_path = self.make_snapshot_sleuth(pt_api)
+        pt_api.get_stories_async.side_effect = as_future(MagicMock(return_value=[]))
 
-        del storyxml.url
-        del storyxml.estimate
-        del storyxml.name
-        del storyxml.owned_by
-        del storyxml.accepted_at
+        # action
+        sleuth = loaded(Sleuth([1, 3], self.track_blocks, self.token, 10, snapshot_path=snapshot_path))
+
+        # confirm
+        self.assertEqual(sleuth.stories.keys(), [1])
+        self.assertEqual(sleuth.stories[1].current_state, 'started')
+        self.assertIn(100, sleuth.processed_activities)
+        self.assertEqual(sleuth._kept_story_ids, set([1]))
+        self.assertEqual(sleuth._get_last_updated(1, 'v4'), datetime.datetime(2013, 8, 7, 20, 33, 30))
+        self.assertListEqual([call(3, 'current', self.token, Story.create, story_builder=STORY_BUILDER,
+                                         executor=sleuth.executor),
+                              call(3, 'backlog', self.token, Story.create, story_builder=STORY_BUILDER,
+                                         executor=sleuth.executor)],
+                             pt_api.get_stories_async.call_args_list)
+
+    @patch('sleuth.journal.replay_batches')
+    def test_restore_snapshot_replays_journal(self, replay_batches, pt_api):
+        # setup
+        activity_journal = MagicMock()
+        activity_journal.position.return_value = (1, 100)
+        pt_api.get_stories_async.side_effect = as_future(MagicMock(return_value=[]))
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        snapshot_path = os.path.join(directory, 'snapshot')
+        loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10, snapshot_path=snapshot_path,
+                      journal=activity_journal)).save_snapshot()
+
+        # action
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10, snapshot_path=snapshot_path,
+                               journal=activity_journal))
 
-        notexml1 = MagicMock()
-        notexml2 = MagicMock()
-        storyxml.notes.iterchildren.return_value = [notexml1, notexml2]
+        # confirm
+        directory, apply_batch, since = replay_batches.call_args[0]
+        self.assertEqual(directory, activity_journal.directory)
+        self.assertEqual(since, (1, 100))
+        activity_journal.remove_before.assert_called_once_with((1, 100))
+        with patch('sleuth.Sleuth.process_activities') as process_activities:
+            apply_batch(['activity'])
+        process_activities.assert_called_once_with(['activity'], record=False)
+
+    def test_restore_snapshot_loads_new_projects_in_background(self, pt_api):
+        # setup
+        snapshot_path = self.make_snapshot_sleuth(pt_api)
+        current, backlog = Future(), Future()
+        pt_api.get_stories_async.side_effect = [current, backlog]
+
+        # action
+        sleuth = Sleuth([1, 3], self.track_blocks, self.token, 10, snapshot_path=snapshot_path)
 
-        taskxml1 = MagicMock()
-        taskxml2 = MagicMock()
-        storyxml.tasks.iterchildren.return_value = [taskxml1, taskxml2]
+        # confirm
+        self.assertFalse(sleuth.ready.is_set())
+        self.assertEqual(sleuth.stories.keys(), [1])
+        current.set_result([])
+        backlog.set_result([])
+        self.assertTrue(sleuth.wait_until_ready(5))
+        self.assertEqual(sorted(sleuth.load_progress()), [3])
+
+    def test_snapshot_leaves_out_incomplete_projects(self, pt_api):
+        # setup
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        snapshot_path = os.path.join(directory, 'snapshot')
+        pt_api.get_stories_async.side_effect = as_future(MagicMock(side_effect=[[], [], [], Exception]))
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10, snapshot_path=snapshot_path))
+
+        # action
+        sleuth.save_snapshot()
+        saved_project_ids = snapshot.load(snapshot_path, datetime.timedelta(hours=1))['project_ids']
+        pt_api.get_stories_async.side_effect = as_future(MagicMock(return_value=[]))
+        sleuth.reconcile_project(2)
+        sleuth.save_snapshot()
+
+        # confirm
+        self.assertEqual(saved_project_ids, [1])
+        self.assertEqual(snapshot.load(snapshot_path, datetime.timedelta(hours=1))['project_ids'], [1, 2])
+
+    def test_snapshot_while_applying(self, pt_api):
+        # setup
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        snapshot_path = os.path.join(directory, 'snapshot')
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10, snapshot_path=snapshot_path))
+        sleuth.stories = {}
+        sleuth.register_handler('story_update', lambda activity: sleuth.save_snapshot())
+        sleuth.process_activity(MagicMock(id=100, event_type='epic_create'))
+
+        # action
+        sleuth.process_activity(MagicMock(id=101, event_type='story_update'))
+        saved_while_one = snapshot.load(snapshot_path, datetime.timedelta(hours=1))['processed_activities']
+        sleuth.process_activities([MagicMock(id=102, event_type='story_update')])
+        saved_while_batch = snapshot.load(snapshot_path, datetime.timedelta(hours=1))['processed_activities']
+
+        # confirm
+        self.assertIn(100, saved_while_one)
+        self.assertNotIn(101, saved_while_one)
+        self.assertIn(101, saved_while_batch)
+        self.assertNotIn(102, saved_while_batch)
+        self.assertIn(102, sleuth.processed_activities)
+        self.assertEqual(sleuth._applying_activity_ids, set())
+
+    def test_restore_snapshot_corrupt(self, pt_api):
+        # setup
+        snapshot_path = self.make_snapshot_sleuth(pt_api)
+        with open(snapshot_path, 'r+b') as snapshot_file:
+            snapshot_file.seek(30)
+            snapshot_file.write('corrupt')
+
+        # action
+        sleuth = loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10, snapshot_path=snapshot_path))
+
+        # confirm
+        self.assertEqual(pt_api.get_stories_async.call_count, 4)
+        self.assertNotIn(100, sleuth.processed_activities)
+
+    def test_restore_snapshot_stale(self, pt_api):
+        # setup
+        snapshot_path = self.make_snapshot_sleuth(pt_api)
+
+        # action
+        loaded(Sleuth(self.project_ids, self.track_blocks, self.token, 10, snapshot_path=snapshot_path,
+                      snapshot_max_age=datetime.timedelta(0)))
+
+        # confirm
+        self.assertEqual(pt_api.get_stories_async.call_count, 4)
+
+
+@patch('sleuth.pt_api')
+@patch('sleuth.pt_api.to_str', MagicMock())
+class Test_Sleuth_concurrency(unittest2.TestCase):
+
+    def meeting_story(self, story_id, entered, other_entered, met):
+        """ A story whose update waits for the update of another story to
+            start, which only happens if the two are updated at the same time
+        """
+        def update(*args):
+            entered.set()
+            met.append(other_entered.wait(5))
+        return MagicMock(id=story_id, update=MagicMock(side_effect=update))
+
+    def make_activity(self, sleuth, story):
+        sleuth.stories[story.id] = story
+        activity = MagicMock(id=story.id, event_type='story_update')
+        activity.stories.iterchildren.return_value = [MagicMock(id=story.id)]
+        return activity
+
+    def test_stories_on_different_stripes_are_updated_concurrently(self, pt_api):
+        # setup
+        sleuth = loaded(Sleuth([1], ['current'], '--token--', 10))
+        self.assertIsNot(sleuth.story_locks(1), sleuth.story_locks(2))
+        entered1, entered2, met = threading.Event(), threading.Event(), []
+        activities = [self.make_activity(sleuth, self.meeting_story(1, entered1, entered2, met)),
+                      self.make_activity(sleuth, self.meeting_story(2, entered2, entered1, met))]
+
+        # action
+        threads = [threading.Thread(target=sleuth.process_activity, args=(activity,)) for activity in activities]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # confirm
+        self.assertEqual(met, [True, True])
+        for activity in activities:
+            storyxml = activity.stories.iterchildren.return_value[0]
+            sleuth.stories[storyxml.id].update.assert_called_once_with(activity, storyxml)
+
+    def test_stories_view(self, pt_api):
+        # setup
+        sleuth = loaded(Sleuth([1], ['current'], '--token--', 10))
+        story = Story(1, 1, 'feature', None, 1, 'started', None, 'name', None, None, None, None, None, None, 'a,b')
+        sleuth.stories = {1: story}
+
+        # action
+        view = sleuth.stories_view()
+        story.labels.append('c')
+        story.current_state = 'finished'
+
+        # confirm
+        self.assertEqual(view[1].labels, ['a', 'b'])
+        self.assertEqual(view[1].current_state, 'started')
+        self.assertIsNot(view[1], story)
+
+
+ACTIVITY = '''<activity>
+  <id type="integer">%(id)s</id>
+  <event_type>%(event_type)s</event_type>
+  <occurred_at type="datetime">2013/08/07 20:33:30 UTC</occurred_at>
+  <author>Dana Deer</author>
+  <project_id type="integer">%(project_id)s</project_id>
+  <description>Dana Deer edited a story</description>
+  <stories type="array">
+    <story>
+      <id type="integer">%(story_id)s</id>
+      %(fields)s
+    </story>
+  </stories>
+</activity>'''
+
+
+def make_activity(activity_id, event_type, story_id, fields='', project_id=1):
+    return pt_api.objectify(ACTIVITY % {'id': activity_id, 'event_type': event_type, 'story_id': story_id,
+                                        'fields': fields, 'project_id': project_id})
+
+
+@patch('sleuth.pt_api.get_stories_async')
+@patch('sleuth.pt_api.to_str', MagicMock())
+class Test_Sleuth_indexes(unittest2.TestCase):
+
+    def make_sleuth(self, get_stories_async):
+        stories = [Story(1, 1, u'feature', None, 1, u'delivered', None, u'one', None, u'Rob', None, None, None, None,
+                         u'ui'),
+                   Story(2, 1, u'bug', None, 1, u'started', None, u'two', None, u'Rob', None, None, None, None, None)]
+        get_stories_async.side_effect = as_future(MagicMock(side_effect=[stories, []]))
+        return loaded(Sleuth([1, 2], ['current'], '--token--', 10))
+
+    def test_load_stories(self, get_stories_async):
+        # action
+        sleuth = self.make_sleuth(get_stories_async)
+
+        # confirm
+        self.assertEqual([story.id for story in sleuth.query(owned_by=u'Rob', label=u'ui')], [1])
+        self.assertEqual(sorted(story.id for story in sleuth.query(project_id=1)), [1, 2])
+
+    def test_serve_while_loading(self, get_stories_async):
+        # setup
+        project1, project2 = Future(), Future()
+        get_stories_async.side_effect = [project1, project2]
+        sleuth = Sleuth([1, 2], ['current'], '--token--', 10)
+
+        # action
+        stats = sleuth.process_activities([make_activity(100, 'story_create', 3, '<owned_by>Rob</owned_by>'),
+                                           make_activity(101, 'story_create', 4, project_id=2)])
+        sleuth.process_activity(make_activity(102, 'story_update', 3, '<owned_by>Sam</owned_by>'))
+
+        # confirm
+        self.assertFalse(sleuth.ready.is_set())
+        self.assertEqual(stats[:5], (2, 2, 0, 0, 0))
+        self.assertEqual(sleuth.stories, {})
+        self.assertEqual(sleuth.load_progress()[1], {'blocks': 1, 'loaded': 0, 'failed': 0, 'buffered': 2,
+                                                     'ready': False})
+        project1.set_result([Story(1, 1, u'feature', None, 1, u'started', None, u'one', None, None, None, None,
+                                   None, None, None)])
+        project2.set_exception(Exception())
+        self.assertTrue(sleuth.wait_until_ready(5))
+        self.assertEqual(sorted(sleuth.stories), [1, 3, 4])
+        self.assertEqual(sleuth.stories[3].owned_by, u'Sam')
+        self.assertTrue(sleuth.is_loaded(1))
+        self.assertEqual(sleuth.load_progress(), {
+            1: {'blocks': 1, 'loaded': 1, 'failed': 0, 'buffered': 0, 'ready': True},
+            2: {'blocks': 1, 'loaded': 0, 'failed': 1, 'buffered': 0, 'ready': True}})
+
+    def test_add_project_loads_in_background(self, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+        project3 = Future()
+        get_stories_async.side_effect = [project3]
+
+        # action
+        sleuth.add_project(3)
+        sleuth.process_activity(make_activity(100, 'story_create', 5, project_id=3))
+
+        # confirm
+        self.assertFalse(sleuth.is_loaded(3))
+        self.assertEqual(sleuth.project_ids, [1, 2, 3])
+        self.assertNotIn(5, sleuth.stories)
+        project3.set_result([Story(4, 3, u'feature', None, 1, u'started', None, u'four', None, None, None, None,
+                                   None, None, None)])
+        sleuth.load_stories_thread.join(5)
+        self.assertTrue(sleuth.is_loaded(3))
+        self.assertEqual(sorted(sleuth.stories), [1, 2, 4, 5])
+        self.assertTrue(sleuth.ready.is_set())
+
+    def test_remove_project_while_loading(self, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+        project3 = Future()
+        get_stories_async.side_effect = [project3]
+        sleuth.add_project(3)
+        sleuth.process_activity(make_activity(100, 'story_create', 5, project_id=3))
+
+        # action
+        sleuth.remove_project(3)
+        project3.set_result([Story(4, 3, u'feature', None, 1, u'started', None, u'four', None, None, None, None,
+                                   None, None, None)])
+        sleuth.load_stories_thread.join(5)
+
+        # confirm
+        self.assertEqual(sorted(sleuth.stories), [1, 2])
+        self.assertNotIn(3, sleuth.load_progress())
+        self.assertTrue(sleuth.is_loaded(3))
+
+    def test_remove_project(self, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+        sleuth._kept_story_ids.update([1, 2])
+        sleuth._incomplete_project_ids.add(1)
+
+        # action
+        sleuth.remove_project(1)
+
+        # confirm
+        self.assertEqual(sleuth.stories, {})
+        self.assertEqual(sleuth._kept_story_ids, set())
+        self.assertEqual(sleuth._incomplete_project_ids, set())
+        self.assertEqual(sleuth.query(project_id=1), [])
+        self.assertEqual(sleuth.check_aggregates(), {})
+
+    def test_activities(self, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+
+        # action
+        sleuth.process_activity(make_activity(100, 'story_update', 2,
+                                              '<current_state>delivered</current_state><labels>ui</labels>'))
+        sleuth.process_activity(make_activity(101, 'story_create', 3,
+                                              '<current_state>delivered</current_state><owned_by>Rob</owned_by>'))
+        sleuth.process_activity(make_activity(102, 'story_delete', 1))
+        sleuth.process_activity(make_activity(103, 'move_into_project', 3, project_id=2))
+
+        # confirm
+        self.assertEqual([story.id for story in sleuth.query(current_state=u'delivered', label=u'ui')], [2])
+        self.assertEqual([story.id for story in sleuth.query(project_id=2, owned_by=u'Rob')], [3])
+        self.assertEqual([story.id for story in sleuth.query(project_id=1)], [2])
+
+    def test_time_index(self, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+
+        # action
+        sleuth.process_activity(make_activity(100, 'story_update', 2, '<current_state>accepted</current_state>'
+                                                                    '<accepted_at>2013/08/07 20:33:30 UTC</accepted_at>'))
+        sleuth.process_activity(make_activity(101, 'story_update', 1, '<current_state>accepted</current_state>'
+                                                                    '<accepted_at>2013/08/06 20:33:30 UTC</accepted_at>'))
+
+        # confirm
+        self.assertEqual([story.id for story in sleuth.stories_between('accepted_at', datetime.datetime(2013, 8, 7))],
+                         [2])
+        self.assertEqual([story.id for story in sleuth.latest_stories('accepted_at', 5)], [2, 1])
+
+    def test_aggregates(self, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+
+        # action
+        sleuth.process_activity(make_activity(100, 'story_update', 2, '<current_state>delivered</current_state>'
+                                                                    '<estimate type="integer">3</estimate>'))
+        sleuth.process_activity(make_activity(101, 'story_create', 3, '<current_state>started</current_state>'
+                                                                    '<estimate type="integer">2</estimate>'))
+        sleuth.process_activity(make_activity(102, 'story_delete', 1))
+
+        # confirm
+        self.assertEqual(sleuth.aggregates.points('current_state'), {u'delivered': 3, u'started': 2})
+        self.assertEqual(sleuth.aggregates.points('project_id'), {1: 5})
+        self.assertEqual(sleuth.check_aggregates(), {})
+
+    def test_changes(self, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+        subscription = sleuth.changes.subscribe()
+
+        # action
+        sleuth.process_activity(make_activity(100, 'story_update', 2, '<current_state>delivered</current_state>'))
+        sleuth.process_activity(make_activity(101, 'task_create', 2, '<tasks><task><id type="integer">7</id>'
+                                                                   '<description>a task</description></task></tasks>'))
+        sleuth.process_activity(make_activity(102, 'task_edit', 2, '<tasks><task><id type="integer">7</id>'
+                                                                 '<description>the task</description></task></tasks>'))
+
+        # confirm
+        self.assertEqual(subscription.get_batch(timeout=0),
+                         [Change('story_changed', 2, None, 'current_state', u'started', u'delivered'),
+                          Change('task_added', 2, 7, None, None, None),
+                          Change('task_changed', 2, 7, 'description', u'a task', u'the task')])
+
+    def test_process_activities(self, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+        subscription = sleuth.changes.subscribe()
+        activities = [make_activity(100, 'story_update', 2, '<current_state>finished</current_state>'),
+                      make_activity(101, 'story_update', 1, '<current_state>accepted</current_state>'),
+                      make_activity(102, 'story_update', 2, '<owned_by>Dana</owned_by>'),
+                      make_activity(100, 'story_update', 2, '<current_state>started</current_state>'),
+                      make_activity(103, 'story_update', 2, '<current_state>delivered</current_state>')]
+
+        # action
+        stats = sleuth.process_activities(activities)
+
+        # confirm
+        self.assertEqual(stats[:5], (5, 0, 1, 2, 2))
+        self.assertEqual((sleuth.stories[2].current_state, sleuth.stories[2].owned_by), (u'delivered', u'Dana'))
+        self.assertEqual(sleuth.stories[1].current_state, u'accepted')
+        self.assertEqual(subscription.get_batch(timeout=0),
+                         [Change('story_changed', 1, None, 'current_state', u'delivered', u'accepted'),
+                          Change('story_changed', 2, None, 'current_state', u'started', u'delivered'),
+                          Change('story_changed', 2, None, 'owned_by', u'Rob', u'Dana')])
+
+    def test_process_activities_keeps_order_around_other_events(self, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+        activities = [make_activity(100, 'story_update', 2, '<current_state>finished</current_state>'),
+                      make_activity(101, 'story_delete', 2),
+                      make_activity(102, 'story_update', 2, '<current_state>delivered</current_state>'),
+                      make_activity(103, 'story_update', 1, '<current_state>accepted</current_state>'),
+                      make_activity(104, 'story_update', 1, '<current_state>rejected</current_state>',
+                                    project_id=2)]
+
+        # action
+        stats = sleuth.process_activities(activities)
+
+        # confirm
+        self.assertEqual(stats[:5], (5, 0, 0, 0, 5))
+        self.assertNotIn(2, sleuth.stories)
+        self.assertEqual((sleuth.stories[1].current_state, sleuth.stories[1].project_id), (u'rejected', 2))
+
+    def test_process_activities_journal(self, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+        sleuth.journal = MagicMock()
+        activities = [make_activity(100, 'story_update', 2, '<current_state>finished</current_state>'),
+                      make_activity(101, 'story_update', 2, '<current_state>delivered</current_state>')]
+
+        # action
+        sleuth.process_activities(activities)
+
+        # confirm
+        self.assertEqual(sleuth.journal.append.call_count, 2)
+        self.assertTrue(100 in sleuth.processed_activities and 101 in sleuth.processed_activities)
+        self.assertEqual([type(activity_id) for _, activity_id in sleuth.processed_activities._seen], [int, int])
+
+    def test_process_activities_registered_handler(self, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+        handler = MagicMock()
+        sleuth.register_handler('story_update', handler)
+        activities = [make_activity(100, 'story_update', 2, '<current_state>finished</current_state>'),
+                      make_activity(101, 'story_update', 2, '<current_state>delivered</current_state>')]
+
+        # action
+        stats = sleuth.process_activities(activities)
+
+        # confirm
+        self.assertEqual(handler.call_args_list, [call(activities[0]), call(activities[1])])
+        self.assertEqual(stats.coalesced, 0)
+
+    def test_process_activity_story_removed_meanwhile(self, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+        subscription = sleuth.changes.subscribe()
+        story = sleuth.stories[2]
+        sleuth.process_activity(make_activity(100, 'story_delete', 2))
+
+        # action
+        with patch.object(sleuth, 'getStory', return_value=story):
+            sleuth.process_activity(make_activity(101, 'story_update', 2, '<current_state>finished</current_state>'))
+            sleuth.process_activity(make_activity(102, 'task_create', 2, '<tasks><task><id type="integer">7</id>'
+                                                                       '<description>a task</description></task></tasks>'))
+
+        # confirm
+        self.assertEqual(story.current_state, u'started')
+        self.assertEqual(story.tasks, {})
+        self.assertEqual([change.kind for change in subscription.get_batch(timeout=0)], ['story_removed'])
+        self.assertEqual(sleuth.check_aggregates(), {})
+
+    def test_remove_observer_while_notifying(self, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+        observer = MagicMock()
+        observer.story_changed.side_effect = lambda *args: sleuth.remove_observer(observer)
+        sleuth.observers = [observer] + sleuth.observers
+
+        # action
+        sleuth.process_activity(make_activity(100, 'story_update', 2, '<current_state>delivered</current_state>'))
+
+        # confirm
+        self.assertEqual(sleuth.observers, [sleuth.indexes, sleuth.time_index, sleuth.aggregates, sleuth.changes])
+        self.assertEqual([story.id for story in sleuth.query(current_state=u'delivered')], [1, 2])
+
+    def test_process_activities_handler_fails(self, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+        sleuth.journal = MagicMock()
+        sleuth.register_handler('task_create', MagicMock(side_effect=AttributeError('no such child: tasks')))
+        activities = [make_activity(100, 'story_update', 2, '<current_state>finished</current_state>'),
+                      make_activity(101, 'task_create', 2),
+                      make_activity(102, 'story_update', 2, '<current_state>delivered</current_state>')]
+
+        # action
+        stats = sleuth.process_activities(activities)
+
+        # confirm
+        self.assertEqual((stats.applied, stats.failed), (2, 1))
+        self.assertEqual(sleuth.stories[2].current_state, u'delivered')
+        self.assertEqual(sleuth.journal.append.call_count, 2)
+        self.assertIn(102, sleuth.processed_activities)
+        self.assertNotIn(101, sleuth.processed_activities)
+
+    def test_process_v4_activities(self, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+        comments = '<comments><comment><id type="integer">7</id><text>a note</text></comment></comments>'
+        activities_xml = '<activities type="array">%s</activities>' % ''.join([
+            ACTIVITY % {'id': 100, 'event_type': 'comment_create', 'story_id': 2, 'fields': comments,
+                        'project_id': 1},
+            ACTIVITY % {'id': 101, 'event_type': 'comment_delete', 'story_id': 2, 'fields': comments,
+                        'project_id': 1},
+            ACTIVITY % {'id': 102, 'event_type': 'story_update', 'story_id': 2,
+                        'fields': '<current_state>finished</current_state>', 'project_id': 1}])
+        activitiesxml = pt_api.parse_activities([activities_xml], frozenset(sleuth.handlers))
+        subscription = sleuth.changes.subscribe()
+
+        # action
+        stats = sleuth.process_activities(list(activitiesxml.iterchildren()))
+
+        # confirm
+        self.assertEqual(stats.applied, 3)
+        self.assertEqual(sleuth.stories[2].notes, {})
+        self.assertEqual(sleuth.stories[2].current_state, u'finished')
+        self.assertEqual([change.kind for change in subscription.get_batch(timeout=0)],
+                         ['note_added', 'note_removed', 'story_changed'])
+
+    def fetched(self):
+        return [Story(1, 1, u'feature', None, 1, u'accepted', None, u'one', None, None, None, None, None, None,
+                      u'ui'),
+                Story(3, 1, u'chore', None, 0, u'started', None, u'three', None, u'Rob', None, None, None, None,
+                      None)]
+
+    @patch('sleuth.pt_api.get_story_async')
+    def test_reconcile_project(self, get_story_async, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+        story = sleuth.stories[1]
+        subscription = sleuth.changes.subscribe()
+        get_stories_async.side_effect = as_future(MagicMock(return_value=self.fetched()))
+        get_story_async.side_effect = as_future(MagicMock(return_value=None))
+
+        # action
+        stats = sleuth.reconcile_project(1)
+
+        # confirm
+        get_story_async.assert_called_once_with(1, 2, '--token--', STORY_BUILDER, executor=sleuth.executor)
+        self.assertEqual(stats[:7], (1, 2, 1, 1, 1, 0, 0))
+        self.assertIs(sleuth.stories[1], story)
+        self.assertEqual((story.current_state, story.owned_by), (u'accepted', None))
+        self.assertEqual(sorted(sleuth.stories), [1, 3])
+        self.assertEqual([story.id for story in sleuth.query(owned_by=u'Rob')], [3])
+        self.assertEqual(sleuth.check_aggregates(), {})
+        self.assertEqual(sorted(subscription.get_batch(timeout=0)),
+                         [Change('story_added', 3, None, None, None, None),
+                          Change('story_changed', 1, None, 'current_state', u'delivered', u'accepted'),
+                          Change('story_changed', 1, None, 'owned_by', u'Rob', None),
+                          Change('story_removed', 2, None, None, None, None)])
+
+    @patch('sleuth.pt_api.get_story_async')
+    def test_reconcile_project_rollover(self, get_story_async, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+        story = sleuth.stories[1]
+        sleuth.process_activity(make_activity(100, 'story_update', 1, '<current_state>accepted</current_state>'
+                                                                      '<accepted_at>2013/08/07 20:33:30 UTC</accepted_at>'))
+        done_story = story.copy()
+        get_stories_async.side_effect = as_future(MagicMock(return_value=[sleuth.stories[2].copy()]))
+        get_story_async.side_effect = as_future(MagicMock(return_value=done_story))
+
+        # action
+        stats = sleuth.reconcile_project(1)
+        next_stats = sleuth.reconcile_project(1)
+
+        # confirm
+        self.assertEqual(stats[:7], (1, 1, 0, 0, 0, 2, 0))
+        self.assertEqual(next_stats[:7], (1, 1, 0, 0, 0, 1, 0))
+        self.assertEqual(get_story_async.call_count, 1)
+        self.assertIs(sleuth.stories[1], story)
+        self.assertEqual([story.id for story in sleuth.stories_between('accepted_at')], [1])
+        self.assertEqual(sleuth.check_aggregates(), {})
+
+    @patch('sleuth.pt_api.get_story_async')
+    def test_reconcile_project_lookup_fails(self, get_story_async, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+        get_stories_async.side_effect = as_future(MagicMock(return_value=[]))
+        get_story_async.side_effect = as_future(Mock(side_effect=pt_api.PT_APIException))
+
+        # action
+        stats = sleuth.reconcile_project(1)
+
+        # confirm
+        self.assertEqual(stats.skipped, 2)
+        self.assertEqual(sorted(sleuth.stories), [1, 2])
+
+    def test_reconcile_project_unchanged(self, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+        subscription = sleuth.changes.subscribe()
+        get_stories_async.side_effect = as_future(MagicMock(
+            return_value=[sleuth.stories[1].copy(), sleuth.stories[2].copy()]))
+
+        # action
+        stats = sleuth.reconcile_project(1)
+
+        # confirm
+        self.assertEqual(stats[:7], (1, 2, 0, 0, 0, 2, 0))
+        self.assertEqual(subscription.get_batch(timeout=0), [])
+
+    def test_reconcile_project_leaves_stories_changed_while_fetching(self, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+
+        def get_stories(*args, **kwargs):
+            sleuth.process_activity(make_activity(100, 'story_update', 1, '<current_state>rejected</current_state>'))
+            sleuth.process_activity(make_activity(101, 'story_delete', 2))
+            return self.fetched()
+        get_stories_async.side_effect = as_future(get_stories)
+
+        # action
+        stats = sleuth.reconcile_project(1)
+
+        # confirm
+        self.assertEqual(stats.skipped, 1)
+        self.assertEqual(sleuth.stories[1].current_state, u'rejected')
+        self.assertEqual(sorted(sleuth.stories), [1, 3])
+
+    def test_reconcile_project_notes_and_tasks(self, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+        story = sleuth.stories[2]
+        story.add_note(Note(1, u'old', u'Rob', u'2013/08/07'))
+        story.add_note(Note(2, u'kept', u'Rob', u'2013/08/07'))
+        story.add_task(Task(1, u'a task', u'2013/08/07', position=1))
+        story.add_task(Task(2, u'gone', u'2013/08/07', position=2))
+        fetched = story.copy()
+        fetched.notes = {2: Note(2, u'kept', u'Rob', u'2013/08/07'), 3: Note(3, u'new', u'Rob', u'2013/08/08')}
+        fetched.tasks = {1: Task(1, u'a task', u'2013/08/07', position=1, complete=True)}
+        get_stories_async.side_effect = as_future(MagicMock(return_value=[sleuth.stories[1].copy(), fetched]))
+        subscription = sleuth.changes.subscribe()
+
+        # action
+        stats = sleuth.reconcile_project(1)
+
+        # confirm
+        self.assertEqual(stats.changed, 1)
+        self.assertEqual(sorted(story.notes), [2, 3])
+        self.assertEqual(sorted(story.tasks), [1])
+        self.assertTrue(story.tasks[1].complete)
+        self.assertEqual(story.fingerprint(), fetched.fingerprint())
+        self.assertEqual(sorted(change.kind for change in subscription.get_batch(timeout=0)),
+                         ['note_added', 'note_removed', 'task_changed', 'task_removed'])
+
+    def test_reconcile_project_fetch_fails(self, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+        get_stories_async.side_effect = as_future(Mock(side_effect=pt_api.PT_APIException))
+
+        # action / confirm
+        self.assertRaises(pt_api.PT_APIException, sleuth.reconcile_project, 1)
+        self.assertEqual(sorted(sleuth.stories), [1, 2])
+        self.assertEqual(sleuth.observers, [sleuth.indexes, sleuth.time_index, sleuth.aggregates, sleuth.changes])
+
+    @patch('sleuth.pt_api.get_client')
+    def test_reconcile_project_error_message(self, get_client, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+        get_client.return_value.get.return_value = MagicMock(status_code=200, headers={},
+                                                             content='<message>Resource not found</message>')
+        get_stories_async.side_effect = as_future(pt_api.get_stories)
+
+        # action / confirm
+        self.assertRaises(pt_api.PT_APIException, sleuth.reconcile_project, 1)
+        self.assertEqual(sorted(sleuth.stories), [1, 2])
+
+    @patch('sleuth.pt_api.response_cache', pt_api.ResponseCache())
+    @patch('sleuth.pt_api.get_client')
+    def test_reconcile_project_not_modified(self, get_client, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+        iterations = '''<iterations type="array"><iteration><stories type="array">
+          <story><id type="integer">1</id><story_type>feature</story_type><current_state>delivered</current_state>
+            <name>one</name><owned_by>Rob</owned_by><labels>ui</labels></story>
+          <story><id type="integer">2</id><story_type>bug</story_type><current_state>started</current_state>
+            <name>two</name><owned_by>Rob</owned_by></story>
+          <story><id type="integer">3</id><story_type>chore</story_type><current_state>started</current_state>
+            <name>three</name></story>
+        </stories></iteration></iterations>'''
+        get_client.return_value.get.side_effect = [
+            MagicMock(status_code=200, content=iterations, headers={'ETag': '"v1"'}),
+            MagicMock(status_code=304, content='', headers={'ETag': '"v1"'})]
+        get_stories_async.side_effect = as_future(pt_api.get_stories)
+        sleuth.reconcile_project(1)
+        sleuth.stories[3].current_state = u'finished'
+
+        # action
+        stats = sleuth.reconcile_project(1)
+
+        # confirm
+        self.assertEqual(stats[:7], (1, 3, 0, 1, 0, 2, 0))
+        self.assertEqual(sleuth.stories[3].current_state, u'started')
+
+    @patch('sleuth.pt_api.get_story_async')
+    def test_reconcile_next(self, get_story_async, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+        get_stories_async.side_effect = as_future(MagicMock(return_value=[]))
+        get_story_async.side_effect = as_future(MagicMock(return_value=None))
+
+        # action
+        project_ids = [sleuth.reconcile_next().project_id for _ in range(3)]
+
+        # confirm
+        self.assertEqual(project_ids, [1, 2, 1])
+
+    def test_remove_project(self, get_stories_async):
+        # setup
+        sleuth = self.make_sleuth(get_stories_async)
+
+        # action
+        sleuth.remove_project(1)
+
+        # confirm
+        self.assertEqual(sleuth.query(owned_by=u'Rob'), [])
+
+
+class Test_Story(unittest2.TestCase):
+
+    def test_get_data_from_story_xml(self):
+        # setup
+        storyxml = story_xml(
+            '<notes type="array">'
+            '<note><id type="integer">1</id><text>one</text><author>Rob</author><noted_at>2009/03/16</noted_at></note>'
+            '<note><id type="integer">2</id><text>two</text><author>Rob</author><noted_at>2009/03/16</noted_at></note>'
+            '</notes><tasks type="array">'
+            '<task><id type="integer">3</id><description>three</description><position type="integer">1</position>'
+            '<complete type="boolean">false</complete><created_at>2009/03/17</created_at></task>'
+            '<task><id type="integer">4</id><description>four</description><position type="integer">2</position>'
+            '<complete type="boolean">true</complete><created_at>2009/03/17</created_at></task></tasks>',
+            story_type='story_type', current_state='current_state', description='description',
+            requested_by='requested_by', created_at='created_at', labels='labels')
 
         # action
         data = Story.get_data_from_story_xml(storyxml)
@@ -369,23 +1305,127 @@ class Test_Story(unittest2.TestCase):
         self.assertEqual(data['owned_by'], None)
         self.assertEqual(data['accepted_at'], None)
 
-        self.assertEqual(data['notes'][notexml1.id].id, notexml1.id)
-        self.assertEqual(data['notes'][notexml2.id].id, notexml2.id)
+        self.assertEqual(sorted(data['notes']), [1, 2])
+        self.assertEqual(data['notes'][2].text, u'two')
 
-        self.assertEqual(data['tasks'][taskxml1.id].id, taskxml1.id)
-        self.assertEqual(data['tasks'][taskxml2.id].id, taskxml2.id)
+        self.assertEqual(sorted(data['tasks']), [3, 4])
+        self.assertTrue(data['tasks'][4].complete)
+
+    def test_from_fields_matches_create(self):
+        # setup
+        xml = '''<story>
+          <id type="integer">7</id>
+          <story_type>feature</story_type>
+          <estimate type="integer">2</estimate>
+          <current_state>started</current_state>
+          <name>The Save Dialog</name>
+          <owned_by>Rob</owned_by>
+          <labels>a,b</labels>
+          <notes type="array">
+            <note><id type="integer">1</id><text>a note</text><author>Rob</author><noted_at>2009/03/16</noted_at></note>
+          </notes>
+          <tasks type="array">
+            <task><id type="integer">2</id><description>a task</description><position type="integer">1</position>
+                  <complete type="boolean">true</complete><created_at>2009/03/17</created_at></task>
+          </tasks>
+        </story>'''
+        created = Story.create(1, pt_api.objectify(xml))
+
+        # action
+        streamed = list(pt_api.iterparse_stories(io.BytesIO(xml), 1, STORY_BUILDER))[0]
+
+        # confirm
+        for attribute in ['id', 'project_id', 'story_type', 'url', 'estimate', 'current_state', 'description',
+                          'name', 'requested_by', 'owned_by', 'created_at', 'accepted_at', 'labels']:
+            self.assertEqual(getattr(streamed, attribute), getattr(created, attribute))
+        for attribute in Note.__slots__:
+            self.assertEqual(getattr(streamed.notes[1], attribute), getattr(created.notes[1], attribute))
+        for attribute in Task.__slots__:
+            self.assertEqual(getattr(streamed.tasks[2], attribute), getattr(created.tasks[2], attribute))
+
+    def test_fingerprint(self):
+        # setup
+        story = Story(1, 1, u'feature', None, 1, u'started', None, u'one', None, None, None, None, None, None, u'ui')
+        story.add_task(Task(1, u'a task', u'2013/08/07'))
+        same = story.copy()
+        changed_task = story.copy()
+        changed_task.tasks[1].complete = True
+        changed_label = story.copy()
+        changed_label.labels.append(u'api')
+
+        # confirm
+        self.assertEqual(story.fingerprint(), same.fingerprint())
+        self.assertNotEqual(story.fingerprint(), changed_task.fingerprint())
+        self.assertNotEqual(story.fingerprint(), changed_label.fingerprint())
+
+    def test_compact(self):
+        # setup
+        one = Story(1, 1, u'feature', None, 1, u'started', None, u'one', None, None, None, None, None, None, None)
+        two = Story(2, 1, u''.join([u'feat', u'ure']), None, 1, u''.join([u'star', u'ted']), None, u'two', None, None,
+                    None, None, None, None, u'ui')
+
+        # confirm
+        self.assertFalse(hasattr(one, '__dict__'))
+        self.assertIs(one.story_type, two.story_type)
+        self.assertIs(one.current_state, two.current_state)
+        self.assertIs(one.labels, EMPTY_LIST)
+        self.assertIs(one.notes, EMPTY_DICT)
+        self.assertIs(one.tasks, two.tasks)
+        self.assertEqual(one.labels, [])
+        self.assertRaises(TypeError, one.labels.append, u'ui')
+        self.assertRaises(TypeError, one.notes.__setitem__, 1, None)
+
+    def test_interned_fields(self):
+        # setup
+        storyxml = story_xml(story_type='feature', current_state='started', requested_by='Dana Deer',
+                             owned_by='Rob', labels='ui')
+        update_storyxml = story_xml(owned_by='Rob', current_state='finished', labels='ui,api')
+        story = Story.create(1, storyxml)
+        other = Story.create(1, storyxml)
+
+        # action
+        story.update(MagicMock(project_id=1), update_storyxml)
+
+        # confirm
+        self.assertIs(story.requested_by, other.requested_by)
+        self.assertIs(story.owned_by, other.owned_by)
+        self.assertIs(story.labels[0], other.labels[0])
+        note = Note(1, u'a note', u''.join([u'R', u'ob']), u'2009/03/16')
+        self.assertIs(note.author, other.owned_by)
+
+    def test_add_note_and_task(self):
+        # setup
+        story = Story(1, 1, u'feature', None, 1, u'started', None, u'one', None, None, None, None, None, None, None)
+        note = Note(1, u'a note', u'Rob', u'2009/03/16')
+        task = Task(2, u'a task', u'2009/03/17')
+
+        # action
+        added = [story.add_note(note), story.add_note(note), story.add_task(task), story.add_task(task)]
+
+        # confirm
+        self.assertEqual(added, [True, False, True, False])
+        self.assertEqual(story.notes, {1: note})
+        self.assertEqual(story.tasks, {2: task})
+        self.assertEqual(EMPTY_DICT, {})
+
+    def test_pickle_and_copy(self):
+        # setup
+        story = Story(1, 1, u'feature', None, 1, u'started', None, u'one', None, None, None, None, None, None, u'a,b')
+
+        # action
+        pickled = pickle.loads(pickle.dumps(story, pickle.HIGHEST_PROTOCOL))
+        copied = story.copy()
+
+        # confirm
+        for restored in [pickled, copied]:
+            self.assertEqual(restored.labels, [u'a', u'b'])
+            self.assertIs(restored.notes, EMPTY_DICT)
+            self.assertIs(restored.tasks, EMPTY_DICT)
 
     def test_create_with_labels(self):
         # setup
-        storyxml = MagicMock(story_type='story_type', current_state='current_state', description='description',
-                        requested_by='requested_by', created_at='created_at', labels='labels')
-        del storyxml.url
-        del storyxml.estimate
-        del storyxml.name
-        del storyxml.owned_by
-        del storyxml.accepted_at
-        del storyxml.notes
-        del storyxml.tasks
+        storyxml = story_xml(story_type='story_type', current_state='current_state', description='description',
+                             requested_by='requested_by', created_at='created_at', labels='labels')
 
         project_id = 1
 
@@ -398,7 +1438,7 @@ class Test_Story(unittest2.TestCase):
         self.assertEqual(story.description, storyxml.description)
         self.assertEqual(story.requested_by, storyxml.requested_by)
         self.assertEqual(story.created_at, storyxml.created_at)
-        self.assertEqual(story.labels, storyxml.labels.split(','))
+        self.assertEqual(story.labels, ['labels'])
 
         self.assertEqual(story.url, None)
         self.assertEqual(story.estimate, None)
@@ -408,16 +1448,8 @@ class Test_Story(unittest2.TestCase):
 
     def test_create_without_labels(self):
         # setup
-        storyxml = MagicMock(story_type='story_type', current_state='current_state', description='description',
-                        requested_by='requested_by', created_at='created_at')
-        del storyxml.url
-        del storyxml.estimate
-        del storyxml.name
-        del storyxml.owned_by
-        del storyxml.accepted_at
-        del storyxml.labels
-        del storyxml.notes
-        del storyxml.tasks
+        storyxml = story_xml(story_type='story_type', current_state='current_state', description='description',
+                             requested_by='requested_by', created_at='created_at')
 
         project_id = 1
 
@@ -440,31 +1472,14 @@ class Test_Story(unittest2.TestCase):
 
     def test_update_story_details(self):
         # setup
-        storyxml = Mock(story_type='story_type', current_state='current_state', description='description',
-                        requested_by='requested_by', created_at='created_at')
-        del storyxml.url
-        del storyxml.estimate
-        del storyxml.name
-        del storyxml.owned_by
-        del storyxml.accepted_at
-        del storyxml.labels
-        del storyxml.notes
-        del storyxml.tasks
+        storyxml = story_xml(story_type='story_type', current_state='current_state', description='description',
+                             requested_by='requested_by', created_at='created_at')
 
         project_id = 1
         story = Story.create(project_id, storyxml)
         activity = MagicMock(project_id=project_id)
 
-        update_storyxml = MagicMock(story_type='different_story_type', description='new description')
-        del update_storyxml.url
-        del update_storyxml.estimate
-        del update_storyxml.name
-        del update_storyxml.owned_by
-        del update_storyxml.accepted_at
-        del update_storyxml.labels
-        del update_storyxml.current_state
-        del update_storyxml.requested_by
-        del update_storyxml.created_at
+        update_storyxml = story_xml(story_type='different_story_type', description='new description')
 
         # action
         story.update(activity, update_storyxml)
@@ -594,19 +1609,23 @@ class Test_Task(unittest2.TestCase):
 
 @patch('sleuth.Sleuth')
 @patch('sleuth.continue_tracking')
-@patch('sleuth.time.sleep', MagicMock())
+@patch('sleuth.scheduler.time.sleep', MagicMock())
 class Test_main(unittest2.TestCase):
 
     def test(self, continue_tracking, Sleuth):
         # setup
         continue_tracking.side_effect = [True, True, False]
+        Sleuth.return_value.project_ids = [1, 2]
+        Sleuth.return_value.collect_task_updates.return_value = {1: 0, 2: 0}
 
         # action
         main(['--projects', '1', '2', '--token', 'thetoken'])
 
         # confirm
-        Sleuth.assert_called_once_with(project_ids=[1, 2], track_blocks=['current', 'backlog', 'icebox'], token='thetoken', overlap_seconds=10)
-        self.assertListEqual([call(), call()], Sleuth.return_value.collect_task_updates.call_args_list)
+        Sleuth.assert_called_once_with(project_ids=[1, 2], track_blocks=['current', 'backlog', 'icebox'], token='thetoken', overlap_seconds=10, poll_workers=10,
+                                       snapshot_path=None, snapshot_max_age=datetime.timedelta(hours=6), journal=None)
+        # the second poll comes before the projects are due again
+        self.assertListEqual([call([1, 2])], Sleuth.return_value.collect_task_updates.call_args_list)
 
     @patch('sleuth.logging.FileHandler')
     @patch('sleuth.logging.getLogger')
@@ -629,17 +1648,100 @@ class Test_main(unittest2.TestCase):
         # action & confirm
         self.assertRaises(ValueError, main, ['--projects', '1', '2', '--token', 'thetoken', '--log-level', 'blahdeblah'])
 
+    @patch('sleuth.Scheduler')
+    def test_snapshot_file(self, Scheduler, continue_tracking, Sleuth):
+        # action
+        main(['--projects', '1', '--token', 'thetoken', '--snapshot-file', 'sleuth.snapshot', '--snapshot-seconds', '60'])
+
+        # confirm
+        self.assertEqual(Sleuth.call_args[1]['snapshot_path'], 'sleuth.snapshot')
+        Scheduler.return_value.every.assert_any_call(60, Sleuth.return_value.save_snapshot, name='snapshot', delay=60)
+
+    @patch('sleuth.ActivityJournal')
+    @patch('sleuth.Scheduler')
+    def test_journal_dir(self, Scheduler, ActivityJournal, continue_tracking, Sleuth):
+        # action
+        main(['--projects', '1', '--token', 'thetoken', '--journal-dir', 'journal', '--journal-segment-mb', '2'])
+
+        # confirm
+        ActivityJournal.assert_called_once_with('journal', segment_bytes=2 * 1024 * 1024)
+        self.assertEqual(Sleuth.call_args[1]['journal'], ActivityJournal.return_value)
+        Scheduler.return_value.every.assert_any_call(1, ActivityJournal.return_value.sync, name='journal')
+
+    @patch('sleuth.AdaptivePoller')
+    @patch('sleuth.ActivityListener')
+    @patch('sleuth.Scheduler')
+    def test_listen_port(self, Scheduler, ActivityListener, AdaptivePoller, continue_tracking, Sleuth):
+        # action
+        main(['--projects', '1', '--token', 'thetoken', '--listen-port', '8080', '--listen-secret', 's3cret'])
+
+        # confirm
+        ActivityListener.assert_called_once_with(('127.0.0.1', 8080), Sleuth.return_value.process_activity,
+                                                 queue_size=1000, secret='s3cret')
+        ActivityListener.return_value.start.assert_called_once_with()
+        self.assertEqual(AdaptivePoller.call_args[1]['min_interval'], 60)
+        Scheduler.return_value.every.assert_any_call(1, AdaptivePoller.return_value.poll, name='poll')
+
+    @patch('sleuth.AdaptivePoller')
+    @patch('sleuth.Scheduler')
+    def test_adaptive_polling(self, Scheduler, AdaptivePoller, continue_tracking, Sleuth):
+        # action
+        main(['--projects', '1', '--token', 'thetoken', '--max-poll-seconds', '120', '--max-requests-per-second', '2'])
+
+        # confirm
+        args, kwargs = AdaptivePoller.call_args
+        self.assertEqual(args[0], Sleuth.return_value.collect_task_updates)
+        self.assertEqual(kwargs, {'min_interval': 1, 'max_interval': 120, 'max_requests_per_second': 2.0})
+        Scheduler.return_value.every.assert_any_call(1, AdaptivePoller.return_value.poll, name='poll')
+
+    @patch('sleuth.Scheduler')
+    def test_reconcile(self, Scheduler, continue_tracking, Sleuth):
+        # action
+        main(['--projects', '1', '--token', 'thetoken', '--reconcile-seconds', '30'])
+
+        # confirm
+        jobs = dict((job_call[1]['name'], job_call) for job_call in Scheduler.return_value.every.call_args_list)
+        self.assertEqual(jobs['reconcile'][0], (30, Sleuth.return_value.reconcile_next))
+        self.assertEqual(jobs['reconcile'][1]['delay'], 30)
+        self.assertIsNotNone(jobs['reconcile'][1]['executor'])
+
+    @patch('sleuth.AuditLog')
+    def test_audit_log(self, AuditLog, continue_tracking, Sleuth):
+        # setup
+        continue_tracking.side_effect = [False]
+
+        # action
+        main(['--projects', '1', '--token', 'thetoken', '--audit-log', 'audit.log'])
+
+        # confirm
+        AuditLog.assert_called_once_with(Sleuth.return_value.changes, 'audit.log')
+
+    @patch('sleuth.logger')
+    def test_logger_level(self, logger, continue_tracking, Sleuth):
+        # setup
+        continue_tracking.side_effect = [False]
+
+        # action
+        main(['--projects', '1', '--token', 'thetoken', '--log-level', 'warning', '--log-file', os.devnull,
+              '--log-file-level', 'error'])
+
+        # confirm
+        logger.setLevel.assert_called_once_with(logging.WARNING)
+
     @patch('sleuth.sys.argv', ['start-sleuth', '--projects', '1', '2', '--token', 'thetoken'])
     def test_with_sys_args(self, continue_tracking, Sleuth):
         # setup
         continue_tracking.side_effect = [True, True, False]
+        Sleuth.return_value.project_ids = [1, 2]
+        Sleuth.return_value.collect_task_updates.return_value = {1: 0, 2: 0}
 
         # action
         main()
 
         # confirm
-        Sleuth.assert_called_once_with(project_ids=[1, 2], track_blocks=['current', 'backlog', 'icebox'], token='thetoken', overlap_seconds=10)
-        self.assertListEqual([call(), call()], Sleuth.return_value.collect_task_updates.call_args_list)
+        Sleuth.assert_called_once_with(project_ids=[1, 2], track_blocks=['current', 'backlog', 'icebox'], token='thetoken', overlap_seconds=10, poll_workers=10,
+                                       snapshot_path=None, snapshot_max_age=datetime.timedelta(hours=6), journal=None)
+        self.assertListEqual([call([1, 2])], Sleuth.return_value.collect_task_updates.call_args_list)
 
 
 class Test_continue_tracking(unittest2.TestCase):
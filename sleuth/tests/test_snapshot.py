@@ -0,0 +1,69 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest2
+
+from sleuth import snapshot
+
+
+class Test_snapshot(unittest2.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'snapshot')
+
+    def test_save_load(self):
+        # setup
+        state = {'stories': {1: 'story'}, 'last_updated': {'1-v3': datetime.datetime(2013, 8, 7, 20, 33, 30)}}
+
+        # action
+        snapshot.save(self.path, state)
+        loaded_state = snapshot.load(self.path)
+
+        # confirm
+        self.assertEqual(loaded_state['stories'], state['stories'])
+        self.assertEqual(loaded_state['last_updated'], state['last_updated'])
+        self.assertIn('saved_at', loaded_state)
+        self.assertEqual(os.listdir(self.directory), ['snapshot'])
+
+    def test_save_replaces(self):
+        # setup
+        snapshot.save(self.path, {'stories': 1})
+
+        # action
+        snapshot.save(self.path, {'stories': 2})
+
+        # confirm
+        self.assertEqual(snapshot.load(self.path)['stories'], 2)
+        self.assertEqual(os.listdir(self.directory), ['snapshot'])
+
+    def test_load_missing(self):
+        # action / confirm
+        self.assertRaises(snapshot.SnapshotError, snapshot.load, self.path)
+
+    def test_load_other_version(self):
+        # setup
+        with open(self.path, 'wb') as snapshot_file:
+            snapshot_file.write('%s %d 0\n' % (snapshot.MAGIC, snapshot.FORMAT_VERSION + 1))
+
+        # action / confirm
+        self.assertRaises(snapshot.SnapshotError, snapshot.load, self.path)
+
+    def test_load_corrupt(self):
+        # setup
+        snapshot.save(self.path, {'stories': 1})
+        with open(self.path, 'ab') as snapshot_file:
+            snapshot_file.write('corrupt')
+
+        # action / confirm
+        self.assertRaises(snapshot.SnapshotError, snapshot.load, self.path)
+
+    def test_load_stale(self):
+        # setup
+        snapshot.save(self.path, {'stories': 1})
+
+        # action / confirm
+        self.assertRaises(snapshot.SnapshotError, snapshot.load, self.path, datetime.timedelta(0))
+        self.assertEqual(snapshot.load(self.path, datetime.timedelta(hours=1))['stories'], 1)
@@ -0,0 +1,112 @@
+from mock import MagicMock
+import httplib
+import threading
+import unittest2
+
+from sleuth.webhook import ActivityListener
+
+
+ACTIVITY = '''<activity>
+  <id type="integer">%s</id>
+  <event_type>story_update</event_type>
+</activity>'''
+
+
+class Test_ActivityListener(unittest2.TestCase):
+
+    def setUp(self):
+        self.process_activity = MagicMock()
+        self.listener = ActivityListener(('127.0.0.1', 0), self.process_activity, queue_size=1)
+        self.listener.start()
+
+    def tearDown(self):
+        self.listener.stop()
+
+    def post(self, body, path='/'):
+        connection = httplib.HTTPConnection('127.0.0.1', self.listener.server_address[1])
+        connection.request('POST', path, body, {'Content-Type': 'application/xml'})
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        return response
+
+    def test_post(self):
+        # action
+        response = self.post('<?xml version="1.0" encoding="UTF-8"?>\n' + ACTIVITY % 1)
+        self.listener.queue.join()
+
+        # confirm
+        self.assertEqual(response.status, 200)
+        self.assertEqual(self.process_activity.call_args[0][0].id, 1)
+        self.assertEqual(self.listener.received, 1)
+
+    def test_bad_xml(self):
+        # action
+        response = self.post('<html><body>Too many requests')
+
+        # confirm
+        self.assertEqual(response.status, 400)
+        self.assertFalse(self.process_activity.called)
+        self.assertEqual(self.post(ACTIVITY % 1).status, 200)
+
+    def test_secret(self):
+        # setup
+        self.listener.secret = 's3cret'
+
+        # action
+        responses = [self.post(ACTIVITY % 1), self.post(ACTIVITY % 2, '/other'), self.post(ACTIVITY % 3, '/s3cret')]
+        self.listener.queue.join()
+
+        # confirm
+        self.assertEqual([response.status for response in responses], [404, 404, 200])
+        self.assertEqual([call[0][0].id for call in self.process_activity.call_args_list], [3])
+
+    def test_post_activities(self):
+        # setup
+        self.listener.queue.maxsize = 10
+
+        # action
+        response = self.post('<activities>%s%s</activities>' % (ACTIVITY % 1, ACTIVITY % 2))
+        self.listener.queue.join()
+
+        # confirm
+        self.assertEqual(response.status, 200)
+        self.assertEqual([call[0][0].id for call in self.process_activity.call_args_list], [1, 2])
+
+    def test_backpressure(self):
+        # setup
+        processing = threading.Event()
+        release = threading.Event()
+
+        def process_activity(activity):
+            processing.set()
+            release.wait()
+        self.process_activity.side_effect = process_activity
+        self.post(ACTIVITY % 1)
+        processing.wait()
+        queued_response = self.post(ACTIVITY % 2)
+
+        # action
+        rejected_response = self.post(ACTIVITY % 3)
+        release.set()
+        self.listener.queue.join()
+
+        # confirm
+        self.assertEqual(queued_response.status, 200)
+        self.assertEqual(rejected_response.status, 503)
+        self.assertEqual(rejected_response.getheader('Retry-After'), '5')
+        self.assertEqual(self.listener.rejected, 1)
+        self.assertEqual([call[0][0].id for call in self.process_activity.call_args_list], [1, 2])
+
+    def test_processing_problem(self):
+        # setup
+        self.process_activity.side_effect = [Exception, None]
+
+        # action
+        self.post(ACTIVITY % 1)
+        self.listener.queue.join()
+        self.post(ACTIVITY % 2)
+        self.listener.queue.join()
+
+        # confirm
+        self.assertEqual(self.process_activity.call_count, 2)
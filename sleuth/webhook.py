@@ -0,0 +1,133 @@
+""" An HTTP listener for the Pivotal Tracker activity web hook.
+
+    The tracker POSTs the activity xml. The listener parses it, puts it on a
+    bounded queue and answers straight away. A single worker thread takes
+    the activities off the queue, in the order they arrived, and processes
+    them. When the queue is full the listener answers 503 with a
+    Retry-After header, so the tracker backs off instead of the listener
+    running out of memory.
+
+    The listener does not authenticate the tracker, so it only listens on
+    the loopback address unless told otherwise. Given a secret, it only
+    takes the activities POSTed to /<secret>, the url the web hook of the
+    tracker is set up with, and answers 404 to any other.
+"""
+import BaseHTTPServer
+import hmac
+import logging
+import Queue
+import SocketServer
+import threading
+
+import pt_api
+
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        if not self.server.allowed(self.path):
+            self.respond(404)
+            return
+        length = int(self.headers.getheader('content-length', 0))
+        activityxml = pt_api.objectify(self.rfile.read(length))
+        if activityxml is None:
+            self.respond(400)
+            return
+        if activityxml.tag == 'activities':
+            activities = list(activityxml.iterchildren())
+        else:
+            activities = [activityxml]
+        for activity in activities:
+            if not self.server.enqueue(activity):
+                self.respond(503, {'Retry-After': str(self.server.retry_after)})
+                return
+        self.respond(200)
+
+    def respond(self, status, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, log_format, *args):
+        logger.debug(log_format, *args)
+
+
+class ActivityListener(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ Listen on address for activities, and hand them to process_activity
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, process_activity, queue_size=1000,
+                 retry_after=5, secret=None):
+        BaseHTTPServer.HTTPServer.__init__(self, address, ActivityHandler)
+        self.process_activity = process_activity
+        self.retry_after = retry_after
+        self.secret = secret
+        self.queue = Queue.Queue(maxsize=queue_size)
+        self.received = 0
+        self.rejected = 0
+        self._threads = []
+
+    def allowed(self, path):
+        """ Return whether activities POSTed to path are taken
+        """
+        if self.secret is None:
+            return True
+        return hmac.compare_digest(path.split('?', 1)[0], '/' + self.secret)
+
+    def enqueue(self, activity):
+        """ Queue the activity, return False if the queue is full
+        """
+        try:
+            self.queue.put_nowait(activity)
+        except Queue.Full:
+            self.rejected += 1
+            logger.warning('Activity queue is full, rejecting activity %s' %
+                           activity.id)
+            return False
+        self.received += 1
+        return True
+
+    def work(self):
+        """ Process the queued activities, until a None is queued
+        """
+        while True:
+            activity = self.queue.get()
+            try:
+                if activity is None:
+                    return
+                self.process_activity(activity)
+            except Exception:
+                logger.exception('Problem processing activity %s' %
+                                 activity.id)
+            finally:
+                self.queue.task_done()
+
+    def start(self):
+        """ Start listening and processing, in daemon threads
+        """
+        for target in [self.serve_forever, self.work]:
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        logger.info('Listening for activities on %s:%s' %
+                    self.server_address)
+        if self.secret is None and self.server_address[0] != '127.0.0.1':
+            logger.warning('Taking activities from anyone who can reach '
+                           '%s:%s, there is no secret' % self.server_address)
+
+    def stop(self):
+        """ Stop listening, and wait for the queued activities to be processed
+        """
+        self.shutdown()
+        self.server_close()
+        self.queue.put(None)
+        for thread in self._threads:
+            thread.join()